@@ -0,0 +1,228 @@
+import time
+import threading
+from collections import deque
+import numpy as np
+
+
+def _pixels(resolution):
+    width, height = resolution.split("x")
+    return int(width) * int(height)
+
+
+class _CameraQuality:
+    """カメラごとの現在の設定と、制御に使う直近の計測値"""
+    def __init__(self, fps, resolution):
+        self.fps = fps
+        self.resolution = resolution
+        self.history = [] # 下げた設定を元に戻すためのスタック [(kind, 下げる前の値)]
+        self.latencies = deque()
+        self.last_dropped = None
+        self.bad_count = 0
+        self.good_count = 0
+        self.last_change = 0.0
+        self.last_step_up = None
+        self.up_backoff = 1
+
+
+class AdaptiveQualityController:
+    """認識の遅延とフレームの破棄数を監視し、カメラのFPSと解像度を自動で調整するクラス
+
+    observe() には受信から認識結果の通知までの時間 (秒) をフレームごとに渡す。
+    interval 秒ごとに直近 window 秒の遅延のp90と、dropped(camera_id) が返す破棄数の増分を見て判断する。
+
+    - 破棄が出ている (処理が到着に追いついていない) 場合はFPSを1段階下げる。
+    - 破棄はないが遅延が目標を超える (1フレームの処理が遅い) 場合は解像度を1段階下げる。
+    - 遅延が目標の up_ratio 倍未満で破棄のない状態が up_hold 回続いたら、最後に下げた設定を1段階戻す。
+      直近の最小遅延を1フレームの処理時間とみなし、戻した後の稼働率 (FPS × 処理時間 / parallelism) が
+      max_utilization を超えそうな場合は戻さない。
+
+    下げる判断は down_hold 回続いた場合だけ行い、設定を変えた後は settle_sec 秒の間判断しない。
+    戻した直後に再び下げることになった場合は、次に戻すまでの待ちを倍にする (最大 max_backoff 倍)。
+    上限は手動で選んだ設定 (add_camera() / reset() で渡した値) で、それより高い設定にはしない。
+    apply_fps(camera_id, fps) / apply_resolution(camera_id, resolution) は制御スレッドから呼ばれる。
+    """
+    def __init__(self, apply_fps, apply_resolution, dropped, logger, target_latency,
+                 fps_steps, resolution_steps, interval=1.0, window=3.0, settle_sec=3.0,
+                 up_ratio=0.5, up_hold=5, down_hold=2, max_backoff=8, max_utilization=0.8, parallelism=1,
+                 is_active=None):
+        self.apply_fps = apply_fps
+        self.apply_resolution = apply_resolution
+        self.dropped = dropped
+        self.logger = logger
+        self.target_latency = target_latency
+        self.fps_steps = list(fps_steps)
+        self.resolution_steps = sorted(resolution_steps, key=_pixels)
+        self.interval = interval
+        self.window = window
+        self.settle_sec = settle_sec
+        self.up_ratio = up_ratio
+        self.up_hold = up_hold
+        self.down_hold = down_hold
+        self.max_backoff = max_backoff
+        self.max_utilization = max_utilization
+        self.parallelism = parallelism
+        self.is_active = is_active or (lambda camera_id: True)
+        self.adjust_count = 0
+
+        self._cameras = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add_camera(self, camera_id, fps, resolution):
+        with self._lock:
+            self._cameras[camera_id] = _CameraQuality(fps, resolution)
+
+    def reset(self, camera_id, fps=None, resolution=None):
+        """手動で設定が変更された時に呼ぶ。渡した値を新しい上限とし、下げた履歴を破棄する"""
+        with self._lock:
+            state = self._cameras[camera_id]
+            if fps is not None:
+                state.fps = fps
+            if resolution is not None:
+                state.resolution = resolution
+            state.history = []
+            state.up_backoff = 1
+            state.last_step_up = None
+            self._restart_measurement(state, time.monotonic())
+
+    def observe(self, camera_id, latency):
+        """1フレームの受信から認識結果までの時間 (秒) を記録する"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._cameras.get(camera_id)
+            if state is None or now - state.last_change < self.settle_sec:
+                return # 設定変更前に受信したフレームは判断に使わない
+            state.latencies.append((now, latency))
+
+    def current(self, camera_id):
+        """カメラの現在の (fps, resolution) を返す"""
+        with self._lock:
+            state = self._cameras[camera_id]
+            return state.fps, state.resolution
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="adaptive-quality", daemon=True)
+        self._thread.start()
+        self.logger.info(f"FPS・解像度の自動調整を開始しました (目標遅延 {self.target_latency * 1000:.0f} ms)。")
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout=2.0)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            for camera_id in list(self._cameras):
+                try:
+                    self.evaluate(camera_id)
+                except Exception as e:
+                    self.logger.error(f"FPS・解像度の自動調整中にエラーが発生しました ({camera_id}): {e}")
+
+    @staticmethod
+    def _restart_measurement(state, now):
+        state.latencies.clear()
+        state.last_dropped = None
+        state.bad_count = 0
+        state.good_count = 0
+        state.last_change = now
+
+    def evaluate(self, camera_id):
+        """直近の計測値から設定を変えるか判断する (制御スレッドから interval 秒ごとに呼ばれる)"""
+        now = time.monotonic()
+        if not self.is_active(camera_id):
+            with self._lock:
+                self._restart_measurement(self._cameras[camera_id], now)
+            return
+        dropped_total = self.dropped(camera_id)
+        change = None
+        with self._lock:
+            state = self._cameras[camera_id]
+            if now - state.last_change < self.settle_sec:
+                return
+            while state.latencies and now - state.latencies[0][0] > self.window:
+                state.latencies.popleft()
+            dropped = 0 if state.last_dropped is None else dropped_total - state.last_dropped
+            state.last_dropped = dropped_total
+            if not state.latencies:
+                return
+            samples = [v for _, v in state.latencies]
+            latency = float(np.percentile(samples, 90))
+
+            if dropped > 0 or latency > self.target_latency:
+                state.good_count = 0
+                state.bad_count += 1
+                if state.bad_count >= self.down_hold:
+                    change = self._step_down(state, dropped > 0)
+                    if change and state.last_step_up is not None and now - state.last_step_up < self.settle_sec + self.window * 2:
+                        # 戻した設定に処理が追いつかなかったので、次に戻すまでの待ちを長くする
+                        state.up_backoff = min(state.up_backoff * 2, self.max_backoff)
+                    state.bad_count = 0
+            elif latency < self.target_latency * self.up_ratio and state.history:
+                state.bad_count = 0
+                state.good_count += 1
+                if state.good_count >= self.up_hold * state.up_backoff:
+                    change = self._step_up(state, latency, min(samples))
+                    state.good_count = 0
+            else:
+                state.bad_count = 0
+                state.good_count = 0
+
+            if state.last_step_up is not None and now - state.last_step_up > self.window * 10:
+                state.up_backoff = 1 # 戻した設定で安定している
+                state.last_step_up = None
+            if change:
+                state.last_step_up = now if change[2] == "up" else None
+                self._restart_measurement(state, now)
+
+        if change:
+            self._apply(camera_id, change, latency, dropped)
+
+    def _step_down(self, state, dropped):
+        """FPS (破棄が出ている場合) または解像度を1段階下げる。下げられなければNone"""
+        order = ("fps", "resolution") if dropped else ("resolution", "fps")
+        for kind in order:
+            lower = self._neighbor(kind, getattr(state, kind), -1)
+            if lower is not None:
+                state.history.append((kind, getattr(state, kind)))
+                setattr(state, kind, lower)
+                return kind, lower, "down"
+        return None
+
+    def _step_up(self, state, latency, service_time):
+        """最後に下げた設定を1段階戻す。戻すと目標遅延か処理能力を超えそうなら戻さない"""
+        kind, value = state.history[-1]
+        fps = float(value if kind == "fps" else state.fps)
+        scale = _pixels(value) / _pixels(state.resolution) if kind == "resolution" else 1.0
+        if latency * scale > self.target_latency:
+            return None
+        if fps * service_time * scale / self.parallelism > self.max_utilization:
+            return None
+        state.history.pop()
+        setattr(state, kind, value)
+        return kind, value, "up"
+
+    def _neighbor(self, kind, value, direction):
+        steps = self.fps_steps if kind == "fps" else self.resolution_steps
+        if value not in steps:
+            return None
+        index = steps.index(value) + direction
+        if 0 <= index < len(steps):
+            return steps[index]
+        return None
+
+    def _apply(self, camera_id, change, latency, dropped):
+        kind, value, direction = change
+        self.adjust_count += 1
+        label = "FPS" if kind == "fps" else "解像度"
+        verb = "下げます" if direction == "down" else "戻します"
+        self.logger.info(
+            f"{label}を{value}に{verb} ({camera_id}, 遅延p90 {latency * 1000:.0f} ms, 破棄 {dropped} フレーム)。"
+        )
+        if kind == "fps":
+            self.apply_fps(camera_id, value)
+        else:
+            self.apply_resolution(camera_id, value)
@@ -0,0 +1,160 @@
+import time
+import asyncio
+import threading
+import websockets
+
+
+class AsyncCameraClient:
+    """1台のカメラとのWebSocket接続を asyncio のタスクとして維持するクラス
+
+    コールバックは WebSocketClient と同じ引数で、イベントループのスレッドから呼ばれる。
+    イベントループを止めないよう、コールバックではキューに積むなどの軽い処理だけを行うこと。
+    """
+    STABLE_CONNECTION_SEC = 5.0 # この時間以上続いた接続が切れた場合は待たずに再接続する
+
+    def __init__(self, camera_id, url, on_message, on_error, on_close, on_open, logger, initial_backoff=0.5, max_backoff=30.0):
+        self.camera_id = camera_id
+        self.url = url
+        self.on_message_callback = on_message
+        self.on_error_callback = on_error
+        self.on_close_callback = on_close
+        self.on_open_callback = on_open
+        self.logger = logger
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.backoff = initial_backoff
+        self.is_connected = False
+        self.reconnect_count = 0
+        self.ws = None
+        self.task = None
+
+    async def run(self):
+        """接続・受信・再接続を繰り返す (タスクがキャンセルされるまで終わらない)"""
+        while True:
+            opened_at = None
+            try:
+                async with websockets.connect(self.url, max_size=None, open_timeout=10) as ws:
+                    self.ws = ws
+                    self.is_connected = True
+                    opened_at = time.monotonic()
+                    self.logger.info(f"WebSocketに接続しました ({self.url})。 (AsyncCameraClient)")
+                    self.on_open_callback(ws)
+                    try:
+                        async for message in ws:
+                            self.on_message_callback(ws, message)
+                    except websockets.ConnectionClosed:
+                        pass
+                    self.is_connected = False
+                    self.logger.warning(f"WebSocket接続が閉じられました ({self.url})。コード: {ws.close_code}, メッセージ: {ws.close_reason}")
+                    self.on_close_callback(ws, ws.close_code, ws.close_reason)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.is_connected = False
+                self.logger.error(f"WebSocketエラー (AsyncCameraClient {self.url}): {e}")
+                self.on_error_callback(self.ws, e)
+            finally:
+                self.is_connected = False
+                self.ws = None
+
+            if opened_at is not None and time.monotonic() - opened_at >= self.STABLE_CONNECTION_SEC:
+                # 安定していた接続が切れた場合はすぐに再接続する
+                self.backoff = self.initial_backoff
+                delay = 0
+            else:
+                delay = self.backoff
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+            if delay:
+                self.logger.info(f"{delay:.1f}秒後に再接続を試みます ({self.url})。")
+                await asyncio.sleep(delay)
+            self.logger.warning(f"WebSocketが切断されました。再接続を試みます ({self.url})...")
+            self.reconnect_count += 1
+
+    async def send(self, message):
+        if self.ws is None or not self.is_connected:
+            self.logger.warning(f"WebSocketが接続されていません ({self.url})。メッセージ '{message}' の送信をスキップします。")
+            return
+        try:
+            await self.ws.send(message)
+            self.logger.debug(f"WebSocketにメッセージを送信: {message}")
+        except Exception as e:
+            self.logger.error(f"WebSocket送信エラー: {e}")
+
+
+class AsyncIngest:
+    """複数カメラのWebSocket接続を1つの asyncio イベントループで扱う受信層
+
+    ConnectionManager と同じインターフェースを持ち、カメラが増えてもスレッド数は増えない。
+    接続が切れるとポーリングを待たずに再接続し、失敗が続く場合は指数バックオフで間隔を空ける。
+    受信したバイナリフレームは on_message コールバック (FramePipeline.submit) でキューに積むだけにし、
+    デコードや認識はイベントループの外 (パイプラインのスレッドと認識ワーカー) で行う。
+    """
+    def __init__(self, logger, initial_backoff=0.5, max_backoff=30.0):
+        self.logger = logger
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.clients = {}
+        self._loop = None
+        self._thread = None
+
+    def add(self, camera_id, url, on_message, on_error, on_close, on_open):
+        """カメラを追加する。コールバックは WebSocketClient と同じ引数で呼ばれる"""
+        self.clients[camera_id] = AsyncCameraClient(
+            camera_id, url, on_message, on_error, on_close, on_open, self.logger,
+            initial_backoff=self.initial_backoff, max_backoff=self.max_backoff
+        )
+
+    def is_connected(self, camera_id):
+        return self.clients[camera_id].is_connected
+
+    def connect_all(self):
+        """イベントループのスレッドを起動し、全カメラの接続タスクを開始する"""
+        if self._thread is None or not self._thread.is_alive():
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="async-ingest", daemon=True)
+            self._thread.start()
+            self.logger.info("AsyncIngestのイベントループを開始しました。")
+        self._loop.call_soon_threadsafe(self._start_clients)
+
+    def _start_clients(self):
+        for client in self.clients.values():
+            if client.task is None or client.task.done():
+                client.task = self._loop.create_task(client.run())
+
+    def send(self, camera_id, message):
+        """メッセージを送信する。どのスレッドから呼んでもブロックしない"""
+        client = self.clients.get(camera_id)
+        if client is None:
+            self.logger.error(f"不明なカメラです: {camera_id}")
+            return
+        if self._loop is None or self._loop.is_closed():
+            self.logger.warning(f"WebSocketが接続されていません ({client.url})。メッセージ '{message}' の送信をスキップします。")
+            return
+        self._loop.call_soon_threadsafe(lambda: self._loop.create_task(client.send(message)))
+
+    async def _stop_clients(self):
+        tasks = [client.task for client in self.clients.values() if client.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for client in self.clients.values():
+            client.task = None
+
+    def close_all(self):
+        """全カメラの接続を閉じ、イベントループのスレッドを終了する"""
+        if self._thread is None:
+            return
+        future = asyncio.run_coroutine_threadsafe(self._stop_clients(), self._loop)
+        try:
+            future.result(timeout=5.0)
+        except Exception as e:
+            self.logger.error(f"WebSocket接続の終了中にエラーが発生しました: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=2.0)
+        if self._thread.is_alive():
+            self.logger.warning("AsyncIngestのイベントループがタイムアウト後も終了していません。")
+        else:
+            self._loop.close()
+            self.logger.info("AsyncIngestのイベントループを終了しました。")
+        self._thread = None
+        self._loop = None
@@ -0,0 +1,71 @@
+import numpy as np
+import dlib
+import face_recognition.api as face_recognition_api
+from stage_timer import NullTimer
+
+CHIP_SIZE = 150 # face_recognition.face_encodings が内部で使う位置合わせ画像のサイズと余白
+CHIP_PADDING = 0.25
+
+
+def face_chips(image, face_locations):
+    """顔の特徴点を求め、エンコード用に位置合わせした顔画像 (150x150) のリストを返す
+
+    face_recognition.face_encodings(image, face_locations) と同じ5点の特徴点と切り出し方を使うため、
+    compute_descriptors() の結果は face_encodings() と一致する。
+    """
+    if not face_locations:
+        return []
+    landmarks = face_recognition_api._raw_face_landmarks(image, face_locations, model="small")
+    return [dlib.get_face_chip(image, shape, size=CHIP_SIZE, padding=CHIP_PADDING) for shape in landmarks]
+
+
+def compute_descriptors(chips):
+    """位置合わせした顔画像のエンコーディングを1回の呼び出しでまとめて計算する"""
+    if not chips:
+        return []
+    encoder = face_recognition_api.face_encoder
+    try:
+        descriptors = encoder.compute_face_descriptor(chips)
+    except TypeError:  # 顔画像のリストを受け付けない古いdlib
+        descriptors = [encoder.compute_face_descriptor(chip) for chip in chips]
+    return [np.array(d) for d in descriptors]
+
+
+def recognize_batch(items, gallery, timer=None):
+    """複数のフレーム (カメラが異なってもよい) の顔をまとめてエンコード・照合する
+
+    items は (FaceRecognizer, フレーム) のリストで、同じ FaceRecognizer が複数回含まれてもよい (順番に処理される)。
+    前処理・検出は各 FaceRecognizer で行い、顔画像を集めてエンコードを1回、照合を1回の行列演算で行ってから
+    フレームごとに結果を戻す。(FaceMatchのリスト, エラー) のリストを items と同じ順で返す。
+    エンコードと照合の時間は timer の encode_batch / match_batch に1バッチ1件として記録する。
+    """
+    timer = timer or NullTimer()
+    prepared = []
+    for recognizer, frame in items:
+        try:
+            prepared.append((recognizer.prepare(frame, extract_chips=True), None))
+        except Exception as e:
+            prepared.append((None, e))
+
+    chips = [chip for p, _ in prepared if p is not None for chip in p.chips]
+    face_encodings, matches = [], []
+    if chips:
+        with timer.time("encode_batch"):
+            face_encodings = compute_descriptors(chips)
+        with timer.time("match_batch"):
+            matches = gallery.match(face_encodings)
+
+    results = []
+    offset = 0
+    for (recognizer, _), (p, error) in zip(items, prepared):
+        if p is None:
+            results.append(([], error))
+            continue
+        count = len(p.chips)
+        try:
+            results.append((recognizer.finish(p, face_encodings[offset:offset + count], matches[offset:offset + count]), None))
+        except Exception as e:
+            results.append(([], e))
+        offset += count
+    return results
+
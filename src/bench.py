@@ -0,0 +1,616 @@
+"""顔認識パイプラインのベンチマーク
+
+使用例:
+    python src/bench.py workers --images ./frames --workers 0 1 2 4
+    python src/bench.py preprocess --resolution 320x240
+    python src/bench.py gallery --identities 1000 --per-identity 20
+    python src/bench.py roi --images ./frames --min-face-ratio 0.1 0.15 0.25
+    python src/bench.py batch --images ./frames --cameras 4 --batch-sizes 1 2 4 8
+    python src/bench.py replay --recording ./recordings/cam0_20240518_100000.frames
+    python src/bench.py startup --runs 5
+    python src/bench.py enroll --images ./photos --count 10000 --workers 1 2 4 8
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+import cv2
+import numpy as np
+from encoding_store import EncodingStore
+from face_gallery import FaceGallery, IdentityGallery, UNKNOWN_NAME
+from recognizer import FaceRecognizer
+from batch_encoder import recognize_batch
+from recognition_pool import RecognitionPool
+from preprocess import Preprocessor
+from detectors import DETECTOR_STRATEGIES, HogDetector, PyramidHogDetector, create_detector
+from frame_pipeline import FramePipeline
+from frame_recorder import read_frames, replay
+from enroll import list_images, enroll_files
+from stage_timer import LatencyRecorder
+from drawing import draw_faces
+from tracker import iou
+
+RESOLUTIONS = ["160x120", "176x144", "240x176", "240x240", "320x240"] # ESP32-CAMで選択できる解像度
+MAX_IN_FLIGHT = 4 # 最速で再生する場合にパイプライン内に同時に入れるフレーム数
+STARTUP_PHASES = ["app_import", "service_init", "import", "model_load", "gallery_load", "ready"]
+REPLAY_STAGES = ["decode", "rotate", "preprocess", "detect", "encode", "match", "track", "draw"]
+
+
+def load_frames(images_dir, count, resolution="320x240"):
+    """ベンチマーク用のフレームを用意する。画像ディレクトリがなければ乱数画像を生成する"""
+    frames = []
+    if images_dir:
+        for filename in sorted(os.listdir(images_dir)):
+            if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
+                img = cv2.imread(os.path.join(images_dir, filename), cv2.IMREAD_COLOR)
+                if img is not None:
+                    frames.append(img)
+    if not frames:
+        width, height = (int(v) for v in resolution.split("x"))
+        rng = np.random.default_rng(0)
+        # ESP32-CAMのフレームは受信後に90度回転されるため縦長になる
+        frames = [rng.integers(0, 256, (width, height, 3), dtype=np.uint8) for _ in range(8)]
+    return [frames[i % len(frames)] for i in range(count)]
+
+
+def bench_workers(args, logger):
+    """ワーカー数ごとの認識スループット (frames/sec) を計測する"""
+    encodings, names = EncodingStore(args.cache_dir, logger).load_cached()
+    gallery = FaceGallery(encodings, names, args.threshold)
+    frames = load_frames(args.images, args.frames, args.resolution)
+    max_frame_bytes = max(f.nbytes for f in frames)
+    print(f"frames={len(frames)} known_faces={len(names)}")
+    print(f"{'workers':>8} {'fps':>10} {'speedup':>8}")
+
+    baseline = None
+    for num_workers in args.workers:
+        if num_workers == 0:
+            recognizer = FaceRecognizer(gallery)
+            start = time.perf_counter()
+            for frame in frames:
+                recognizer.recognize(frame)
+            elapsed = time.perf_counter() - start
+        else:
+            done = threading.Event()
+            received = []
+
+            def on_result(camera_id, frame, results, context):
+                received.append(results)
+                if len(received) == len(frames):
+                    done.set()
+
+            pool = RecognitionPool(num_workers, gallery, on_result, logger, max_frame_bytes)
+            pool.start()
+            # ワーカーの起動とモデル読み込みが終わるまで計測しない
+            pool.submit("bench", frames[0])
+            while pool.pending_count():
+                time.sleep(0.01)
+            received.clear()
+
+            start = time.perf_counter()
+            for frame in frames:
+                pool.submit("bench", frame)
+            done.wait()
+            elapsed = time.perf_counter() - start
+            pool.stop()
+
+        fps = len(frames) / elapsed
+        if baseline is None:
+            baseline = fps
+        print(f"{num_workers:>8} {fps:>10.2f} {fps / baseline:>7.2f}x")
+
+
+def _legacy_preprocess(frame):
+    """変更前の前処理 (ステップごとに配列を確保し、LUTを毎回作り直す)"""
+    gray = cv2.cvtColor(frame.copy(), cv2.COLOR_BGR2GRAY)
+    denoised = cv2.GaussianBlur(gray, (5, 5), 0)
+    equalized = cv2.equalizeHist(denoised)
+    table = np.array([((i / 255.0) ** (1.0 / 1.5)) * 255 for i in np.arange(0, 256)]).astype("uint8")
+    gamma_corrected = cv2.LUT(equalized, table)
+    return gamma_corrected, cv2.cvtColor(gamma_corrected, cv2.COLOR_GRAY2BGR)
+
+
+def _measure(func, frames):
+    """1フレームあたりの処理時間 (ms) と確保メモリ量 (バイト) を計測する"""
+    for frame in frames[:5]:
+        func(frame)  # バッファの確保を計測から除く
+
+    start = time.perf_counter()
+    for frame in frames:
+        func(frame)
+    elapsed_ms = (time.perf_counter() - start) * 1000 / len(frames)
+
+    tracemalloc.start()
+    allocated = 0
+    for frame in frames:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        func(frame)
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return elapsed_ms, allocated / len(frames)
+
+
+def bench_preprocess(args, logger):
+    """前処理の変更前後で1フレームあたりの時間とメモリ確保量を比較する"""
+    frames = load_frames(args.images, args.frames, args.resolution)
+    preprocessor = Preprocessor()
+    print(f"frames={len(frames)} shape={frames[0].shape}")
+    print(f"{'method':>10} {'ms/frame':>10} {'alloc/frame':>14}")
+    for label, func in (("legacy", _legacy_preprocess), ("fused", preprocessor.run)):
+        elapsed_ms, allocated = _measure(func, frames)
+        print(f"{label:>10} {elapsed_ms:>10.3f} {allocated:>12.0f} B")
+
+
+def _synthetic_identities(rng, count):
+    """疑似的な人物ごとの (エンコーディングの中心, ばらつき) を生成する
+
+    同じ人物の写真同士の距離が 0.3〜0.5 程度、別人同士が 1.0 程度になるようにする。
+    人物ごとにばらつきを変え、写真の写りが安定している人と安定していない人を混ぜる。
+    """
+    centers = rng.normal(0, 0.06, (count, 128))
+    spreads = rng.uniform(0.015, 0.03, count)
+    return centers, spreads
+
+
+def bench_gallery(args, logger):
+    """全エンコーディングとの照合 (FaceGallery) と代表点での照合 (IdentityGallery) の速度と精度を比較する"""
+    rng = np.random.default_rng(0)
+    centers, spreads = _synthetic_identities(rng, args.identities)
+    names = [f"person{i}" for i in range(args.identities)]
+    encodings = np.concatenate([c + rng.normal(0, s, (args.per_identity, 128)) for c, s in zip(centers, spreads)])
+    gallery_names = [name for name in names for _ in range(args.per_identity)]
+
+    # 半分は登録済みの人物の新しい写真、残りは未登録の人物
+    known = rng.integers(0, args.identities, args.queries // 2)
+    queries = [centers[i] + rng.normal(0, spreads[i], 128) for i in known]
+    unseen_centers, unseen_spreads = _synthetic_identities(rng, args.queries - len(known))
+    queries += [c + rng.normal(0, s, 128) for c, s in zip(unseen_centers, unseen_spreads)]
+    expected = [names[i] for i in known] + [UNKNOWN_NAME] * len(unseen_centers)
+
+    start = time.perf_counter()
+    flat = FaceGallery(encodings, gallery_names, args.threshold, ann_threshold=args.ann_threshold)
+    flat_build = time.perf_counter() - start
+    start = time.perf_counter()
+    identity = IdentityGallery(encodings, gallery_names, args.threshold, medoids=args.medoids)
+    identity_build = time.perf_counter() - start
+    print(f"encodings={len(encodings)} identities={args.identities} prototypes={identity.prototype_count} queries={len(queries)}")
+    print(f"{'gallery':>10} {'build s':>8} {'ms/query':>9} {'accuracy':>9} {'fallback':>9}")
+
+    for label, gallery, build in (("flat", flat, flat_build), ("identity", identity, identity_build)):
+        start = time.perf_counter()
+        results = [gallery.match([q])[0] for q in queries]
+        elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        accuracy = np.mean([name == e for (name, _), e in zip(results, expected)])
+        fallback = "-"
+        if gallery is identity:
+            fallback = f"{np.mean([identity.match_detailed([q])[1][0] for q in queries]):.1%}"
+        print(f"{label:>10} {build:>8.2f} {elapsed_ms:>9.3f} {accuracy:>9.1%} {fallback:>9}")
+
+
+def _roi_modes(args):
+    """比較する (名前, FaceRecognizerのオプション) のリスト"""
+    modes = [("hog", {"detector": HogDetector()}), ("hog+crop", {"detector": HogDetector(), "encode_crops": True})]
+    for ratio in args.min_face_ratio:
+        modes.append((f"pyr{ratio:g}", {"detector": PyramidHogDetector(ratio)}))
+        modes.append((f"pyr{ratio:g}+crop", {"detector": PyramidHogDetector(ratio), "encode_crops": True}))
+    return modes
+
+
+def _agreement(reference, results, scale_y, scale_x):
+    """基準の結果に対する検出の再現率と、対応した顔の名前の一致数を返す"""
+    found = named = 0
+    for ref in reference:
+        top, right, bottom, left = ref.location
+        box = (top * scale_y, right * scale_x, bottom * scale_y, left * scale_x)
+        best = max(results, key=lambda m: iou(box, m.location), default=None)
+        if best is not None and iou(box, best.location) >= 0.5:
+            found += 1
+            named += best.name == ref.name
+    return found, named
+
+
+def bench_roi(args, logger):
+    """検出用の縮尺と元フレームからの切り出しエンコードを、ESP32の解像度ごとに速度と精度で比較する
+
+    基準は元の画像の解像度で2倍に拡大してHOG検出し、元の画像から切り出してエンコードした結果。
+    登録写真は前処理せずにエンコードしているため、名前の基準も同じ条件でエンコードしたものにする。
+    各解像度・方式で基準の顔をいくつ検出できたか (recall) と、そのうち名前が一致した割合を表示する。
+    """
+    encodings, names = EncodingStore(args.cache_dir, logger).load_cached()
+    gallery = FaceGallery(encodings, names, args.threshold)
+    images = load_frames(args.images, args.frames)
+    originals = [cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE) for img in images]
+    reference_recognizer = FaceRecognizer(gallery, encode_crops=True)
+    references = [reference_recognizer.recognize(frame) for frame in originals]
+    total = sum(len(r) for r in references)
+    print(f"frames={len(images)} reference_faces={total} known_faces={len(names)} min_face_ratio={' '.join(f'{r:g}' for r in args.min_face_ratio)}")
+    print(f"{'resolution':>10} {'mode':>14} {'ms/frame':>9} {'detect':>8} {'encode':>8} {'recall':>7} {'name':>6}")
+
+    for resolution in args.resolutions:
+        width, height = (int(v) for v in resolution.split("x"))
+        frames = [
+            cv2.rotate(cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA), cv2.ROTATE_90_COUNTERCLOCKWISE)
+            for img in images
+        ]
+        for label, options in _roi_modes(args):
+            timer = LatencyRecorder()
+            recognizer = FaceRecognizer(gallery, timer=timer, **options)
+            found = named = 0
+            start = time.perf_counter()
+            for frame, original, reference in zip(frames, originals, references):
+                results = recognizer.recognize(frame)
+                f, n = _agreement(reference, results, frame.shape[0] / original.shape[0], frame.shape[1] / original.shape[1])
+                found += f
+                named += n
+            elapsed_ms = (time.perf_counter() - start) * 1000 / len(frames)
+            detect = timer.percentiles("detect", (50,))
+            encode = timer.percentiles("encode", (50,))
+            recall = f"{found / total:.1%}" if total else "-"
+            name_rate = f"{named / found:.1%}" if found else "-"
+            print(
+                f"{resolution:>10} {label:>14} {elapsed_ms:>9.2f} {detect[0]:>8.2f} "
+                f"{encode[0] if encode else 0.0:>8.2f} {recall:>7} {name_rate:>6}"
+            )
+
+
+def bench_batch(args, logger):
+    """複数カメラのフレームをまとめてエンコード・照合した場合のスループットを、バッチサイズごとに計測する
+
+    フレームはカメラ間で順番に並べ、先頭から batch_size 枚ずつ処理する (到着を待つ時間は含まない)。
+    """
+    encodings, names = EncodingStore(args.cache_dir, logger).load_cached()
+    gallery = FaceGallery(encodings, names, args.threshold)
+    frames = load_frames(args.images, args.frames, args.resolution)
+    print(f"frames={len(frames)} cameras={args.cameras} known_faces={len(names)}")
+    print(f"{'batch':>6} {'fps':>10} {'speedup':>8} {'faces/batch':>12} {'encode ms/face':>15}")
+
+    baseline = None
+    for batch_size in args.batch_sizes:
+        timer = LatencyRecorder()
+        recognizers = [FaceRecognizer(gallery, timer=timer) for _ in range(args.cameras)]
+        items = [(recognizers[i % args.cameras], frame) for i, frame in enumerate(frames)]
+        for recognizer, frame in items[:args.cameras]:
+            recognizer.recognize(frame)  # モデルの読み込みを計測から除く
+        timer.reset()
+
+        faces = 0
+        start = time.perf_counter()
+        if batch_size == 1:
+            for recognizer, frame in items:
+                faces += len(recognizer.recognize(frame))
+            encode_stage = "encode"
+        else:
+            for i in range(0, len(items), batch_size):
+                faces += sum(len(results) for results, _ in recognize_batch(items[i:i + batch_size], gallery, timer))
+            encode_stage = "encode_batch"
+        elapsed = time.perf_counter() - start
+
+        fps = len(frames) / elapsed
+        if baseline is None:
+            baseline = fps
+        batches = -(-len(frames) // batch_size)
+        encode_ms = timer.total(encode_stage) * 1000 / faces if faces else 0.0
+        print(f"{batch_size:>6} {fps:>10.2f} {fps / baseline:>7.2f}x {faces / batches:>12.2f} {encode_ms:>15.3f}")
+
+
+def _reset_peak_rss():
+    """ピークRSSの記録をリセットする (Linuxのみ)。リセットできたかを返す"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    """プロセスのピークRSS (MB) を返す。取得できなければNone"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _replay_source(args):
+    """再生するフレーム (受信時刻, JPEGバイト列) を用意する。記録ファイルがなければ画像から作る"""
+    if args.recording:
+        frames = list(read_frames(args.recording))
+        if args.frames:
+            frames = frames[:args.frames]
+        return frames
+    images = load_frames(args.images, args.frames or 200)
+    # 記録がない場合は10FPSで受信したものとして扱う
+    return [(i / 10, cv2.imencode(".jpg", img)[1].tobytes()) for i, img in enumerate(images)]
+
+
+def _scale_recording(frames, resolution):
+    """記録したフレームを指定した解像度のJPEGに変換する (ESP32-CAMの解像度変更の代わり)"""
+    width, height = (int(v) for v in resolution.split("x"))
+    scaled = []
+    for timestamp, jpeg_bytes in frames:
+        img = cv2.imdecode(np.frombuffer(jpeg_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            continue
+        img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+        scaled.append((timestamp, cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()))
+    return scaled
+
+
+def _replay_resolution(frames, gallery, args, logger):
+    """1つの解像度でフレームをパイプラインに流し、処理時間・FPS・破棄数・ピークRSSを計測する"""
+    timer = LatencyRecorder()
+    recognizer = FaceRecognizer(gallery, detector=create_detector(args.detector, args.cascade), timer=timer)
+    lock = threading.Lock()
+    finished = {"recognized": 0, "failed": 0}
+
+    def decode(camera_id, message):
+        with timer.time("decode"):
+            frame = cv2.imdecode(np.frombuffer(message, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            with lock:
+                finished["failed"] += 1
+            return None
+        with timer.time("rotate"):
+            return cv2.rotate(frame, cv2.ROTATE_90_COUNTERCLOCKWISE)
+
+    def recognize(camera_id, frame):
+        try:
+            face_matches = recognizer.recognize(frame)
+            faces = [{"name": m.name, "box": [int(v) for v in m.location]} for m in face_matches]
+            with timer.time("draw"):
+                # GUIと同じく表示用のコピーに描画する
+                draw_faces(frame.copy(), faces)
+        finally:
+            with lock:
+                finished["recognized"] += 1
+
+    if args.realtime:
+        # アプリと同じキュー長で、処理が追いつかないフレームは破棄される
+        pipeline = FramePipeline(decode, recognize, logger)
+    else:
+        # 最速で再生する場合はキューを処理中のフレーム数の上限より長くし、破棄されないようにする
+        pipeline = FramePipeline(decode, recognize, logger, raw_queue_size=MAX_IN_FLIGHT, decoded_queue_size=MAX_IN_FLIGHT)
+
+    def in_flight():
+        stats = pipeline.stats()
+        dropped = stats["receive"]["dropped"] + stats["decode"]["dropped"]
+        with lock:
+            return stats["receive"]["received"] - dropped - finished["recognized"] - finished["failed"]
+
+    def submit(jpeg_bytes):
+        if not args.realtime:
+            while in_flight() >= MAX_IN_FLIGHT:
+                time.sleep(0.0005)
+        pipeline.submit("replay", jpeg_bytes)
+
+    _reset_peak_rss()
+    pipeline.start()
+    start = time.perf_counter()
+    replay(frames, submit, realtime=args.realtime, speed=args.speed)
+    while in_flight() > 0:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    stats = pipeline.stats()
+    pipeline.stop()
+    return {
+        "fps": finished["recognized"] / elapsed,
+        "dropped": stats["receive"]["dropped"] + stats["decode"]["dropped"],
+        "peak_rss_mb": _peak_rss_mb(),
+        "timer": timer,
+    }
+
+
+def bench_replay(args, logger):
+    """記録したフレームを再生し、解像度ごとにステージ別の処理時間・FPS・ピークRSSを計測する"""
+    encodings, names = EncodingStore(args.cache_dir, logger).load_cached()
+    gallery = FaceGallery(encodings, names, args.threshold)
+    source = _replay_source(args)
+    print(f"frames={len(source)} known_faces={len(names)} mode={'realtime' if args.realtime else 'fast'} detector={args.detector}")
+
+    for resolution in args.resolutions:
+        frames = _scale_recording(source, resolution)
+        result = _replay_resolution(frames, gallery, args, logger)
+        peak = f"{result['peak_rss_mb']:.1f} MB" if result["peak_rss_mb"] is not None else "-"
+        print(f"\n{resolution}: {result['fps']:.2f} fps, dropped={result['dropped']}, peak RSS={peak}")
+        print(f"  {'stage':>10} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}")
+        timer = result["timer"]
+        for stage in REPLAY_STAGES:
+            values = timer.percentiles(stage)
+            if values is None:
+                continue
+            p50, p90, p99 = values
+            print(f"  {stage:>10} {timer.count(stage):>7} {p50:>9.3f} {p90:>9.3f} {p99:>9.3f}")
+
+
+# 新しいプロセスで RecognitionService を作成し、起動の段階ごとの時間をJSONで出力する
+# (このファイルは顔認識のモジュールを読み込むため、計測は別のインタープリターで行う)
+_STARTUP_CHILD = """
+import sys, json, time, logging
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+from recognition_service import RecognitionService
+app_import = time.perf_counter() - start
+logging.basicConfig(level=logging.WARNING)
+start = time.perf_counter()
+service = RecognitionService(logging.getLogger("bench"))
+service_init = time.perf_counter() - start
+completed = service.ready_event.wait(float(sys.argv[2]))
+result = dict(service.startup_times, app_import=app_import, service_init=service_init, completed=completed)
+service.shutdown()
+print(json.dumps(result))
+"""
+
+
+def _run_startup_child(args):
+    """起動を1回計測する。エンコーディングキャッシュを使わない場合は空のディレクトリを使う"""
+    env = dict(os.environ)
+    if args.faces_dir:
+        env["FACES_DIR"] = args.faces_dir
+    with tempfile.TemporaryDirectory() as cache_dir:
+        if args.no_cache:
+            env["ENCODING_CACHE_DIR"] = cache_dir
+        proc = subprocess.run(
+            [sys.executable, "-c", _STARTUP_CHILD, os.path.dirname(os.path.abspath(__file__)), str(args.timeout)],
+            env=env, capture_output=True, text=True
+        )
+    if proc.returncode != 0 or not proc.stdout.strip():
+        raise RuntimeError(f"起動の計測に失敗しました:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def bench_startup(args, logger):
+    """起動の段階 (アプリのimport・サービス作成・dlibのimport・モデル・既知の顔) ごとの時間を計測する"""
+    runs = []
+    for i in range(args.runs):
+        result = _run_startup_child(args)
+        if not result["completed"]:
+            print(f"run {i}: {args.timeout} 秒以内に顔認識の準備が終わりませんでした。")
+            return
+        runs.append(result)
+
+    print(f"runs={len(runs)} encoding_cache={'off' if args.no_cache else 'on'}")
+    print(f"{'phase':>13} {'median s':>9} {'min s':>7} {'max s':>7}")
+    for phase in STARTUP_PHASES:
+        values = [run[phase] for run in runs]
+        print(f"{phase:>13} {np.median(values):>9.3f} {min(values):>7.3f} {max(values):>7.3f}")
+
+    ui = np.median([run["app_import"] + run["service_init"] for run in runs])
+    ready = np.median([run["app_import"] + run["ready"] for run in runs])
+    sequential = np.median([run["app_import"] + run["import"] + run["model_load"] + run["gallery_load"] for run in runs])
+    print(f"\nGUI表示・カメラ接続が可能になるまで: {ui:.3f} s")
+    print(f"顔認識を開始できるまで: {ready:.3f} s (全てを順番に読み込んでからGUIを表示する場合: {sequential:.3f} s)")
+
+
+def _synthetic_photos(directory, count=16, size=(1600, 1200)):
+    """顔の写っていない大きな写真の代わりになる画像を作る (縮小とHOG検出の時間だけを計測する)"""
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        small = rng.integers(0, 256, (size[1] // 16, size[0] // 16, 3), dtype=np.uint8)
+        path = os.path.join(directory, f"photo{i}.jpg")
+        cv2.imwrite(path, cv2.resize(small, size, interpolation=cv2.INTER_CUBIC))
+        paths.append(path)
+    return paths
+
+
+def bench_enroll(args, logger):
+    """一括登録 (縮小・検出・エンコード) のスループットをワーカー数ごとに計測する。登録はしない"""
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = list_images(args.images) if args.images else []
+        if not paths:
+            paths = _synthetic_photos(tmp)
+        tasks = [(paths[i % len(paths)], None) for i in range(args.count)]
+        print(f"images={len(tasks)} (distinct {len(paths)}) max_side={args.max_side} upsample={args.upsample} cpus={os.cpu_count()}")
+        print(f"{'workers':>7} {'total s':>8} {'img/s':>8} {'speedup':>8} {'efficiency':>10} {'enrolled':>8}")
+        baseline = None
+        for workers in args.workers:
+            start = time.perf_counter()
+            results = enroll_files(tasks, workers, args.max_side, args.upsample)
+            elapsed = time.perf_counter() - start
+            rate = len(tasks) / elapsed
+            if baseline is None:
+                baseline = (rate, workers)
+            speedup = rate / baseline[0]
+            efficiency = speedup / (workers / baseline[1])
+            enrolled = sum(1 for r in results if r["status"] == "enrolled")
+            print(f"{workers:>7} {elapsed:>8.1f} {rate:>8.1f} {speedup:>7.2f}x {efficiency:>9.0%} {enrolled:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="顔認識パイプラインのベンチマーク")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    workers_parser = subparsers.add_parser("workers", help="認識ワーカー数ごとのスループットを計測する")
+    workers_parser.add_argument("--images", help="フレームとして使う画像のディレクトリ (省略時は乱数画像)")
+    workers_parser.add_argument("--frames", type=int, default=200, help="処理するフレーム数")
+    workers_parser.add_argument("--resolution", default="320x240", help="乱数画像の解像度")
+    workers_parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4], help="計測するワーカー数 (0はプロセスを使わない)")
+    workers_parser.add_argument("--cache-dir", default="./resources/cache", help="エンコーディングキャッシュのディレクトリ")
+    workers_parser.add_argument("--threshold", type=float, default=0.5)
+    workers_parser.set_defaults(func=bench_workers)
+
+    preprocess_parser = subparsers.add_parser("preprocess", help="前処理の時間とメモリ確保量を計測する")
+    preprocess_parser.add_argument("--images", help="フレームとして使う画像のディレクトリ (省略時は乱数画像)")
+    preprocess_parser.add_argument("--frames", type=int, default=500, help="処理するフレーム数")
+    preprocess_parser.add_argument("--resolution", default="320x240", help="乱数画像の解像度")
+    preprocess_parser.set_defaults(func=bench_preprocess)
+
+    gallery_parser = subparsers.add_parser("gallery", help="全エンコーディングとの照合と代表点での照合を比較する (疑似データ)")
+    gallery_parser.add_argument("--identities", type=int, default=1000, help="登録する人物数")
+    gallery_parser.add_argument("--per-identity", type=int, default=20, help="1人あたりの写真数")
+    gallery_parser.add_argument("--queries", type=int, default=1000, help="照合する顔の数 (半分は未登録の人物)")
+    gallery_parser.add_argument("--medoids", type=int, default=3, help="1人あたりのメドイド数")
+    gallery_parser.add_argument("--threshold", type=float, default=0.5)
+    gallery_parser.add_argument("--ann-threshold", type=int, default=20000, help="FaceGalleryで近似探索に切り替える登録数")
+    gallery_parser.set_defaults(func=bench_gallery)
+
+    roi_parser = subparsers.add_parser("roi", help="縮小画像での検出と元フレームからの切り出しエンコードを解像度ごとに比較する")
+    roi_parser.add_argument("--images", help="顔が写っている画像のディレクトリ (省略時は乱数画像)")
+    roi_parser.add_argument("--frames", type=int, default=50, help="処理するフレーム数")
+    roi_parser.add_argument("--resolutions", nargs="+", default=RESOLUTIONS, help="計測する解像度")
+    roi_parser.add_argument("--min-face-ratio", type=float, nargs="+", default=[0.15, 0.25], help="想定する最小の顔のサイズ (フレームの短辺に対する割合、複数指定で比較)")
+    roi_parser.add_argument("--cache-dir", default="./resources/cache", help="エンコーディングキャッシュのディレクトリ")
+    roi_parser.add_argument("--threshold", type=float, default=0.5)
+    roi_parser.set_defaults(func=bench_roi)
+
+    batch_parser = subparsers.add_parser("batch", help="複数フレームの顔をまとめてエンコード・照合した場合のスループットを計測する")
+    batch_parser.add_argument("--images", help="顔が写っている画像のディレクトリ (省略時は乱数画像)")
+    batch_parser.add_argument("--frames", type=int, default=200, help="処理するフレーム数")
+    batch_parser.add_argument("--resolution", default="320x240", help="乱数画像の解像度")
+    batch_parser.add_argument("--cameras", type=int, default=4, help="フレームを振り分けるカメラ数")
+    batch_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8], help="計測するバッチサイズ (フレーム数)")
+    batch_parser.add_argument("--cache-dir", default="./resources/cache", help="エンコーディングキャッシュのディレクトリ")
+    batch_parser.add_argument("--threshold", type=float, default=0.5)
+    batch_parser.set_defaults(func=bench_batch)
+
+    replay_parser = subparsers.add_parser("replay", help="記録したフレームを再生し、解像度ごとのステージ別処理時間を計測する")
+    replay_parser.add_argument("--recording", help="RECORD_DIRに保存された記録ファイル (省略時は --images の画像または乱数画像)")
+    replay_parser.add_argument("--images", help="記録ファイルがない場合にフレームとして使う画像のディレクトリ")
+    replay_parser.add_argument("--frames", type=int, default=0, help="再生するフレーム数の上限 (0なら全フレーム)")
+    replay_parser.add_argument("--resolutions", nargs="+", default=RESOLUTIONS, help="計測する解像度")
+    replay_parser.add_argument("--realtime", action="store_true", help="記録時の間隔で再生する (省略時は最速で再生)")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="--realtime 時の再生速度の倍率")
+    replay_parser.add_argument("--detector", default="hog", choices=DETECTOR_STRATEGIES)
+    replay_parser.add_argument("--cascade", default="resources/models/haarcascade_frontalface_default.xml")
+    replay_parser.add_argument("--cache-dir", default="./resources/cache", help="エンコーディングキャッシュのディレクトリ")
+    replay_parser.add_argument("--threshold", type=float, default=0.5)
+    replay_parser.set_defaults(func=bench_replay)
+
+    startup_parser = subparsers.add_parser("startup", help="起動の段階ごとの時間を新しいプロセスで計測する")
+    startup_parser.add_argument("--runs", type=int, default=3, help="計測する回数")
+    startup_parser.add_argument("--faces-dir", help="既知の顔のディレクトリ (省略時はFACES_DIR)")
+    startup_parser.add_argument("--no-cache", action="store_true", help="エンコーディングキャッシュを使わずに全ての顔をエンコードする")
+    startup_parser.add_argument("--timeout", type=float, default=300.0, help="顔認識の準備を待つ時間の上限 (秒)")
+    startup_parser.set_defaults(func=bench_startup)
+
+    enroll_parser = subparsers.add_parser("enroll", help="一括登録のスループットをワーカー数ごとに計測する")
+    enroll_parser.add_argument("--images", help="顔写真のディレクトリ (省略時は顔のない大きな画像を生成する)")
+    enroll_parser.add_argument("--count", type=int, default=10000, help="処理する画像の枚数 (足りない場合は同じ画像を繰り返す)")
+    enroll_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="計測するワーカープロセス数")
+    enroll_parser.add_argument("--max-side", type=int, default=1024, help="長辺がこれを超える画像は縮小してから検出する")
+    enroll_parser.add_argument("--upsample", type=int, default=0, help="HOG検出の前に画像を2倍に拡大する回数")
+    enroll_parser.set_defaults(func=bench_enroll)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    args.func(args, logging.getLogger("bench"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import os
+from dotenv import load_dotenv
+
+# 環境変数の読み込み
+load_dotenv()
+
+class AppConfig:
+    """アプリケーションの設定を管理するクラス"""
+    WS_URL = os.getenv("WS_URL", "ws://localhost:8080")
+    WS_URLS = [url.strip() for url in os.getenv("WS_URLS", WS_URL).split(",") if url.strip()] # 複数カメラの接続先 (カンマ区切り、カメラIDは先頭から cam0, cam1, ...)
+    RECONNECT_INITIAL_BACKOFF_SEC = 0.5 # 切断後、最初の再接続までの待ち時間 (失敗するたびに倍にする)
+    RECONNECT_MAX_BACKOFF_SEC = 30.0
+    INGEST_BACKEND = os.getenv("INGEST_BACKEND", "thread") # thread (接続ごとにスレッド) / asyncio (1つのイベントループで全カメラを受信)
+    # LINE_NOTIFY_TOKEN = os.getenv("LINE_NOTIFY_TOKEN", "") 
+    FACES_DIR = os.getenv("FACES_DIR", "./resources/faces")
+    ENCODING_CACHE_DIR = os.getenv("ENCODING_CACHE_DIR", "./resources/cache") # 既知の顔エンコーディングのキャッシュ保存先
+    FACE_MATCH_THRESHOLD = float(os.getenv("FACE_MATCH_THRESHOLD", 0.5))
+    GALLERY_ANN_THRESHOLD = int(os.getenv("GALLERY_ANN_THRESHOLD", 20000)) # この登録数以上で近似最近傍探索 (IVF) に切り替える
+    GALLERY_ANN_PROBES = 8 # 近似探索で調べるクラスタ数
+    GALLERY_MODE = os.getenv("GALLERY_MODE", "flat") # flat (全エンコーディングと照合) / identity (人物ごとの代表点と人物ごとの閾値で照合)
+    IDENTITY_MEDOIDS = int(os.getenv("IDENTITY_MEDOIDS", 3)) # identityモードで重心に加えて1人あたりに保持する代表点の数
+    IDENTITY_BOUNDARY_MARGIN = 0.05 # 代表点での距離が閾値からこの範囲内なら全エンコーディングと照合し直す
+    GALLERY_WATCH_INTERVAL_SEC = float(os.getenv("GALLERY_WATCH_INTERVAL_SEC", 5)) # FACES_DIRの変更を確認する間隔 (0なら監視しない)
+    CASCADE_PATH = "resources/models/haarcascade_frontalface_default.xml"
+    DETECTOR_STRATEGY = os.getenv("DETECTOR_STRATEGY", "hog") # hog / cascade / pyramid / motion / motion+cascade / motion+pyramid
+    DETECT_MIN_FACE_RATIO = float(os.getenv("DETECT_MIN_FACE_RATIO", 0.15)) # pyramid方式で想定する最小の顔のサイズ (フレームの短辺に対する割合)
+    ENCODE_CROPS = os.getenv("ENCODE_CROPS", "True").lower() == "true" # 元のフレームから切り出した顔の周辺でエンコードするかどうか
+    PREPROCESS_STEPS = os.getenv("PREPROCESS_STEPS", "blur,equalize,gamma") # 顔検出前の前処理ステップ (カンマ区切り、順番どおりに適用)
+    PREPROCESS_GAMMA = 1.5
+    DEFAULT_FPS_SETTING = "1"
+    DEFAULT_RESOLUTION = "160x120"
+    RESOLUTION_RESEND_INTERVAL_SEC = 5
+    FPS_STEPS = ["1", "5", "10", "20", "30"] # ESP32-CAMに設定できるFPS (低い順)
+    RESOLUTION_STEPS = ["160x120", "176x144", "240x176", "240x240", "320x240"] # ESP32-CAMに設定できる解像度 (画素数の少ない順)
+    ADAPTIVE_QUALITY = os.getenv("ADAPTIVE_QUALITY", "False").lower() == "true" # 認識の遅延に応じてFPSと解像度を自動で下げる・戻すかどうか
+    TARGET_LATENCY_MS = int(os.getenv("TARGET_LATENCY_MS", 500)) # 受信から認識結果までの遅延 (p90) の目標
+    ADAPTIVE_INTERVAL_SEC = 1.0 # 自動調整の判断を行う間隔
+    ADAPTIVE_WINDOW_SEC = 3.0 # 遅延のp90を計算する期間
+    ADAPTIVE_SETTLE_SEC = 3.0 # 設定を変えた後、この時間は判断しない (カメラへの反映とキューの入れ替わりを待つ)
+    ADAPTIVE_UP_RATIO = 0.5 # 遅延が目標のこの割合未満なら余裕があるとみなす
+    ADAPTIVE_UP_HOLD = 5 # 余裕のある状態がこの回数続いたら設定を1段階戻す
+    ADAPTIVE_DOWN_HOLD = 2 # 目標を超える状態がこの回数続いたら設定を1段階下げる
+    RAW_FRAME_QUEUE_SIZE = 2 # 受信したJPEGを保持するリングバッファの長さ (古いものから破棄)
+    DECODED_FRAME_QUEUE_SIZE = 1 # デコード済みフレームを保持するキューの長さ
+    DISPLAY_MAX_FPS = int(os.getenv("DISPLAY_MAX_FPS", 30)) # GUIで映像を描画する頻度の上限 (新しいフレームが届いた時だけ描画する)
+    LOG_VIEW_MAX_LINES = int(os.getenv("LOG_VIEW_MAX_LINES", 1000)) # GUIのログ欄に残す行数 (超えたら古い行から消す)
+    LOG_VIEW_RATE_PER_SEC = float(os.getenv("LOG_VIEW_RATE_PER_SEC", 5)) # GUIのログ欄に追加する新しいINFO以下の行の上限 (ロガーごと、毎秒。WARNING以上は制限しない)
+    LOG_VIEW_BURST = int(os.getenv("LOG_VIEW_BURST", 20)) # 上限を超えて連続で追加できる行数
+    FRAME_POOL_SIZE = 16 # 解像度ごとに使い回すフレーム用配列の数 (全て使用中なら新しく確保する)
+    WARMUP_FRAME_POLICY = os.getenv("WARMUP_FRAME_POLICY", "latest") # 顔認識の準備中に届いたフレームの扱い (latest: 最新のフレームを残して準備後に認識 / detect: Haar Cascadeで位置だけ検出)
+    FRAME_CACHE_SIZE = int(os.getenv("FRAME_CACHE_SIZE", 0)) # 同じJPEGのデコード結果と認識結果を使い回すフレーム数 (0なら使わない、保持中のフレームはFRAME_POOL_SIZEの配列を使う)
+    FACE_CACHE_SIZE = int(os.getenv("FACE_CACHE_SIZE", 0)) # 見た目がほぼ同じ顔のエンコーディングと照合結果を使い回す数 (カメラごと、0なら使わない)
+    RESULT_CACHE_TTL_SEC = float(os.getenv("RESULT_CACHE_TTL_SEC", 10)) # キャッシュした結果を使い回す時間の上限
+    RECOGNITION_WORKERS = int(os.getenv("RECOGNITION_WORKERS", 0)) # 認識用ワーカープロセス数 (0なら認識スレッド内で処理)
+    RECOGNITION_SUBMIT_TIMEOUT_SEC = 1.0 # ワーカーの空きを待つ時間の上限 (超えたらそのフレームを破棄する)
+    RECOGNITION_RESULT_TIMEOUT_SEC = float(os.getenv("RECOGNITION_RESULT_TIMEOUT_SEC", 30)) # この時間以上結果を返さないワーカーは強制終了して起動し直す
+    ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", 1)) # 顔をまとめてエンコード・照合するフレーム数の上限 (1ならフレームごとに処理)
+    ENCODE_BATCH_WAIT_MS = float(os.getenv("ENCODE_BATCH_WAIT_MS", 20)) # バッチの最初のフレームから、他のフレームを待つ時間の上限
+    MAX_FRAME_BYTES = 320 * 320 * 3 # 共有メモリのスロットサイズ (最大解像度のBGRフレームが収まる大きさ)
+    TRACKING_ENABLED = os.getenv("TRACKING_ENABLED", "False").lower() == "true" # 追跡中の顔のエンコードを省略するかどうか
+    TRACK_DETECT_INTERVAL = int(os.getenv("TRACK_DETECT_INTERVAL", 1)) # 追跡時にHOG検出を行うフレーム間隔 (間のフレームはオプティカルフローで追跡)
+    TRACK_REVERIFY_INTERVAL = int(os.getenv("TRACK_REVERIFY_INTERVAL", 30)) # 追跡中の顔を再エンコードして確認するフレーム間隔
+    TRACK_IOU_THRESHOLD = 0.3
+    TRACK_MAX_MISSED = 3 # 検出されないフレームがこの数を超えたトラックを破棄する
+    RECORD_DIR = os.getenv("RECORD_DIR", "") # 受信したフレームをカメラごとに記録するディレクトリ (空なら記録しない)
+    METRICS_PORT = int(os.getenv("METRICS_PORT", 0)) # メトリクスを公開するHTTPポート (0なら公開しない、127.0.0.1でのみ待ち受ける)
+    METRICS_SNAPSHOT_PATH = os.getenv("METRICS_SNAPSHOT_PATH", "") # メトリクスのスナップショットを書き出すJSONファイル (空なら書き出さない)
+    METRICS_SNAPSHOT_INTERVAL_SEC = 10
+    SAVE_UNKNOWN_FACES = os.getenv("SAVE_UNKNOWN_FACES", "True").lower() == "true" # 未知の顔を保存するかどうかの設定
+    UNKNOWN_DEDUP_THRESHOLD = float(os.getenv("UNKNOWN_DEDUP_THRESHOLD", 0.5)) # 直近に保存した未知の顔とこの距離未満なら同じ人物として保存しない
+    UNKNOWN_DEDUP_WINDOW_SEC = int(os.getenv("UNKNOWN_DEDUP_WINDOW_SEC", 600)) # 未知の顔をこの時間見かけなければ、次に現れた時に再度保存する
+    UNKNOWN_WRITE_QUEUE_SIZE = 32 # 保存待ちの未知の顔のキューの長さ
+    SIGHTING_DB_PATH = os.getenv("SIGHTING_DB_PATH", "./resources/sightings.db") # 認識した人物 (名前・カメラ・時刻・位置・距離) を記録するSQLiteファイル (空なら記録しない)
+    SIGHTING_VISIT_GAP_SEC = float(os.getenv("SIGHTING_VISIT_GAP_SEC", 10)) # 同じ人物・カメラの検出がこの時間以上途切れたら別の訪問とする
+    SIGHTING_MAX_VISIT_SEC = 3600 # 1つの訪問の長さの上限 (期間の検索でstart_timeのインデックスを使うため)
+    SIGHTING_MIN_INTERVAL_SEC = float(os.getenv("SIGHTING_MIN_INTERVAL_SEC", 1.0)) # 同じ訪問の検出ごとの記録はこの間隔に1件まで (間の検出は訪問の回数に数える)
+    SIGHTING_BATCH_SIZE = 200 # 1回のコミットでまとめて書き込む検出数の上限
+    SIGHTING_FLUSH_INTERVAL_SEC = 1.0 # 書き込みを待たせる時間の上限
+    SIGHTING_QUEUE_SIZE = 10000 # 書き込み待ちの検出のキューの長さ (満杯なら捨てる)
@@ -0,0 +1,182 @@
+import cv2
+import numpy as np
+from tracker import iou
+
+DETECTOR_STRATEGIES = ("hog", "cascade", "pyramid", "motion", "motion+cascade", "motion+pyramid")
+HOG_WINDOW_SIZE = 80 # dlibのHOG検出器が検出できる最小の顔のサイズ (画素)
+
+
+def _face_locations(image, **kwargs):
+    """face_recognition.face_locations を呼ぶ
+
+    face_recognition は読み込み時にdlibのモデルを読み込んで時間がかかるため、最初に検出する時に読み込む。
+    """
+    import face_recognition
+    return face_recognition.face_locations(image, **kwargs)
+
+
+class HogDetector:
+    """フレーム全体にdlibのHOG検出器をかける (従来の方式)"""
+    def detect(self, processed_frame, color_for_dlib):
+        return _face_locations(color_for_dlib, model="hog")
+
+
+class PyramidHogDetector:
+    """想定する最小の顔のサイズから検出用の縮尺を決め、縮小 (または拡大) した画像にHOG検出器をかける
+
+    face_recognition.face_locations のデフォルトは画像を2倍に拡大してから検出するため、
+    HOG_WINDOW_SIZE の半分 (40画素) の顔まで検出できる代わりに4倍の画素を走査する。
+    ここでは最小の顔 (フレームの短辺 × min_face_ratio) がちょうど HOG_WINDOW_SIZE になる縮尺で検出し、
+    検出した矩形は元の解像度の座標に戻して返す。縮尺は max_scale 倍 (デフォルトの拡大と同じ) を上限にする。
+    """
+    def __init__(self, min_face_ratio=0.15, max_scale=2.0, min_scale=0.25):
+        self.min_face_ratio = min_face_ratio
+        self.max_scale = max_scale
+        self.min_scale = min_scale
+        self._resized = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_resized"] = None
+        return state
+
+    def scale_for(self, height, width):
+        """フレームサイズに対する検出用の縮尺を返す"""
+        min_face = min(height, width) * self.min_face_ratio
+        return min(max(HOG_WINDOW_SIZE / min_face, self.min_scale), self.max_scale)
+
+    def detect(self, processed_frame, color_for_dlib):
+        height, width = color_for_dlib.shape[:2]
+        scale = self.scale_for(height, width)
+        if abs(scale - 1.0) < 0.05:
+            return _face_locations(color_for_dlib, number_of_times_to_upsample=0, model="hog")
+
+        size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+        if self._resized is None or self._resized.shape[:2] != (size[1], size[0]):
+            self._resized = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+        cv2.resize(color_for_dlib, size, dst=self._resized, interpolation=interpolation)
+        locations = _face_locations(self._resized, number_of_times_to_upsample=0, model="hog")
+        return [
+            (
+                max(int(round(top / scale)), 0),
+                min(int(round(right / scale)), width),
+                min(int(round(bottom / scale)), height),
+                max(int(round(left / scale)), 0),
+            )
+            for (top, right, bottom, left) in locations
+        ]
+
+
+class CascadeDetector:
+    """Haar Cascadeだけで顔を検出する (HOGより誤検出が多いが、dlibを使わないため顔認識の準備中でも使える)
+
+    CascadeClassifierはpickleできないため、ワーカープロセスに渡せるように初回使用時に読み込む。
+    """
+    def __init__(self, cascade_path, scale_factor=1.1, min_neighbors=5, min_size=(20, 20)):
+        self.cascade_path = cascade_path
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+        self._cascade = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_cascade"] = None
+        return state
+
+    @property
+    def cascade(self):
+        if self._cascade is None:
+            self._cascade = cv2.CascadeClassifier(self.cascade_path)
+            if self._cascade.empty():
+                raise IOError(f"Haar Cascades ファイルが見つかりません: {self.cascade_path}")
+        return self._cascade
+
+    def candidates(self, processed_frame):
+        """グレースケール画像から顔の候補を (x, y, w, h) のリストで返す"""
+        return self.cascade.detectMultiScale(
+            processed_frame, scaleFactor=self.scale_factor, minNeighbors=self.min_neighbors, minSize=self.min_size
+        )
+
+    def detect(self, processed_frame, color_for_dlib):
+        return [(int(y), int(x + w), int(y + h), int(x)) for (x, y, w, h) in self.candidates(processed_frame)]
+
+
+class CascadeHogDetector(CascadeDetector):
+    """Haar Cascadeで候補領域を絞り込み、その領域だけにHOG検出器をかける"""
+    def __init__(self, cascade_path, padding=0.3, scale_factor=1.1, min_neighbors=3, min_size=(20, 20)):
+        super().__init__(cascade_path, scale_factor=scale_factor, min_neighbors=min_neighbors, min_size=min_size)
+        self.padding = padding
+
+    def detect(self, processed_frame, color_for_dlib):
+        candidates = self.candidates(processed_frame)
+        height, width = processed_frame.shape[:2]
+        locations = []
+        for (x, y, w, h) in candidates:
+            pad_x, pad_y = int(w * self.padding), int(h * self.padding)
+            x0, y0 = max(x - pad_x, 0), max(y - pad_y, 0)
+            x1, y1 = min(x + w + pad_x, width), min(y + h + pad_y, height)
+            crop = color_for_dlib[y0:y1, x0:x1]
+            for (top, right, bottom, left) in _face_locations(crop, model="hog"):
+                location = (top + y0, right + x0, bottom + y0, left + x0)
+                # 候補領域が重なっている場合は同じ顔を二重に数えない
+                if all(iou(location, other) < 0.5 for other in locations):
+                    locations.append(location)
+        return locations
+
+
+class MotionGate:
+    """前回検出時のフレームから変化がなければ検出をスキップするゲート
+
+    detect() は変化がない場合 None を返し、呼び出し側は前回の結果を使い回す。
+    変化がなくても max_skip フレームごとに一度は検出を行う。
+    """
+    def __init__(self, detector, pixel_threshold=25, motion_ratio=0.01, downscale=4, max_skip=30):
+        self.detector = detector
+        self.pixel_threshold = pixel_threshold
+        self.motion_ratio = motion_ratio
+        self.downscale = downscale
+        self.max_skip = max_skip
+        self._reference = None
+        self._small = None
+        self._diff = None
+        self._skipped = 0
+
+    def detect(self, processed_frame, color_for_dlib):
+        height, width = processed_frame.shape[:2]
+        small_shape = (max(height // self.downscale, 1), max(width // self.downscale, 1))
+        if self._small is None or self._small.shape != small_shape:
+            self._small = np.empty(small_shape, dtype=np.uint8)
+            self._diff = np.empty(small_shape, dtype=np.uint8)
+            self._reference = None
+        cv2.resize(processed_frame, (small_shape[1], small_shape[0]), dst=self._small, interpolation=cv2.INTER_AREA)
+
+        if self._reference is not None and self._skipped < self.max_skip:
+            cv2.absdiff(self._small, self._reference, dst=self._diff)
+            cv2.threshold(self._diff, self.pixel_threshold, 255, cv2.THRESH_BINARY, dst=self._diff)
+            if cv2.countNonZero(self._diff) < self.motion_ratio * self._diff.size:
+                self._skipped += 1
+                return None
+
+        # 検出を行ったフレームを次の比較の基準にする (バッファは入れ替えて使い回す)
+        if self._reference is None:
+            self._reference = np.empty(small_shape, dtype=np.uint8)
+        self._reference, self._small = self._small, self._reference
+        self._skipped = 0
+        return self.detector.detect(processed_frame, color_for_dlib)
+
+
+def create_detector(strategy, cascade_path, min_face_ratio=0.15):
+    """設定された方式の検出器を作成する"""
+    if strategy not in DETECTOR_STRATEGIES:
+        raise ValueError(f"不明な検出方式です: {strategy} (選択肢: {', '.join(DETECTOR_STRATEGIES)})")
+    if "cascade" in strategy:
+        detector = CascadeHogDetector(cascade_path)
+    elif "pyramid" in strategy:
+        detector = PyramidHogDetector(min_face_ratio)
+    else:
+        detector = HogDetector()
+    if strategy.startswith("motion"):
+        detector = MotionGate(detector)
+    return detector
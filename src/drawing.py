@@ -0,0 +1,14 @@
+import cv2
+
+
+def draw_faces(frame, faces, scale=1.0):
+    """フレームに顔の矩形と名前を描画する (faces は "faces" イベントの faces)
+
+    表示用に縮小・拡大したフレームに描画する場合は、元のフレームに対する倍率を scale に渡す。
+    """
+    for face in faces:
+        top, right, bottom, left = (int(round(v * scale)) for v in face["box"])
+        name = face["name"]
+        color = (0, 0, 255) if name == "Unknown" else (0, 255, 0)
+        cv2.rectangle(frame, (left, top), (right, bottom), color, 1)
+        cv2.putText(frame, name, (left + 6, bottom + 12), cv2.FONT_HERSHEY_DUPLEX, 0.5, color, 1)
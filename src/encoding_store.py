@@ -0,0 +1,242 @@
+import os
+import json
+import hashlib
+import threading
+import contextlib
+import numpy as np
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+ENCODING_DIM = 128
+
+
+class EncodingStore:
+    """既知の顔エンコーディングをディスクに永続化するキャッシュクラス
+
+    エンコーディングは1つの .npy ファイル (N x 128) にまとめて保存し、
+    各画像ファイルのパス・mtime・サイズ・内容ハッシュをマニフェスト(JSON)に記録する。
+    起動時は変更のあった画像のみ再エンコードし、削除された画像はキャッシュから取り除く。
+
+    アプリ (sync) と一括登録 (add) は別のプロセスで同じキャッシュを読み書きするため、
+    読み込みから書き込みまではロックファイルで排他する (locked())。
+    """
+    MANIFEST_VERSION = 1
+    MANIFEST_FILE = "manifest.json"
+    ENCODINGS_FILE = "encodings.npy"
+    LOCK_FILE = "lock"
+
+    def __init__(self, cache_dir, logger):
+        self.cache_dir = cache_dir
+        self.logger = logger
+        self.manifest_path = os.path.join(cache_dir, self.MANIFEST_FILE)
+        self.encodings_path = os.path.join(cache_dir, self.ENCODINGS_FILE)
+        self.lock_path = os.path.join(cache_dir, self.LOCK_FILE)
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+
+    @staticmethod
+    def file_hash(filepath):
+        """ファイル内容のハッシュ値を計算する"""
+        h = hashlib.sha256()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    @contextlib.contextmanager
+    def locked(self):
+        """キャッシュを他のプロセス・スレッドと排他して使う (同じインスタンスでは入れ子にできる)"""
+        with self._thread_lock:
+            if self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self.lock_path, 'a+b') as f:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                else:
+                    f.seek(0)
+                    while True:
+                        try:
+                            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                            break
+                        except OSError: # 約10秒で諦めるため、取れるまで繰り返す
+                            pass
+                self._lock_depth = 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth = 0
+                    if fcntl is not None:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                    else:
+                        f.seek(0)
+                        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _read_cache(self):
+        """マニフェストとエンコーディング配列を読み込む。不整合があれば空を返す"""
+        if not (os.path.exists(self.manifest_path) and os.path.exists(self.encodings_path)):
+            return {}, None
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get("version") != self.MANIFEST_VERSION:
+                self.logger.info("エンコーディングキャッシュのバージョンが異なるため再構築します。")
+                return {}, None
+            encodings = np.load(self.encodings_path, mmap_mode='r')
+            if encodings.ndim != 2 or encodings.shape[0] != manifest.get("count") or encodings.shape[1] != ENCODING_DIM:
+                self.logger.warning("エンコーディングキャッシュが破損しているため再構築します。")
+                return {}, None
+            return manifest.get("entries", {}), encodings
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"エンコーディングキャッシュの読み込みに失敗しました: {e}")
+            return {}, None
+
+    def _write_cache(self, entries, encodings):
+        """マニフェストとエンコーディング配列をアトミックに書き込む"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_encodings = self.encodings_path + ".tmp"
+        with open(tmp_encodings, 'wb') as f:
+            np.save(f, encodings)
+        os.replace(tmp_encodings, self.encodings_path)
+
+        manifest = {"version": self.MANIFEST_VERSION, "count": int(encodings.shape[0]), "entries": entries}
+        tmp_manifest = self.manifest_path + ".tmp"
+        with open(tmp_manifest, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_manifest, self.manifest_path)
+
+    def load_cached(self):
+        """キャッシュ済みの (エンコーディング配列, 名前リスト) をディレクトリを走査せずに返す"""
+        with self.locked():
+            entries, encodings = self._read_cache()
+        if encodings is None:
+            return np.empty((0, ENCODING_DIM)), []
+        names = [None] * encodings.shape[0]
+        for entry in entries.values():
+            if entry["row"] is not None:
+                names[entry["row"]] = entry["name"]
+        return encodings, names
+
+    def add(self, items):
+        """エンコード済みの画像をキャッシュに追加する (同じファイル名のエントリは置き換える)
+
+        items は (ファイル名, 人物名, エンコーディング, os.stat の結果, sha256) のリスト。
+        mtime とサイズを記録するため、次の sync() ではこれらの画像を再エンコードしない。
+        """
+        with self.locked():
+            cached_entries, cached_encodings = self._read_cache()
+            added = {}
+            for filename, name, encoding, st, digest in items:
+                added[filename] = ({"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha256": digest, "name": name}, encoding)
+
+            # sync() と同じくファイル名順に行を並べる (sync() は変更がなければ行の順に名前を並べて返すため)
+            entries = {}
+            rows = []
+            for filename in sorted(set(cached_entries) | set(added)):
+                if filename in added:
+                    entry, encoding = added[filename]
+                else:
+                    entry = cached_entries[filename]
+                    encoding = cached_encodings[entry["row"]] if entry["row"] is not None else None
+                row = None
+                if encoding is not None:
+                    row = len(rows)
+                    rows.append(encoding)
+                entries[filename] = dict(entry, row=row)
+
+            encodings = np.asarray(rows, dtype=np.float64).reshape(-1, ENCODING_DIM)
+            # 上書き前に古いメモリマップへの参照を解放する (Windowsでは置換に失敗するため)
+            rows = cached_encodings = None
+            self._write_cache(entries, encodings)
+            return encodings.shape[0]
+
+    def sync(self, faces_dir, filenames, name_for, encode_file):
+        """キャッシュをディレクトリの内容と同期し、(エンコーディング配列, 名前リスト) を返す
+
+        name_for(filename) は人物名を、encode_file(filepath) はエンコーディング(顔がなければNone)を返す。
+        """
+        with self.locked():
+            cached_entries, cached_encodings = self._read_cache()
+
+            entries = {}
+            rows = []
+            names = []
+            changed = len(cached_entries) == 0 and len(filenames) > 0
+            reused = encoded = 0
+
+            for filename in sorted(filenames):
+                filepath = os.path.join(faces_dir, filename)
+                try:
+                    st = os.stat(filepath)
+                except OSError as e:
+                    self.logger.error(f"ファイルの情報を取得できませんでした: {filename} - {e}")
+                    continue
+
+                old = cached_entries.get(filename)
+                encoding = None
+                entry = None
+                if old is not None and old["mtime_ns"] == st.st_mtime_ns and old["size"] == st.st_size:
+                    entry = old
+                else:
+                    try:
+                        digest = self.file_hash(filepath)
+                    except OSError as e:
+                        self.logger.error(f"ファイルの読み込み中にエラーが発生しました: {filename} - {e}")
+                        continue
+                    if old is not None and old["sha256"] == digest:
+                        # 内容は同じでmtimeのみ変わった場合は再エンコード不要
+                        entry = dict(old, mtime_ns=st.st_mtime_ns, size=st.st_size)
+                    changed = True
+
+                if entry is not None:
+                    if entry["row"] is not None:
+                        encoding = cached_encodings[entry["row"]]
+                        if entry["row"] != len(rows):
+                            # キャッシュの行がファイル名順でない場合は並べ直して書き込む
+                            changed = True
+                    reused += 1
+                else:
+                    try:
+                        encoding = encode_file(filepath)
+                    except Exception as e:
+                        self.logger.error(f"ファイルの処理中にエラーが発生しました: {filename} - {e}")
+                        continue
+                    encoded += 1
+                    entry = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha256": digest}
+                    if encoding is None:
+                        self.logger.debug(f"顔が検出されませんでした: {filename}")
+
+                entry = dict(entry, name=name_for(filename), row=None)
+                if encoding is not None:
+                    entry["row"] = len(rows)
+                    rows.append(encoding)
+                    names.append(entry["name"])
+                entries[filename] = entry
+
+            removed = len(set(cached_entries) - set(entries))
+            if removed:
+                changed = True
+
+            self.logger.info(f"エンコーディングキャッシュ: 再利用 {reused} 件, 新規エンコード {encoded} 件, 削除 {removed} 件")
+            # キャッシュも画像もない場合 (初回起動) は下で空の (0, 128) 配列を作って返す (Noneを返さない)
+            if not changed and cached_encodings is not None:
+                # 変更がなければメモリマップした配列をそのまま使う
+                return cached_encodings, names
+
+            encodings = np.asarray(rows, dtype=np.float64).reshape(-1, ENCODING_DIM)
+            # 上書き前に古いメモリマップへの参照を解放する (Windowsでは置換に失敗するため)
+            rows = cached_encodings = None
+            try:
+                self._write_cache(entries, encodings)
+            except OSError as e:
+                self.logger.error(f"エンコーディングキャッシュの書き込みに失敗しました: {e}")
+            return encodings, names
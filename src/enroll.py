@@ -0,0 +1,268 @@
+"""既知の顔の一括登録
+
+ディレクトリ以下の画像をプロセスプールで並列にエンコードし、FACES_DIR にコピーしてエンコーディングキャッシュに書き込む。
+アプリは起動時 (と既知の顔の再読み込み時) にキャッシュを使うため、登録した画像を再エンコードしない。
+
+人物名は、登録元のディレクトリ直下のサブディレクトリ名 (例: photos/yamada/001.jpg は yamada)、
+直下に置かれた画像はファイル名の "_" より前 (例: photos/yamada_1.jpg は yamada) から決める。
+顔が見つからない画像・複数の顔が写っている画像は登録せず、レポート (CSV) に書き出す。
+
+使用例:
+    python src/enroll.py ./photos --workers 4
+    python src/enroll.py ./photos --max-side 1600 --upsample 1 --report ./enroll_report.csv
+    python src/enroll.py ./photos --dry-run
+"""
+import os
+import sys
+import csv
+import time
+import shutil
+import hashlib
+import argparse
+import logging
+import multiprocessing as mp
+import cv2
+import numpy as np
+from encoding_store import EncodingStore
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+STAGING_DIR = ".enroll" # 登録中の画像を置く FACES_DIR 内のディレクトリ (既知の顔の読み込み・監視の対象外)
+REJECT_REASONS = {
+    "no_face": "顔なし",
+    "multiple_faces": "複数の顔",
+    "unreadable": "読み込めない",
+    "invalid_name": "名前が不正",
+    "error": "エラー",
+}
+
+_face_recognition = None
+_max_side = 0
+_upsample = 0
+
+
+def _init_worker(max_side, upsample):
+    """ワーカープロセスの初期化 (dlibの読み込みはプロセスごとに1回だけ行う)"""
+    global _face_recognition, _max_side, _upsample
+    cv2.setNumThreads(1) # プロセス数だけ並列にするため、OpenCVのスレッドは使わない
+    import face_recognition
+    _face_recognition = face_recognition
+    _max_side = max_side
+    _upsample = upsample
+
+
+def downscale(image, max_side):
+    """長辺が max_side を超える画像を縮小する (max_side が0なら縮小しない)"""
+    height, width = image.shape[:2]
+    if max_side <= 0 or max(height, width) <= max_side:
+        return image
+    scale = max_side / max(height, width)
+    return cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+
+def _enroll_one(task):
+    """1枚の画像を検出・エンコードし、登録できれば staged_path に書き込む (ワーカープロセスで呼ばれる)"""
+    source_path, staged_path = task
+    result = {"path": source_path, "status": "error", "faces": 0, "detail": ""}
+    try:
+        with open(source_path, 'rb') as f:
+            data = f.read()
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            result["status"] = "unreadable"
+            return result
+        # 大きな写真はHOG検出の前に縮小する (エンコードに使う顔画像は150x150のため精度はほぼ変わらない)
+        rgb = cv2.cvtColor(downscale(image, _max_side), cv2.COLOR_BGR2RGB)
+        locations = _face_recognition.face_locations(rgb, number_of_times_to_upsample=_upsample)
+        result["faces"] = len(locations)
+        if len(locations) != 1:
+            result["status"] = "no_face" if not locations else "multiple_faces"
+            return result
+        result["encoding"] = _face_recognition.face_encodings(rgb, locations)[0]
+        result["sha256"] = hashlib.sha256(data).hexdigest()
+        if staged_path is not None:
+            with open(staged_path, 'wb') as f:
+                f.write(data)
+            result["stat"] = os.stat(staged_path)
+        result["status"] = "enrolled"
+    except Exception as e:
+        result["status"] = "error"
+        result["detail"] = str(e)
+    return result
+
+
+def list_images(source_dir):
+    """source_dir 以下の画像ファイルのパスを返す (隠しディレクトリは除く)"""
+    paths = []
+    for root, dirs, files in os.walk(source_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(IMAGE_EXTENSIONS))
+    return paths
+
+
+def plan_filenames(source_dir, paths, existing=()):
+    """画像ごとに (人物名, FACES_DIR でのファイル名) を決める。名前が使えない画像は (None, 理由) にする
+
+    FACES_DIR のファイル名はアプリが人物名を取り出せるよう "人物名_..." の形にする。
+    existing (FACES_DIR にあるファイル名) やこのバッチで決めたファイル名と重なる場合は "-2" などを付けて
+    既存の画像を上書きしない (大文字・小文字を区別しないファイルシステムに合わせて区別せずに比べる)。
+    """
+    plans = []
+    used = {filename.lower() for filename in existing}
+    for path in paths:
+        relative = os.path.relpath(path, source_dir)
+        parts = relative.split(os.sep)
+        stem, ext = os.path.splitext(parts[-1])
+        if len(parts) > 1:
+            name, tag = parts[0], "-".join(parts[1:-1] + [stem])
+        else:
+            name, _, tag = stem.partition("_")
+        if not name or "_" in name or name.lower() == "unknown":
+            plans.append((None, f"人物名 '{name}' は使えません ('_' を含まない、Unknown 以外の名前にしてください)"))
+            continue
+        tag = tag or "1"
+        filename = f"{name}_{tag}{ext.lower()}"
+        suffix = 2
+        while filename.lower() in used:
+            filename = f"{name}_{tag}-{suffix}{ext.lower()}"
+            suffix += 1
+        used.add(filename.lower())
+        plans.append((name, filename))
+    return plans
+
+
+class _Progress:
+    """処理済みの枚数・速度・残り時間を interval 秒ごとに標準エラー出力へ表示する"""
+    def __init__(self, total, interval=1.0, stream=sys.stderr):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.started_at = time.monotonic()
+        self._last_shown = 0.0
+
+    def update(self, done, enrolled, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_shown < self.interval:
+            return
+        self._last_shown = now
+        elapsed = now - self.started_at
+        rate = done / elapsed if elapsed > 0 else 0.0
+        remaining = (self.total - done) / rate if rate > 0 else 0.0
+        self.stream.write(
+            f"\r{done}/{self.total} 枚 ({rate:.1f} 枚/秒, 残り約 {remaining:.0f} 秒) 登録 {enrolled} / 除外 {done - enrolled}"
+        )
+        if force:
+            self.stream.write("\n")
+        self.stream.flush()
+
+
+def enroll_files(tasks, workers, max_side, upsample, progress=None):
+    """(画像のパス, 書き込み先またはNone) のリストを workers 個のプロセスで処理し、結果のリストを返す
+
+    結果の順番は処理が終わった順。progress に _Progress を渡すと進捗を表示する。
+    """
+    # 1回のやり取りでまとめて渡す枚数 (少なすぎるとプロセス間通信が、多すぎると最後の待ちが増える)
+    chunksize = max(1, min(16, len(tasks) // (workers * 8)))
+    ctx = mp.get_context("spawn")
+    results = []
+    enrolled = 0
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(max_side, upsample)) as pool:
+        for result in pool.imap_unordered(_enroll_one, tasks, chunksize):
+            results.append(result)
+            if result["status"] == "enrolled":
+                enrolled += 1
+            if progress is not None:
+                progress.update(len(results), enrolled)
+    if progress is not None:
+        progress.update(len(results), enrolled, force=True)
+    return results
+
+
+def write_report(path, rejected):
+    """登録しなかった画像を理由付きでCSVに書き出す"""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["path", "status", "faces", "detail"])
+        for result in rejected:
+            writer.writerow([result["path"], result["status"], result["faces"], result["detail"]])
+
+
+def main():
+    from config import AppConfig
+    parser = argparse.ArgumentParser(description="ディレクトリ以下の顔写真を並列にエンコードして既知の顔に一括登録する")
+    parser.add_argument("source", help="登録する画像のディレクトリ (サブディレクトリ名またはファイル名の '_' より前が人物名)")
+    parser.add_argument("--faces-dir", default=AppConfig.FACES_DIR, help="登録先 (デフォルト: FACES_DIR)")
+    parser.add_argument("--cache-dir", default=AppConfig.ENCODING_CACHE_DIR, help="エンコーディングキャッシュ (デフォルト: ENCODING_CACHE_DIR)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="ワーカープロセス数 (デフォルト: CPUコア数)")
+    parser.add_argument("--max-side", type=int, default=1024, help="長辺がこれを超える画像は縮小してから検出する (0なら縮小しない)")
+    parser.add_argument("--upsample", type=int, default=0, help="HOG検出の前に画像を2倍に拡大する回数 (小さな顔が見つからない場合に1にする)")
+    parser.add_argument("--report", default="enroll_report.csv", help="登録しなかった画像の一覧 (CSV) の書き出し先")
+    parser.add_argument("--dry-run", action="store_true", help="検出・エンコードだけを行い、登録しない")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logger = logging.getLogger("enroll")
+
+    paths = list_images(args.source)
+    if not paths:
+        print(f"{args.source} に画像がありません。")
+        return
+
+    staging_dir = os.path.join(args.faces_dir, STAGING_DIR)
+    rejected = []
+    tasks = []
+    names = {}
+    existing = os.listdir(args.faces_dir) if os.path.isdir(args.faces_dir) else []
+    for path, (name, detail) in zip(paths, plan_filenames(args.source, paths, existing)):
+        if name is None:
+            rejected.append({"path": path, "status": "invalid_name", "faces": 0, "detail": detail})
+            continue
+        staged_path = None if args.dry_run else os.path.join(staging_dir, detail)
+        names[path] = (name, detail)
+        tasks.append((path, staged_path))
+
+    if not args.dry_run:
+        os.makedirs(staging_dir, exist_ok=True)
+    workers = max(1, min(args.workers, len(tasks)))
+    print(f"{len(tasks)} 枚の画像を {workers} プロセスで処理します。", file=sys.stderr)
+    started_at = time.monotonic()
+    try:
+        results = enroll_files(tasks, workers, args.max_side, args.upsample, _Progress(len(tasks))) if tasks else []
+        enrolled = [r for r in results if r["status"] == "enrolled"]
+        rejected.extend(r for r in results if r["status"] != "enrolled")
+
+        if enrolled and not args.dry_run:
+            store = EncodingStore(args.cache_dir, logger)
+            # アプリが既知の顔を読み込み直している間に FACES_DIR とキャッシュを書き換えないよう排他する
+            with store.locked():
+                items = []
+                for result in list(enrolled):
+                    name, filename = names[result["path"]]
+                    destination = os.path.join(args.faces_dir, filename)
+                    if os.path.exists(destination):
+                        # 計画した後に同じ名前のファイルが置かれた場合も上書きしない
+                        enrolled.remove(result)
+                        rejected.append(dict(result, status="error", detail=f"登録先に同じ名前のファイルがあります: {filename}"))
+                        continue
+                    # rename では mtime が変わらないため、キャッシュに記録した mtime・サイズのまま FACES_DIR に置ける
+                    os.replace(os.path.join(staging_dir, filename), destination)
+                    items.append((filename, name, result["encoding"], result["stat"], result["sha256"]))
+                total = store.add(items)
+            print(f"{args.cache_dir} に書き込みました (既知の顔 {total} 件)。")
+    finally:
+        if not args.dry_run:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+    elapsed = time.monotonic() - started_at
+
+    counts = {reason: 0 for reason in REJECT_REASONS}
+    for result in rejected:
+        counts[result["status"]] += 1
+    breakdown = ", ".join(f"{label} {counts[reason]}" for reason, label in REJECT_REASONS.items())
+    print(f"登録 {len(enrolled)} 枚 / 除外 {len(rejected)} 枚 ({breakdown}) - {elapsed:.1f} 秒 ({len(tasks) / elapsed:.1f} 枚/秒)")
+    if rejected:
+        rejected.sort(key=lambda r: r["path"])
+        write_report(args.report, rejected)
+        print(f"登録しなかった画像の一覧を {args.report} に書き出しました。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+import numpy as np
+
+UNKNOWN_NAME = "Unknown"
+
+
+def _squared_distances(queries, matrix, matrix_sq_norms):
+    """queries (M x D) と matrix (N x D) の二乗ユークリッド距離 (M x N) を行列積で計算する"""
+    query_sq_norms = np.einsum('ij,ij->i', queries, queries)
+    d2 = query_sq_norms[:, None] + matrix_sq_norms[None, :] - 2.0 * (queries @ matrix.T)
+    np.maximum(d2, 0.0, out=d2)
+    return d2
+
+
+def _kmeans(data, k, iterations, rng, chunk_size=8192):
+    """k-meansクラスタリング (NumPyのみ)。(重心, 各点の所属クラスタ) を返す"""
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    labels = np.empty(len(data), dtype=np.int64)
+    for _ in range(iterations):
+        centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+        # 距離行列が大きくなりすぎないように分割して所属を計算する
+        for start in range(0, len(data), chunk_size):
+            chunk = data[start:start + chunk_size]
+            labels[start:start + chunk_size] = np.argmin(_squared_distances(chunk, centroids, centroid_sq_norms), axis=1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, data)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        # 空のクラスタはランダムな点で置き直す
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), size=len(empty), replace=False)]
+    return centroids, labels
+
+
+class FaceGallery:
+    """既知の顔エンコーディングを連続したfloat32行列で保持し、一括照合を行うクラス
+
+    1フレーム内の全ての顔をまとめて1回の行列演算で照合する。登録数が ann_threshold を
+    超えた場合はk-meansで分割した転置インデックス (IVF) を作り、近いクラスタだけを探索する。
+    """
+    def __init__(self, encodings, names, threshold, ann_threshold=20000, ann_probes=8, seed=0):
+        self.matrix = np.ascontiguousarray(np.asarray(encodings, dtype=np.float32).reshape(-1, 128))
+        self.names = list(names)
+        self.threshold = threshold
+        self.sq_norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+        self.ann_probes = ann_probes
+
+        self.centroids = None
+        self.list_offsets = None
+        self.row_ids = None
+        if len(self.matrix) >= ann_threshold:
+            self._build_ivf(np.random.default_rng(seed))
+
+    def __len__(self):
+        return len(self.matrix)
+
+    @property
+    def uses_ann(self):
+        return self.centroids is not None
+
+    def _build_ivf(self, rng):
+        """転置インデックスを構築する。行列はクラスタ順に並べ替え、各クラスタを連続領域に置く"""
+        n_lists = max(1, int(np.sqrt(len(self.matrix))))
+        centroids, labels = _kmeans(self.matrix, n_lists, iterations=10, rng=rng)
+        order = np.argsort(labels, kind='stable')
+        self.matrix = np.ascontiguousarray(self.matrix[order])
+        self.sq_norms = self.sq_norms[order]
+        self.row_ids = order  # 並べ替え後の行 -> 元の登録順の行
+        self.centroids = centroids
+        self.centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+        self.list_offsets = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=n_lists))))
+
+    def _nearest_exact(self, queries):
+        d2 = _squared_distances(queries, self.matrix, self.sq_norms)
+        best = np.argmin(d2, axis=1)
+        return best, d2[np.arange(len(queries)), best]
+
+    def _nearest_ivf(self, queries):
+        probes = min(self.ann_probes, len(self.centroids))
+        centroid_d2 = _squared_distances(queries, self.centroids, self.centroid_sq_norms)
+        nearest_lists = np.argpartition(centroid_d2, probes - 1, axis=1)[:, :probes]
+
+        # 探索したクラスタが全て空だった顔は -1 (一致なし) のままにする
+        best = np.full(len(queries), -1, dtype=np.int64)
+        best_d2 = np.full(len(queries), np.inf, dtype=np.float32)
+        for i, lists in enumerate(nearest_lists):
+            query = queries[i:i + 1]
+            for l in lists:
+                start, end = self.list_offsets[l], self.list_offsets[l + 1]
+                if start == end:
+                    continue
+                # クラスタは連続領域に並んでいるのでコピーせずにスライスで照合できる
+                d2 = _squared_distances(query, self.matrix[start:end], self.sq_norms[start:end])[0]
+                j = np.argmin(d2)
+                if d2[j] < best_d2[i]:
+                    best[i] = start + j
+                    best_d2[i] = d2[j]
+        return best, best_d2
+
+    def match(self, face_encodings):
+        """顔エンコーディングのリストを照合し、(名前, 距離) のリストを返す。距離は登録がなければNone"""
+        if len(face_encodings) == 0:
+            return []
+        if len(self.matrix) == 0:
+            return [(UNKNOWN_NAME, None)] * len(face_encodings)
+
+        queries = np.asarray(face_encodings, dtype=np.float32).reshape(-1, 128)
+        if self.uses_ann:
+            best, best_d2 = self._nearest_ivf(queries)
+        else:
+            best, best_d2 = self._nearest_exact(queries)
+
+        results = []
+        for row, d2 in zip(best, best_d2):
+            if row < 0:
+                results.append((UNKNOWN_NAME, None))
+                continue
+            distance = float(np.sqrt(d2))
+            name_index = self.row_ids[row] if self.uses_ann else row
+            name = self.names[name_index] if distance <= self.threshold else UNKNOWN_NAME
+            results.append((name, distance))
+        return results
+
+
+def _pairwise_distances(a, b):
+    return np.sqrt(_squared_distances(a, b, np.einsum('ij,ij->i', b, b)))
+
+
+def _select_medoids(members, k, iterations=5):
+    """メンバーから代表となるk個のメドイド (実在するエンコーディング) の添字を選ぶ"""
+    if len(members) <= k:
+        return list(range(len(members)))
+    centroid = members.mean(axis=0, keepdims=True)
+    # 最も中心に近い点から始め、既に選んだ点から最も遠い点を順に加える
+    chosen = [int(np.argmin(_pairwise_distances(members, centroid)[:, 0]))]
+    while len(chosen) < k:
+        nearest = _pairwise_distances(members, members[chosen]).min(axis=1)
+        chosen.append(int(np.argmax(nearest)))
+    for _ in range(iterations):
+        labels = np.argmin(_pairwise_distances(members, members[chosen]), axis=1)
+        updated = []
+        for c in range(k):
+            cluster = np.flatnonzero(labels == c)
+            if len(cluster) == 0:
+                updated.append(chosen[c])
+                continue
+            within = _pairwise_distances(members[cluster], members[cluster]).sum(axis=1)
+            updated.append(int(cluster[np.argmin(within)]))
+        if updated == chosen:
+            break
+        chosen = updated
+    return chosen
+
+
+class IdentityGallery:
+    """人物ごとにエンコーディングをまとめ、代表点 (重心 + k個のメドイド) で照合するギャラリー
+
+    人物までの距離は、その人物の代表点と全エンコーディングのうち最も近いものまでの距離とする。
+    人物ごとの閾値は、各登録写真からその人物の他の写真 (または重心) までの距離の95パーセンタイルに margin を足して決め、
+    全体の閾値 threshold の min_factor〜max_factor 倍に収める。写真が min_samples 枚未満の人物は threshold を使う。
+    照合はまず代表点だけで行い、判定が閾値の近く (boundary_margin 以内) の場合と、
+    代表点から離れたメンバーの方が近い可能性がある場合だけ、候補の人物の全エンコーディングと照合し直す。
+    FaceGallery と同じく作成後は変更しないため、複数のスレッドからロックなしで使える。
+    """
+    def __init__(self, encodings, names, threshold, medoids=3, boundary_margin=0.05, threshold_margin=0.05,
+                 min_samples=3, min_factor=0.8, max_factor=1.2):
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+        self.threshold = threshold
+        self.boundary_margin = boundary_margin
+
+        # 人物ごとにメンバーを連続領域に並べる
+        groups = {}
+        for row, name in enumerate(names):
+            groups.setdefault(name, []).append(row)
+        self.names = list(groups)
+        self.members = np.ascontiguousarray(encodings[[row for rows in groups.values() for row in rows]]).reshape(-1, 128)
+        self.member_sq_norms = np.einsum('ij,ij->i', self.members, self.members)
+        self.member_offsets = np.concatenate(([0], np.cumsum([len(rows) for rows in groups.values()]))).astype(np.int64)
+
+        prototypes = []
+        prototype_counts = []
+        self.thresholds = np.empty(len(self.names), dtype=np.float32)
+        self.radii = np.empty(len(self.names), dtype=np.float32)
+        for i in range(len(self.names)):
+            members = self.members[self.member_offsets[i]:self.member_offsets[i + 1]]
+            centroid = members.mean(axis=0, keepdims=True)
+            if len(members) == 1:
+                identity_prototypes = members
+            else:
+                identity_prototypes = np.vstack([centroid, members[_select_medoids(members, medoids)]])
+            prototypes.append(identity_prototypes)
+            prototype_counts.append(len(identity_prototypes))
+            # 代表点から最も離れたメンバーまでの距離 (この範囲内にメンバーが全て含まれる)
+            self.radii[i] = _pairwise_distances(members, identity_prototypes).min(axis=1).max()
+
+            if len(members) < min_samples:
+                self.thresholds[i] = threshold
+            else:
+                # 新しい写真がその人物からどのくらい離れるかを、各写真を除いた残りとの距離で見積もる
+                within = _pairwise_distances(members, members)
+                np.fill_diagonal(within, np.inf)
+                nearest = np.minimum(within.min(axis=1), _pairwise_distances(members, centroid)[:, 0])
+                spread = float(np.percentile(nearest, 95))
+                self.thresholds[i] = np.clip(spread + threshold_margin, threshold * min_factor, threshold * max_factor)
+
+        self.prototypes = np.ascontiguousarray(np.vstack(prototypes)) if prototypes else np.empty((0, 128), dtype=np.float32)
+        self.prototype_sq_norms = np.einsum('ij,ij->i', self.prototypes, self.prototypes)
+        self.prototype_offsets = np.concatenate(([0], np.cumsum(prototype_counts))).astype(np.int64)
+
+    def __len__(self):
+        return len(self.members)
+
+    @property
+    def prototype_count(self):
+        return len(self.prototypes)
+
+    def match(self, face_encodings):
+        """顔エンコーディングのリストを照合し、(名前, 距離) のリストを返す。距離は登録がなければNone"""
+        return self.match_detailed(face_encodings)[0]
+
+    def match_detailed(self, face_encodings):
+        """match() の結果と、各顔で全エンコーディングとの照合に切り替えたかどうかのリストを返す"""
+        if len(face_encodings) == 0:
+            return [], []
+        if len(self.members) == 0:
+            return [(UNKNOWN_NAME, None)] * len(face_encodings), [False] * len(face_encodings)
+
+        queries = np.asarray(face_encodings, dtype=np.float32).reshape(-1, 128)
+        d2 = _squared_distances(queries, self.prototypes, self.prototype_sq_norms)
+        # 人物ごとに最も近い代表点までの距離 (M x 人数)
+        identity_distances = np.sqrt(np.minimum.reduceat(d2, self.prototype_offsets[:-1], axis=1))
+
+        results = []
+        fallbacks = []
+        for query, distances in zip(queries, identity_distances):
+            best = int(np.argmin(distances))
+            distance = float(distances[best])
+            if distance <= self.thresholds[best] - self.boundary_margin:
+                results.append((self.names[best], distance))
+                fallbacks.append(False)
+                continue
+            # 代表点より近いメンバーがいて閾値を下回る可能性のある人物だけを全エンコーディングで照合する
+            candidates = np.flatnonzero(distances - self.radii <= self.thresholds)
+            if len(candidates) == 0:
+                results.append((UNKNOWN_NAME, distance))
+                fallbacks.append(False)
+                continue
+            fallbacks.append(True)
+            best_name, best_distance, best_margin = UNKNOWN_NAME, distance, np.inf
+            for i in candidates:
+                start, end = self.member_offsets[i], self.member_offsets[i + 1]
+                member_d2 = _squared_distances(query[None, :], self.members[start:end], self.member_sq_norms[start:end])[0]
+                member_distance = min(float(np.sqrt(member_d2.min())), float(distances[i]))
+                # 閾値との差が最も大きい (最も確からしい) 人物を選ぶ
+                margin = member_distance - self.thresholds[i]
+                if margin <= 0 and margin < best_margin:
+                    best_name, best_distance, best_margin = self.names[i], member_distance, margin
+                elif best_margin == np.inf and member_distance < best_distance:
+                    best_distance = member_distance
+            results.append((best_name, best_distance))
+        return results, fallbacks
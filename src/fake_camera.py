@@ -0,0 +1,116 @@
+"""ESP32-CAMの代わりにJPEGファイルを配信するWebSocketサーバー
+
+ファームウェア (firmware/Face_detection/app_httpd.cpp) と同じテキストプロトコルを話すため、
+実機なしで受信・再接続・認識の動作確認ができる。
+
+使用例:
+    python src/fake_camera.py --images ./frames --port 8080
+    WS_URL=ws://localhost:8080 python src/headless.py
+"""
+import os
+import asyncio
+import argparse
+import logging
+import websockets
+
+logger = logging.getLogger("fake_camera")
+
+
+class FakeCamera:
+    """JPEGファイルを順番に (最後まで行ったら先頭に戻って) 送信する疑似カメラ
+
+    fail_every に1以上を指定すると、そのフレーム数ごとに "error:frame_capture_failed" を送信する。
+    drop_after に1以上を指定すると、そのフレーム数を送信した後に接続を切断する (再接続の確認用)。
+    """
+    def __init__(self, frames, fps=1, resolution="160x120", fail_every=0, drop_after=0):
+        self.frames = frames
+        self.fps = fps
+        self.resolution = resolution
+        self.fail_every = fail_every
+        self.drop_after = drop_after
+        self.frames_sent = 0
+
+    async def handle(self, ws, path=None):
+        logger.info("クライアントが接続しました。")
+        await ws.send("from_esp32: client connected")
+        await ws.send(f"current_fps:{self.fps}")
+        await ws.send(f"current_resolution:{self.resolution}")
+
+        streaming = asyncio.Event()
+        sender = asyncio.ensure_future(self._stream(ws, streaming))
+        try:
+            async for msg in ws:
+                if not isinstance(msg, str):
+                    continue
+                logger.info(f"Received message: {msg}")
+                if msg.startswith("SET_FPS:"):
+                    fps = int(msg[len("SET_FPS:"):] or 0)
+                    if 0 < fps <= 30:
+                        self.fps = fps
+                elif msg.startswith("SET_RESOLUTION:"):
+                    self.resolution = msg[len("SET_RESOLUTION:"):]
+                elif msg == "start_stream":
+                    streaming.set()
+                elif msg == "stop_stream":
+                    streaming.clear()
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            sender.cancel()
+            logger.info("クライアントが切断しました。")
+
+    async def _stream(self, ws, streaming):
+        sent_on_connection = 0
+        while True:
+            await streaming.wait()
+            self.frames_sent += 1
+            if self.fail_every and self.frames_sent % self.fail_every == 0:
+                await ws.send("error:frame_capture_failed")
+            else:
+                await ws.send(self.frames[self.frames_sent % len(self.frames)])
+            sent_on_connection += 1
+            if self.drop_after and sent_on_connection >= self.drop_after:
+                logger.info("接続を切断します (drop_after)。")
+                await ws.close()
+                return
+            await asyncio.sleep(1.0 / self.fps)
+
+
+def load_jpeg_files(images_dir):
+    """ディレクトリ内のJPEGファイルをファイル名順に読み込む"""
+    frames = []
+    for filename in sorted(os.listdir(images_dir)):
+        if filename.lower().endswith((".jpg", ".jpeg")):
+            with open(os.path.join(images_dir, filename), "rb") as f:
+                frames.append(f.read())
+    if not frames:
+        raise ValueError(f"JPEGファイルが見つかりません: {images_dir}")
+    return frames
+
+
+async def serve(camera, host, port):
+    async with websockets.serve(camera.handle, host, port, max_size=None):
+        logger.info(f"疑似カメラを起動しました: ws://{host}:{port} (フレーム数: {len(camera.frames)})")
+        await asyncio.Future()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JPEGファイルを配信する疑似ESP32-CAMサーバー")
+    parser.add_argument("--images", required=True, help="配信するJPEGファイルのディレクトリ")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--fps", type=int, default=1, help="初期FPS (SET_FPSで変更される)")
+    parser.add_argument("--fail-every", type=int, default=0, help="このフレーム数ごとにフレーム取得失敗を通知する")
+    parser.add_argument("--drop-after", type=int, default=0, help="このフレーム数を送信するたびに接続を切断する")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s]: %(message)s")
+    camera = FakeCamera(load_jpeg_files(args.images), fps=args.fps, fail_every=args.fail_every, drop_after=args.drop_after)
+    try:
+        asyncio.run(serve(camera, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
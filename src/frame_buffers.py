@@ -0,0 +1,59 @@
+import sys
+import threading
+import numpy as np
+
+
+def _refcount_at(buffers, index):
+    return sys.getrefcount(buffers[index])
+
+
+def read_only(array):
+    """書き込みできないビューを返す (元の配列を参照し続けるため、プールの配列は使用中のままになる)"""
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+class FramePool:
+    """解像度 (配列の形) ごとに確保済みのフレーム用配列を使い回すプール
+
+    配列が使用中かどうかはPythonの参照カウントで判断する。acquire() で受け取った配列やそのビュー
+    (スライス・read_only() を含む) がどこかに残っている間は使用中で、全て手放されると次の acquire() で再利用される。
+    キューから破棄されたフレームも明示的に返却する必要はない。
+    形ごとに max_per_shape 個まで確保し、全て使用中の場合はプールに入れない配列を新しく確保して返す (overflow_count に数える)。
+    """
+    def __init__(self, max_per_shape=8):
+        self.max_per_shape = max_per_shape
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self.allocated_count = 0
+        self.overflow_count = 0
+        # プールのリストだけが参照している状態の参照カウント (Pythonのバージョンによって異なるため実測する)
+        probe = [np.empty(1, dtype=np.uint8)]
+        self._free_refcount = _refcount_at(probe, 0)
+
+    def acquire(self, shape, dtype=np.uint8):
+        """指定した形の書き込み可能な配列を返す (内容は前回使った時のまま)"""
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            buffers = self._buffers.setdefault(key, [])
+            for i in range(len(buffers)):
+                if _refcount_at(buffers, i) <= self._free_refcount:
+                    return buffers[i]
+            if len(buffers) < self.max_per_shape:
+                buffers.append(np.empty(shape, dtype=dtype))
+                self.allocated_count += 1
+                return buffers[-1]
+            self.overflow_count += 1
+        return np.empty(shape, dtype=dtype)
+
+    def stats(self):
+        """形ごとの確保数と使用中の数を返す"""
+        with self._lock:
+            return {
+                "x".join(str(v) for v in key[0]): {
+                    "allocated": len(buffers),
+                    "in_use": sum(1 for i in range(len(buffers)) if _refcount_at(buffers, i) > self._free_refcount),
+                }
+                for key, buffers in self._buffers.items()
+            }
@@ -0,0 +1,315 @@
+import time
+import threading
+from collections import deque
+
+
+def collect_batch(get, first, max_items, max_wait):
+    """first を先頭に、get(timeout) で最大 max_items 件、最初の要素から max_wait 秒まで集める
+
+    get() は要素がなければNoneを返す関数。バッチの終わりを示す値 (ワーカーの終了指示など) の扱いは呼び出し側で行う。
+    """
+    batch = [first]
+    deadline = time.monotonic() + max_wait
+    while len(batch) < max_items:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        item = get(remaining)
+        if item is None:
+            break
+        batch.append(item)
+    return batch
+
+
+class DropOldestQueue:
+    """容量を超えると最も古い要素を破棄する、スレッドセーフな固定長キュー"""
+    def __init__(self, maxsize):
+        self._items = deque()
+        self._maxsize = maxsize
+        self._cond = threading.Condition()
+        self._closed = False
+        self.put_count = 0
+        self.dropped_count = 0
+
+    def put(self, item):
+        """要素を追加する。満杯なら最も古い要素を破棄する"""
+        with self._cond:
+            if len(self._items) >= self._maxsize:
+                self._items.popleft()
+                self.dropped_count += 1
+            self._items.append(item)
+            self.put_count += 1
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """要素を取り出す。タイムアウトまたはクローズ時はNoneを返す"""
+        with self._cond:
+            if not self._items and not self._closed:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            return self._items.popleft()
+
+    def close(self):
+        """待機中の取り出しを解除する"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def reopen(self):
+        """クローズを解除し、残っている要素を破棄する"""
+        with self._cond:
+            self._closed = False
+            self._items.clear()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+
+class FairQueue:
+    """カメラごとに古いものから破棄する固定長キューを持ち、カメラ間をラウンドロビンで取り出すキュー
+
+    要素は (camera_id, payload) のタプル。フレームレートの高いカメラが他のカメラの処理枠を
+    奪わないように、取り出しは要素のあるカメラを順番に回る。
+    """
+    def __init__(self, maxsize_per_camera):
+        self._queues = {}
+        self._order = []
+        self._next_index = 0
+        self._maxsize = maxsize_per_camera
+        self._cond = threading.Condition()
+        self._closed = False
+        self._put_counts = {}
+        self._dropped_counts = {}
+
+    @property
+    def put_count(self):
+        return sum(self._put_counts.values())
+
+    @property
+    def dropped_count(self):
+        return sum(self._dropped_counts.values())
+
+    def _camera_items(self, camera_id):
+        items = self._queues.get(camera_id)
+        if items is None:
+            items = self._queues[camera_id] = deque()
+            self._order.append(camera_id)
+            self._put_counts[camera_id] = 0
+            self._dropped_counts[camera_id] = 0
+        return items
+
+    def offer(self, item):
+        """そのカメラのキューが空の場合だけ要素を追加する (より新しい要素を押し出さない)。追加したかを返す"""
+        camera_id = item[0]
+        with self._cond:
+            items = self._camera_items(camera_id)
+            if items:
+                return False
+            items.append(item)
+            self._put_counts[camera_id] += 1
+            self._cond.notify()
+            return True
+
+    def put(self, item):
+        """要素を追加する。そのカメラのキューが満杯なら最も古い要素を破棄する"""
+        camera_id = item[0]
+        with self._cond:
+            items = self._camera_items(camera_id)
+            if len(items) >= self._maxsize:
+                items.popleft()
+                self._dropped_counts[camera_id] += 1
+            items.append(item)
+            self._put_counts[camera_id] += 1
+            self._cond.notify()
+
+    def _pop_next(self):
+        for i in range(len(self._order)):
+            index = (self._next_index + i) % len(self._order)
+            items = self._queues[self._order[index]]
+            if items:
+                self._next_index = index + 1
+                return items.popleft()
+        return None
+
+    def get(self, timeout=None):
+        """次のカメラの要素を取り出す。タイムアウトまたはクローズ時はNoneを返す"""
+        with self._cond:
+            item = self._pop_next()
+            if item is None and not self._closed:
+                self._cond.wait(timeout)
+                item = self._pop_next()
+            return item
+
+    def close(self):
+        """待機中の取り出しを解除する"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def reopen(self):
+        """クローズを解除し、残っている要素を破棄する"""
+        with self._cond:
+            self._closed = False
+            for items in self._queues.values():
+                items.clear()
+
+    def __len__(self):
+        with self._cond:
+            return sum(len(items) for items in self._queues.values())
+
+    def stats_by_camera(self):
+        """カメラごとのキュー長・投入数・破棄数を返す"""
+        with self._cond:
+            return {
+                camera_id: {
+                    "depth": len(self._queues[camera_id]),
+                    "received": self._put_counts[camera_id],
+                    "dropped": self._dropped_counts[camera_id],
+                }
+                for camera_id in self._order
+            }
+
+
+class PipelineStage:
+    """入力キューから (camera_id, payload) を取り出して func(camera_id, payload) で処理し、結果を次のキューに渡すワーカー
+
+    batch_size が2以上なら、最初の要素から batch_wait 秒以内に届いた要素を最大 batch_size 件まとめて
+    func(items) で処理する (items は (camera_id, payload) のリスト)。この場合は出力キューを使わない。
+    """
+    def __init__(self, name, func, input_queue, output_queue, logger, workers=1, batch_size=1, batch_wait=0.0):
+        self.name = name
+        self.func = func
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.logger = logger
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.processed_count = 0
+        self.error_count = 0
+        self._count_lock = threading.Lock()
+        self._threads = []
+        self._stop_event = threading.Event()
+
+    def start(self):
+        self._stop_event.clear()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        self.input_queue.close()
+        for t in self._threads:
+            t.join(timeout=timeout)
+            if t.is_alive():
+                self.logger.warning(f"パイプラインステージ '{self.name}' のスレッドがタイムアウト後も終了していません。")
+        self._threads = []
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            item = self.input_queue.get(timeout=0.5)
+            if item is None:
+                continue
+            if self.batch_size > 1:
+                self._run_batch(item)
+                continue
+            camera_id, payload = item
+            try:
+                result = self.func(camera_id, payload)
+            except Exception as e:
+                with self._count_lock:
+                    self.error_count += 1
+                self.logger.error(f"パイプラインステージ '{self.name}' で処理中にエラーが発生しました: {e}")
+                continue
+            with self._count_lock:
+                self.processed_count += 1
+            if result is not None and self.output_queue is not None:
+                self.output_queue.put((camera_id, result))
+
+    def _run_batch(self, first):
+        items = collect_batch(lambda timeout: self.input_queue.get(timeout=timeout), first, self.batch_size, self.batch_wait)
+        try:
+            self.func(items)
+        except Exception as e:
+            with self._count_lock:
+                self.error_count += len(items)
+            self.logger.error(f"パイプラインステージ '{self.name}' で処理中にエラーが発生しました: {e}")
+            return
+        with self._count_lock:
+            self.processed_count += len(items)
+
+
+class FramePipeline:
+    """受信・デコード・認識を分離したフレーム処理パイプライン
+
+    受信スレッドはJPEGバイト列をリングバッファに積むだけにし、デコードと認識は
+    別スレッドで行う。各キューはカメラごとに満杯になると古いフレームを捨てるため、
+    認識処理は常に最新のフレームに対して行われ、複数カメラは順番に処理される。
+    recognize_batch_size が2以上なら recognize_func はフレームのリストを受け取る (PipelineStage を参照)。
+    """
+    def __init__(self, decode_func, recognize_func, logger, raw_queue_size=2, decoded_queue_size=1, recognize_workers=1,
+                 recognize_batch_size=1, recognize_batch_wait=0.0):
+        self.logger = logger
+        self.raw_queue = FairQueue(raw_queue_size)
+        self.decoded_queue = FairQueue(decoded_queue_size)
+        self.decode_stage = PipelineStage("decode", decode_func, self.raw_queue, self.decoded_queue, logger)
+        self.recognize_stage = PipelineStage(
+            "recognize", recognize_func, self.decoded_queue, None, logger, workers=recognize_workers,
+            batch_size=recognize_batch_size, batch_wait=recognize_batch_wait
+        )
+        self.is_running = False
+
+    def start(self):
+        if self.is_running:
+            return
+        self.raw_queue.reopen()
+        self.decoded_queue.reopen()
+        self.decode_stage.start()
+        self.recognize_stage.start()
+        self.is_running = True
+        self.logger.info("フレーム処理パイプラインを開始しました。")
+
+    def stop(self):
+        if not self.is_running:
+            return
+        self.is_running = False
+        self.decode_stage.stop()
+        self.recognize_stage.stop()
+        self.logger.info("フレーム処理パイプラインを停止しました。")
+
+    def submit(self, camera_id, jpeg_bytes):
+        """受信したJPEGバイト列をパイプラインに投入する (受信スレッドから呼ばれる)"""
+        self.raw_queue.put((camera_id, jpeg_bytes))
+
+    def resubmit_decoded(self, camera_id, payload):
+        """デコード済みのフレームを認識ステージに戻す。同じカメラの新しいフレームが待っている場合は戻さない"""
+        return self.decoded_queue.offer((camera_id, payload))
+
+    def stats(self):
+        """ステージごとのキュー長・処理数・破棄数を返す"""
+        return {
+            "receive": {
+                "received": self.raw_queue.put_count,
+                "depth": len(self.raw_queue),
+                "dropped": self.raw_queue.dropped_count,
+            },
+            "decode": {
+                "processed": self.decode_stage.processed_count,
+                "errors": self.decode_stage.error_count,
+                "depth": len(self.decoded_queue),
+                "dropped": self.decoded_queue.dropped_count,
+            },
+            "recognize": {
+                "processed": self.recognize_stage.processed_count,
+                "errors": self.recognize_stage.error_count,
+            },
+            "cameras": {
+                camera_id: {"receive": raw, "decode": decoded.get(camera_id)}
+                for decoded in [self.decoded_queue.stats_by_camera()]
+                for camera_id, raw in self.raw_queue.stats_by_camera().items()
+            },
+        }
@@ -0,0 +1,99 @@
+import time
+import queue
+import struct
+import threading
+
+# 記録ファイルの形式:
+#   先頭にマジックナンバー、その後にフレームごとのレコードが続く。
+#   レコード = 受信時刻 (float64, UNIX時刻) + JPEGの長さ (uint32) + JPEGバイト列 (すべてリトルエンディアン)
+MAGIC = b"ESP32FRM"
+_RECORD_HEADER = struct.Struct("<dI")
+
+
+class FrameRecorder:
+    """受信したJPEGフレームを記録ファイルに追記するクラス
+
+    write() は受信スレッド (ASYNC_INGEST の場合はイベントループ) から呼ばれるため、キューに積むだけにして
+    ファイルへの書き込みは専用のスレッドで行う。キューが満杯なら記録せずに dropped_count に数える。
+    """
+    def __init__(self, path, queue_size=256):
+        self.path = path
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._closed = False
+        self.frame_count = 0
+        self.dropped_count = 0
+        self._thread = threading.Thread(target=self._run, name="frame-recorder", daemon=True)
+        self._thread.start()
+
+    def write(self, jpeg_bytes, timestamp=None):
+        if self._closed:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        try:
+            self._queue.put_nowait((timestamp, jpeg_bytes))
+        except queue.Full:
+            self.dropped_count += 1
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            timestamp, jpeg_bytes = item
+            self._file.write(_RECORD_HEADER.pack(timestamp, len(jpeg_bytes)))
+            self._file.write(jpeg_bytes)
+            self.frame_count += 1
+
+    def close(self):
+        """キューに残っているフレームを書き出してからファイルを閉じる"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+
+
+def read_frames(path):
+    """記録ファイルから (受信時刻, JPEGバイト列) を順番に返す
+
+    記録中に終了した場合など、末尾のレコードが途中で切れていればそこで終わる。
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"フレーム記録ファイルではありません: {path}")
+        while True:
+            header = f.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                return
+            timestamp, length = _RECORD_HEADER.unpack(header)
+            jpeg_bytes = f.read(length)
+            if len(jpeg_bytes) < length:
+                return
+            yield timestamp, jpeg_bytes
+
+
+def replay(frames, submit, realtime=False, speed=1.0, stop_event=None):
+    """(受信時刻, JPEGバイト列) のフレームを submit(jpeg_bytes) に渡す
+
+    realtime=True の場合は記録時の間隔 (speed 倍速) で、False の場合は待たずに渡す。
+    渡したフレーム数を返す。
+    """
+    start = time.perf_counter()
+    first_timestamp = None
+    count = 0
+    for timestamp, jpeg_bytes in frames:
+        if stop_event is not None and stop_event.is_set():
+            break
+        if realtime:
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            delay = (timestamp - first_timestamp) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        submit(jpeg_bytes)
+        count += 1
+    return count
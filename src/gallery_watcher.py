@@ -0,0 +1,66 @@
+import os
+import threading
+
+
+class GalleryWatcher:
+    """既知の顔のディレクトリをmtimeポーリングで監視し、変更があれば on_change() を呼ぶクラス
+
+    list_files() は監視対象のファイル名のリストを返す関数。
+    コピー途中のファイルを読まないよう、変更を見つけてから次のポーリングまで内容が変わらなかった時に通知する。
+    on_change() は監視スレッドで呼ばれるため、認識処理を止めずに再エンコードできる。
+    """
+    def __init__(self, faces_dir, list_files, on_change, logger, interval=5.0):
+        self.faces_dir = faces_dir
+        self.list_files = list_files
+        self.on_change = on_change
+        self.logger = logger
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _signature(self):
+        signature = {}
+        for filename in self.list_files():
+            try:
+                st = os.stat(os.path.join(self.faces_dir, filename))
+            except OSError:
+                continue
+            signature[filename] = (st.st_mtime_ns, st.st_size)
+        return signature
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="gallery-watcher", daemon=True)
+        self._thread.start()
+        self.logger.info(f"{self.faces_dir} の監視を開始しました ({self.interval} 秒ごと)。")
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout=2.0)
+        self._thread = None
+
+    def _run(self):
+        last = self._signature()
+        pending = None
+        while not self._stop_event.wait(self.interval):
+            try:
+                signature = self._signature()
+            except OSError as e:
+                self.logger.error(f"{self.faces_dir} の監視中にエラーが発生しました: {e}")
+                continue
+            if signature == last:
+                pending = None
+                continue
+            if signature != pending:
+                # 書き込み中かもしれないので、次のポーリングで変わっていないことを確認する
+                pending = signature
+                continue
+            self.logger.info(f"{self.faces_dir} の変更を検出しました。既知の顔を再読み込みします。")
+            try:
+                self.on_change()
+            except Exception as e:
+                self.logger.error(f"既知の顔の再読み込み中にエラーが発生しました: {e}")
+            last = signature
+            pending = None
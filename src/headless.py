@@ -0,0 +1,61 @@
+"""GUIなしで顔認識を実行するエントリーポイント
+
+認識結果などのイベントを1行1イベントのJSON (JSON Lines) として出力する。
+ログは標準エラー出力とログファイルに出力される。
+
+使用例:
+    python src/headless.py > events.jsonl
+    python src/headless.py --output events.jsonl
+"""
+import sys
+import json
+import signal
+import argparse
+import threading
+from logging_handlers import setup_logging
+from recognition_service import RecognitionService
+
+
+class JsonLinesWriter:
+    """RecognitionServiceのイベントをJSON Linesとして書き出すコンシューマー"""
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def __call__(self, event, frame):
+        line = json.dumps(event, ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+def main():
+    """ヘッドレスモードのエントリーポイント"""
+    parser = argparse.ArgumentParser(description="GUIなしで顔認識を実行し、イベントをJSON Linesで出力する")
+    parser.add_argument("--output", default="-", help="イベントの出力先ファイル (デフォルト: 標準出力)")
+    args = parser.parse_args()
+
+    # 標準出力はイベント用に空けておく
+    logger = setup_logging(__name__, console_stream="ext://sys.stderr")
+    stream = sys.stdout if args.output == "-" else open(args.output, "a", encoding="utf-8")
+
+    service = RecognitionService(logger)
+    service.subscribe(JsonLinesWriter(stream))
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+
+    service.start()
+    while not stop_event.wait(1.0):
+        pass
+
+    logger.info("終了処理を開始します。")
+    service.shutdown()
+    if stream is not sys.stdout:
+        stream.close()
+    logger.info("アプリケーションを終了しました。")
+
+
+if __name__ == "__main__":
+    main()
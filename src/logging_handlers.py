@@ -1,15 +1,160 @@
+import json
 import logging
-import tkinter as tk
+import logging.config
+import threading
+import time
 
 class TkinterHandler(logging.Handler):
     """
     A logging handler that sends log messages to a Tkinter Text widget.
+
+    emit() はどのスレッドからでも呼べ、行をバッファに溜めるだけでウィジェットには触らない。
+    GUIスレッドが定期的に drain_to_widget() を呼ぶと、溜まった行を1回の insert でまとめて追加する。
+
+    - 同じロガー・レベル・メッセージが続いた場合は1行にまとめ、末尾に回数を付ける (例: "顔を検出しました: X ×120")。
+    - INFO以下の新しい行はロガーごとに毎秒 rate 行 (最大 burst 行まで連続) に制限し、超えた分は省略した件数だけを表示する。
+      WARNING以上は大量のINFOに埋もれないよう制限せずに必ず表示する (同じ行の集約だけは行う)。
+    - ウィジェットの行数は max_lines までとし、超えた分は古い行から削除する。
+
+    ここでの省略・集約は表示だけで、ファイルなど他のハンドラーには全てのレコードが渡る。
     """
-    def __init__(self, text_widget, log_queue):
+    def __init__(self, text_widget, max_lines=1000, rate=5.0, burst=20, notice_interval=1.0):
         super().__init__()
         self.text_widget = text_widget
-        self.log_queue = log_queue
+        self.max_lines = max_lines
+        self.rate = rate
+        self.burst = burst
+        self.notice_interval = notice_interval
+        self.coalesced_count = 0
+        self.suppressed_count = 0
+        self._pending = [] # [(logger名, レベル, メッセージ), 整形した行, 回数] のリスト
+        self._buckets = {} # logger名 -> [残りの行数, 最後に補充した時刻, 省略した件数]
+        self._last_key = None # ウィジェットの最後の行のキー (次のバッチで回数を足せるようにする)
+        self._last_line = None # ウィジェットの最後の行の [整形した行, 回数]
+        self._last_notice = 0.0
+        self._buffer_lock = threading.Lock()
 
     def emit(self, record):
-        log_entry = self.format(record)
-        self.log_queue.put(log_entry)
+        try:
+            key = (record.name, record.levelno, record.getMessage())
+            with self._buffer_lock:
+                if self._pending and self._pending[-1][0] == key:
+                    self._pending[-1][2] += 1
+                    self.coalesced_count += 1
+                    return
+                if not self._pending and key == self._last_key:
+                    # 表示済みの最後の行と同じなので、次のバッチでその行の回数を増やす
+                    self._pending.append([key, None, 1])
+                    self.coalesced_count += 1
+                    return
+                if record.levelno < logging.WARNING and not self._take_token(record.name, record.created):
+                    return
+            log_entry = self.format(record)
+            with self._buffer_lock:
+                self._pending.append([key, log_entry, 1])
+        except Exception:
+            self.handleError(record)
+
+    def _take_token(self, name, now):
+        """ロガーごとのトークンバケットから1行分を取る。取れなければ省略した件数を数えてFalseを返す"""
+        bucket = self._buckets.get(name)
+        if bucket is None:
+            bucket = self._buckets[name] = [float(self.burst), now, 0]
+        bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1.0:
+            bucket[2] += 1
+            self.suppressed_count += 1
+            return False
+        bucket[0] -= 1.0
+        return True
+
+    def _take_notices(self):
+        """省略した件数のお知らせ行を返す (notice_interval 秒に1回まで)"""
+        now = time.time()
+        if now - self._last_notice < self.notice_interval:
+            return []
+        notices = []
+        for name, bucket in self._buckets.items():
+            if bucket[2]:
+                notices.append(f"({name}: ログが多いため {bucket[2]} 件を表示しませんでした。ログファイルには全て記録されています)")
+                bucket[2] = 0
+        if notices:
+            self._last_notice = now
+        return notices
+
+    def drain_to_widget(self):
+        """溜まった行をウィジェットに追加する (GUIスレッドから呼ぶ)"""
+        with self._buffer_lock:
+            pending, self._pending = self._pending, []
+            notices = self._take_notices()
+            if pending:
+                self._last_key = pending[-1][0] if not notices else None
+            elif notices:
+                self._last_key = None
+        if not pending and not notices:
+            return
+
+        replace_last = False
+        if pending and pending[0][1] is None:
+            # 表示済みの最後の行と同じメッセージの続き
+            if self._last_line is not None:
+                self._last_line[1] += pending[0][2]
+                pending[0][1], pending[0][2] = self._last_line
+                replace_last = True
+            else:
+                pending = pending[1:]
+        lines = [text if count == 1 else f"{text} ×{count}" for _, text, count in pending]
+        lines.extend(notices)
+        if not lines:
+            return
+        if pending and not notices:
+            self._last_line = [pending[-1][1], pending[-1][2]]
+        else:
+            self._last_line = None
+
+        widget = self.text_widget
+        widget.config(state="normal")
+        if replace_last:
+            widget.delete("end-2l linestart", "end-1c")
+        widget.insert("end", "\n".join(lines) + "\n")
+        excess = int(widget.index("end-1c").split(".")[0]) - 1 - self.max_lines
+        if excess > 0:
+            widget.delete("1.0", f"{excess + 1}.0")
+        widget.yview("end")
+        widget.config(state="disabled")
+
+
+def setup_logging(logger_name, console_stream=None):
+    """log_config.json からロギングを設定し、ロガーを返す
+
+    TkinterHandlerはGUI要素が必要なので、ここでは設定しない。
+    console_stream を指定するとコンソール出力先を変更する (例: "ext://sys.stderr")。
+    """
+    with open('log_config.json', 'r', encoding='utf-8') as f:
+        log_cfg = json.load(f)
+
+    temp_handlers = {}
+    if 'consoleHandler' in log_cfg['handlers']:
+        temp_handlers['consoleHandler'] = dict(log_cfg['handlers']['consoleHandler'])
+        if console_stream:
+            temp_handlers['consoleHandler']['stream'] = console_stream
+    if 'fileHandler' in log_cfg['handlers']:
+        temp_handlers['fileHandler'] = log_cfg['handlers']['fileHandler']
+
+    partial_log_config = {
+        "version": 1,
+        "disable_existing_loggers": False,
+        "formatters": log_cfg.get('formatters', {}),
+        "handlers": temp_handlers,
+        "loggers": {
+            logger_name: {
+                "level": log_cfg.get('loggers', {}).get('__main__', {}).get('level', 'DEBUG'),
+                "handlers": [h for h in temp_handlers.keys()],
+                "propagate": False
+            }
+        },
+        "root": log_cfg.get('root', {"level": "INFO"})
+    }
+    logging.config.dictConfig(partial_log_config)
+    return logging.getLogger(logger_name)
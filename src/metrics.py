@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from stage_timer import TimingSpan
+
+METRIC_PREFIX = "facerec_"
+STAGE_SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+MATCH_DISTANCE_BUCKETS = tuple(round(0.05 * i, 2) for i in range(1, 21))
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # 最後は +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        result = []
+        for le, c in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += c
+            result.append((le, total))
+        return result
+
+
+class Metrics:
+    """カウンターとヒストグラムを保持する軽量なメトリクスレジストリ
+
+    LatencyRecorder と同じ time(stage) / record(stage, seconds) を持つため、FaceRecognizer の timer に渡すと
+    ステージごとの処理時間が stage_seconds ヒストグラムに記録される。
+    add_collector() で登録した関数は出力時に呼ばれ、他のオブジェクトが持つ値 (キューの破棄数など) を返す。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._descriptions = {}
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self.describe("stage_seconds", "histogram", "ステージごとの処理時間 (秒)", STAGE_SECONDS_BUCKETS)
+
+    def describe(self, name, kind, help_text, buckets=None):
+        """メトリクスの種類 (counter / gauge / histogram) と説明を登録する"""
+        self._descriptions[name] = (kind, help_text, buckets)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self._descriptions[name][2])
+            histogram.observe(value)
+
+    def time(self, stage):
+        return TimingSpan(self, stage)
+
+    def record(self, stage, seconds):
+        self.observe("stage_seconds", seconds, stage=stage)
+
+    def add_collector(self, func):
+        """func() は (name, labels, value) を返すイテラブル。値は出力時に取得する"""
+        self._collectors.append(func)
+
+    def _collect(self):
+        with self._lock:
+            values = dict(self._counters)
+            histograms = {
+                key: (h.cumulative(), h.sum, h.count)
+                for key, h in self._histograms.items()
+            }
+        for func in self._collectors:
+            for name, labels, value in func():
+                values[(name, _label_key(labels))] = value
+        return values, histograms
+
+    def snapshot(self):
+        """JSONに変換できる形でメトリクスを返す"""
+        values, histograms = self._collect()
+        result = {"timestamp": time.time(), "values": {}, "histograms": {}}
+        for (name, key), value in sorted(values.items()):
+            result["values"].setdefault(name, []).append({"labels": dict(key), "value": value})
+        for (name, key), (cumulative, total, count) in sorted(histograms.items()):
+            result["histograms"].setdefault(name, []).append({
+                "labels": dict(key),
+                "count": count,
+                "sum": total,
+                "mean": total / count if count else None,
+                "buckets": {str(le): c for le, c in cumulative},
+            })
+        return result
+
+    def render_prometheus(self):
+        """Prometheusのテキスト形式でメトリクスを返す"""
+        values, histograms = self._collect()
+        lines = []
+        described = set()
+
+        def header(name):
+            if name in described:
+                return
+            described.add(name)
+            kind, help_text, _ = self._descriptions.get(name, ("untyped", "", None))
+            lines.append(f"# HELP {METRIC_PREFIX}{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} {kind}")
+
+        for (name, key), value in sorted(values.items()):
+            header(name)
+            lines.append(f"{METRIC_PREFIX}{name}{_format_labels(key)} {value}")
+        for (name, key), (cumulative, total, count) in sorted(histograms.items()):
+            header(name)
+            for le, c in cumulative:
+                lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(key, [('le', le)])} {c}")
+            lines.append(f"{METRIC_PREFIX}{name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{METRIC_PREFIX}{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """/metrics (Prometheus形式) と /metrics.json を返すローカルHTTPサーバー"""
+    def __init__(self, metrics, port, logger, host="127.0.0.1"):
+        self.metrics = metrics
+        self.port = port
+        self.host = host
+        self.logger = logger
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = metrics.render_prometheus().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(metrics.snapshot(), ensure_ascii=False).encode("utf-8")
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True)
+        self._thread.start()
+        self.logger.info(f"メトリクスを http://{self.host}:{self._server.server_address[1]}/metrics で公開しています。")
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join(timeout=2.0)
+        self._server = None
+        self._thread = None
+
+
+class JsonSnapshotWriter:
+    """一定間隔でメトリクスのスナップショットをJSONファイルに書き出す"""
+    def __init__(self, metrics, path, interval, logger):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.logger = logger
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-snapshot", daemon=True)
+        self._thread.start()
+        self.logger.info(f"メトリクスを {self.interval} 秒ごとに {self.path} に書き出します。")
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.write()
+
+    def write(self):
+        """スナップショットを書き出す (読み手が書きかけのファイルを見ないよう置き換える)"""
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.metrics.snapshot(), f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.logger.error(f"メトリクスの書き出しに失敗しました: {e}")
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout=2.0)
+        self._thread = None
+        self.write()
@@ -0,0 +1,118 @@
+import cv2
+import numpy as np
+
+PREPROCESS_STEPS = ("blur", "equalize", "gamma")
+
+
+def gamma_lut(gamma):
+    """ガンマ補正用の256要素のLUTを作成する"""
+    inv_gamma = 1.0 / gamma
+    return (((np.arange(256) / 255.0) ** inv_gamma) * 255).astype(np.uint8)
+
+
+def equalize_lut(hist):
+    """ヒストグラムから平坦化用のLUTを作成する (cv2.equalizeHist と同じ計算)"""
+    hist = np.asarray(hist, dtype=np.int64).reshape(-1)
+    nonzero = np.flatnonzero(hist)
+    if len(nonzero) == 0:
+        return np.arange(256, dtype=np.uint8)
+    first = nonzero[0]
+    total = hist.sum()
+    if hist[first] == total:
+        # 単色の画像は全画素がその値になる
+        return np.full(256, first, dtype=np.uint8)
+    scale = 255.0 / (total - hist[first])
+    cdf = np.cumsum(hist) - hist[first]
+    lut = np.clip(np.rint(cdf * scale), 0, 255).astype(np.uint8)
+    lut[:first] = 0
+    return lut
+
+
+class _FrameBuffers:
+    """1つの解像度に対する前処理用バッファ一式"""
+    def __init__(self, height, width):
+        self.gray = np.empty((height, width), dtype=np.uint8)
+        self.work = [np.empty((height, width), dtype=np.uint8) for _ in range(2)]
+        self.color = np.empty((height, width, 3), dtype=np.uint8)
+
+
+class Preprocessor:
+    """顔検出用の前処理を行うパイプライン
+
+    ステップ (blur / equalize / gamma) は設定で並べ替え・省略できる。ガンマ補正のLUTは
+    パラメータごとに一度だけ作成し、連続する画素値変換 (平坦化・ガンマ補正) は1つのLUTに
+    合成して1回で適用する。出力先は解像度ごとに確保したバッファを使い回すため、
+    定常状態ではフレームごとの画像サイズの確保が発生しない。
+
+    run() が返す配列は次々回の呼び出しで上書きされる (直前のフレームの結果は保持される)。
+    """
+    def __init__(self, steps=PREPROCESS_STEPS, blur_ksize=5, gamma=1.5):
+        for step in steps:
+            if step not in PREPROCESS_STEPS:
+                raise ValueError(f"不明な前処理ステップです: {step} (選択肢: {', '.join(PREPROCESS_STEPS)})")
+        self.steps = tuple(steps)
+        self.blur_ksize = (blur_ksize, blur_ksize)
+        self.gamma_lut = gamma_lut(gamma)
+        self._buffers = {}
+        self._parity = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_buffers"] = {}
+        return state
+
+    def _buffers_for(self, height, width):
+        # 前回の結果を上書きしないように、同じ解像度で2組のバッファを交互に使う
+        self._parity ^= 1
+        key = (height, width, self._parity)
+        buffers = self._buffers.get(key)
+        if buffers is None:
+            buffers = _FrameBuffers(height, width)
+            self._buffers[key] = buffers
+        return buffers
+
+    def run(self, frame):
+        """BGRフレームを前処理し、(前処理後のグレースケール画像, dlib用の3チャンネル画像) を返す"""
+        height, width = frame.shape[:2]
+        buffers = self._buffers_for(height, width)
+
+        if frame.ndim == 2:
+            np.copyto(buffers.gray, frame)
+        else:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=buffers.gray)
+        current = buffers.gray
+        free = list(buffers.work)
+        pending_lut = None
+
+        def next_buffer():
+            buf = free.pop(0)
+            if current is not buffers.gray:
+                free.append(current)
+            return buf
+
+        for step in self.steps:
+            if step == "blur":
+                if pending_lut is not None:
+                    out = next_buffer()
+                    cv2.LUT(current, pending_lut, dst=out)
+                    current, pending_lut = out, None
+                out = next_buffer()
+                cv2.GaussianBlur(current, self.blur_ksize, 0, dst=out)
+                current = out
+            elif step == "equalize":
+                hist = cv2.calcHist([current], [0], None, [256], [0, 256]).reshape(-1)
+                if pending_lut is not None:
+                    # 未適用のLUTを通した後のヒストグラムを計算する
+                    hist = np.bincount(pending_lut, weights=hist, minlength=256)
+                lut = equalize_lut(hist)
+                pending_lut = lut if pending_lut is None else lut[pending_lut]
+            elif step == "gamma":
+                pending_lut = self.gamma_lut if pending_lut is None else self.gamma_lut[pending_lut]
+
+        if pending_lut is not None:
+            out = next_buffer()
+            cv2.LUT(current, pending_lut, dst=out)
+            current = out
+
+        cv2.cvtColor(current, cv2.COLOR_GRAY2BGR, dst=buffers.color)
+        return current, buffers.color
@@ -0,0 +1,423 @@
+import copy
+import time
+import heapq
+import queue
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from frame_pipeline import collect_batch
+from stage_timer import TimingSpan
+
+
+def _attach_shared_memory(name):
+    """既存の共有メモリに接続する (子プロセス側ではリソーストラッカーに登録しない)"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python 3.12以前
+        return shared_memory.SharedMemory(name=name)
+
+
+class _TaskTimer:
+    """ワーカー内で1フレーム分のステージ処理時間を集め、結果とともに親プロセスへ返すタイマー"""
+    def __init__(self):
+        self.timings = []
+
+    def time(self, stage):
+        return TimingSpan(self, stage)
+
+    def record(self, stage, seconds):
+        self.timings.append((stage, seconds))
+
+    def take(self):
+        timings, self.timings = self.timings, []
+        return timings
+
+
+def _latest_gallery(gallery_queue, gallery):
+    """更新されたギャラリーがあれば最新のものを返す"""
+    while True:
+        try:
+            gallery = gallery_queue.get_nowait()
+        except queue.Empty:
+            return gallery
+
+
+def _collect_tasks(task_queue, first, batch_size, batch_wait):
+    """first に続けて batch_wait 秒以内に届いたタスクを集める。終了指示を受け取ったかどうかも返す"""
+    stop = []
+
+    def get(timeout):
+        try:
+            task = task_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if task is None:
+            stop.append(True)
+        return task
+
+    return collect_batch(get, first, batch_size, batch_wait), bool(stop)
+
+
+def _face_cache_counts(recognizers):
+    """ワーカー内の全ての FaceRecognizer の顔キャッシュの (ヒット数, ミス数) の合計を返す"""
+    caches = [r.face_cache for r in recognizers.values() if r.face_cache is not None]
+    return sum(c.hits for c in caches), sum(c.misses for c in caches)
+
+
+def _worker_main(slot_names, gallery, recognizer_options, task_queue, result_queue, gallery_queue, batch_size=1, batch_wait=0.0):
+    """ワーカープロセスのメインループ
+
+    既知の顔データは起動時に一度だけ受け取り、フレームは共有メモリ上のスロットから読み出す。
+    ギャラリーが更新された場合は gallery_queue から新しいギャラリーを受け取り、次のフレームから使う。
+    トラッカー等の状態はカメラごとに分けるため、FaceRecognizer はカメラごとに作成する。
+    batch_size が2以上なら、batch_wait 秒以内に届いたフレーム (カメラが異なってもよい) の顔をまとめてエンコード・照合する。
+    """
+    # dlibを使うため、ワーカープロセスの中でだけ読み込む
+    from recognizer import FaceRecognizer
+    from batch_encoder import recognize_batch
+
+    recognizers = {}
+    timer = _TaskTimer()
+    reported_counts = (0, 0)
+    slots = [_attach_shared_memory(name) for name in slot_names]
+
+    def recognizer_for(camera_id):
+        recognizer = recognizers.get(camera_id)
+        if recognizer is None:
+            recognizer = recognizers[camera_id] = FaceRecognizer(gallery, timer=timer, **copy.deepcopy(recognizer_options))
+        return recognizer
+
+    def recognize_tasks(tasks, frames):
+        """タスクごとの (FaceMatchのリスト, エラー) を返す。例外でワーカーを終了させない"""
+        if len(tasks) == 1:
+            try:
+                return [(recognizer_for(tasks[0][3]).recognize(frames[0]), None)]
+            except Exception as e:
+                return [([], e)]
+        outcomes = [None] * len(tasks)
+        items, indices = [], []
+        for i, ((_, _, _, camera_id), frame) in enumerate(zip(tasks, frames)):
+            try:
+                items.append((recognizer_for(camera_id), frame))
+                indices.append(i)
+            except Exception as e:
+                outcomes[i] = ([], e)
+        try:
+            batch_outcomes = recognize_batch(items, gallery, timer)
+        except Exception as e:
+            batch_outcomes = [([], e)] * len(items)
+        for i, outcome in zip(indices, batch_outcomes):
+            outcomes[i] = outcome
+        return outcomes
+
+    try:
+        stop = False
+        while not stop:
+            task = task_queue.get()
+            if task is None:
+                break
+            tasks = [task]
+            if batch_size > 1:
+                tasks, stop = _collect_tasks(task_queue, task, batch_size, batch_wait)
+                tasks = [t for t in tasks if t is not None]
+            latest = _latest_gallery(gallery_queue, gallery)
+            if latest is not gallery:
+                gallery = latest
+                for recognizer in recognizers.values():
+                    recognizer.set_gallery(gallery)
+
+            frames = [np.ndarray(shape, dtype=np.uint8, buffer=slots[slot_index].buf) for _, slot_index, shape, _ in tasks]
+            outcomes = recognize_tasks(tasks, frames)
+            del frames
+            # バッチ全体の処理時間と顔キャッシュのヒット・ミス数の増分は先頭のフレームの結果と一緒に返す
+            timings = timer.take()
+            counts = _face_cache_counts(recognizers)
+            cache_counts = (counts[0] - reported_counts[0], counts[1] - reported_counts[1])
+            reported_counts = counts
+            for (seq, slot_index, _, _), (results, error) in zip(tasks, outcomes):
+                result_queue.put((seq, slot_index, results, None if error is None else str(error), timings, cache_counts))
+                timings, cache_counts = [], (0, 0)
+    finally:
+        for shm in slots:
+            shm.close()
+
+
+class RecognitionPool:
+    """マルチプロセスで顔認識を行うワーカープール
+
+    フレームは共有メモリのスロットにコピーしてワーカーへ渡し (pickle しない)、
+    結果はシーケンス番号順に並べ替えてから on_result(camera_id, frame, results, context) に渡す
+    (context は submit() に渡したフレームごとの任意の値で、プールは中身を見ずにそのまま返す)。
+    全カメラのフレームが同じワーカーを共有するため、既知の顔データはワーカーごとに一度だけ読み込まれる。
+    recognizer_options は各ワーカーの FaceRecognizer に渡すキーワード引数 (トラッカー等はワーカーごとに複製される)。
+    timer を渡すと、ワーカーで計測したステージごとの処理時間を timer.record(stage, seconds) に記録する。
+    batch_size が2以上なら、各ワーカーは batch_wait 秒以内に届いたフレームの顔をまとめてエンコード・照合する。
+    ワーカーの顔キャッシュ (recognizer_options の face_cache_size) のヒット・ミス数は face_cache_hits / face_cache_misses に集計する。
+
+    フレームは処理中のフレームが最も少ないワーカーのキューに渡し、どのワーカーが持っているかを記録する。
+    ワーカーが異常終了した場合 (dlibのクラッシュ・メモリ不足など) や、result_timeout 秒以上結果を返さない場合
+    (強制終了する) は、そのワーカーが持っていたフレームを飛ばしてスロットを解放し、ワーカーを起動し直す。
+    飛ばしたフレームは順番が来た時に on_skipped(camera_id, frame, context) に渡す (後続のフレームの配信は止まらない)。
+    """
+    SLOTS_PER_WORKER = 2
+    RESTART_INTERVAL = 2.0 # 起動直後に終了を繰り返すワーカーを再起動する間隔
+    CHECK_INTERVAL = 0.5 # ワーカーの生存と応答時間を確認する間隔
+
+    def __init__(self, num_workers, gallery, on_result, logger, max_frame_bytes, recognizer_options=None, timer=None,
+                 batch_size=1, batch_wait=0.0, result_timeout=30.0, on_skipped=None):
+        self.num_workers = num_workers
+        self.gallery = gallery
+        self.recognizer_options = recognizer_options or {}
+        self.on_result = on_result
+        self.on_skipped = on_skipped
+        self.timer = timer
+        self.logger = logger
+        self.max_frame_bytes = max_frame_bytes
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.result_timeout = result_timeout
+        self.face_cache_hits = 0
+        self.face_cache_misses = 0
+        self.skipped_count = 0
+        self.restart_count = 0
+
+        self._ctx = mp.get_context("spawn")  # TkinterやWebSocketのスレッドをforkしないようにspawnを使う
+        self._slots = []
+        self._slot_names = []
+        self._free_slots = queue.Queue()
+        self._result_queue = None
+        self._workers = []
+        self._task_queues = []
+        self._gallery_queues = []
+        self._alive = []
+        self._started_at = []
+        self._loads = []
+        self._workers_lock = threading.Lock()
+        self._collector_thread = None
+        self._stop_event = threading.Event()
+        self._last_check = 0.0
+
+        self._seq_lock = threading.Lock()
+        self._next_seq = 0
+        self._next_deliver_seq = 0
+        self._pending_frames = {}
+        self._in_flight = {} # シーケンス番号 -> (ワーカー番号, スロット番号, 渡した時刻)
+        self._skipped = set()
+        self._reorder_heap = []
+        self.is_running = False
+
+    def _worker_target(self):
+        """ワーカープロセスで実行する関数"""
+        return _worker_main
+
+    def start(self):
+        if self.is_running:
+            return
+        # バッチを集めている間も次のフレームを渡せるだけのスロットを用意する
+        num_slots = self.num_workers * max(self.SLOTS_PER_WORKER, self.batch_size + 1)
+        self._slots = [shared_memory.SharedMemory(create=True, size=self.max_frame_bytes) for _ in range(num_slots)]
+        self._slot_names = [shm.name for shm in self._slots]
+        for i in range(num_slots):
+            self._free_slots.put(i)
+        self._result_queue = self._ctx.Queue()
+
+        self._workers = [None] * self.num_workers
+        self._task_queues = [None] * self.num_workers
+        self._gallery_queues = [None] * self.num_workers
+        self._alive = [False] * self.num_workers
+        self._started_at = [0.0] * self.num_workers
+        self._loads = [0] * self.num_workers
+        with self._workers_lock:
+            for i in range(self.num_workers):
+                self._start_worker(i)
+
+        self._stop_event.clear()
+        self._collector_thread = threading.Thread(target=self._collect_results, daemon=True)
+        self._collector_thread.start()
+        self.is_running = True
+        self.logger.info(f"認識ワーカープールを開始しました (ワーカー数: {self.num_workers})。")
+
+    def _start_worker(self, index):
+        """index 番目のワーカーを新しいキューで起動する (_workers_lock を持って呼ぶ)"""
+        task_queue = self._ctx.Queue()
+        gallery_queue = self._ctx.Queue()
+        p = self._ctx.Process(
+            target=self._worker_target(),
+            args=(self._slot_names, self.gallery, self.recognizer_options, task_queue, self._result_queue, gallery_queue,
+                  self.batch_size, self.batch_wait),
+            name=f"recognition-worker-{index}",
+            daemon=True
+        )
+        p.start()
+        self._workers[index] = p
+        self._gallery_queues[index] = gallery_queue
+        self._started_at[index] = time.monotonic()
+        with self._seq_lock:
+            self._task_queues[index] = task_queue
+            self._alive[index] = True
+
+    def stop(self):
+        if not self.is_running:
+            return
+        self.is_running = False
+        with self._workers_lock:
+            for task_queue in self._task_queues:
+                task_queue.put(None)
+            for p in self._workers:
+                p.join(timeout=5.0)
+                if p.is_alive():
+                    self.logger.warning(f"{p.name} がタイムアウト後も終了していないため強制終了します。")
+                    p.terminate()
+            self._workers = []
+            self._task_queues = []
+            self._gallery_queues = []
+            self._alive = []
+
+        self._stop_event.set()
+        if self._collector_thread:
+            self._collector_thread.join(timeout=2.0)
+        self._collector_thread = None
+
+        for shm in self._slots:
+            shm.close()
+            shm.unlink()
+        self._slots = []
+        self._free_slots = queue.Queue()
+        self.logger.info("認識ワーカープールを停止しました。")
+
+    def submit(self, camera_id, frame, timeout=None, context=None):
+        """フレームを空きスロットにコピーしてワーカーに渡す
+
+        空きがなければ最大 timeout 秒 (Noneなら無制限) 待ち、空かなければ、
+        または動いているワーカーがなければFalseを返す。
+        """
+        if frame.nbytes > self.max_frame_bytes:
+            self.logger.warning(f"フレームサイズ {frame.nbytes} バイトが共有メモリのスロットサイズを超えているためスキップします。")
+            return False
+        try:
+            slot_index = self._free_slots.get(timeout=timeout)
+        except queue.Empty:
+            return False
+
+        view = np.ndarray(frame.shape, dtype=np.uint8, buffer=self._slots[slot_index].buf)
+        view[...] = frame
+        del view
+
+        with self._seq_lock:
+            alive = [i for i, alive in enumerate(self._alive) if alive]
+            if not alive:
+                self._free_slots.put(slot_index)
+                return False
+            worker_index = min(alive, key=lambda i: self._loads[i])
+            seq = self._next_seq
+            self._next_seq += 1
+            self._pending_frames[seq] = (camera_id, frame, context)
+            self._in_flight[seq] = (worker_index, slot_index, time.monotonic())
+            self._loads[worker_index] += 1
+            task_queue = self._task_queues[worker_index]
+        task_queue.put((seq, slot_index, frame.shape, camera_id))
+        return True
+
+    def update_gallery(self, gallery):
+        """全ワーカーのギャラリーを差し替える (各ワーカーは次のフレームから新しいギャラリーを使う)"""
+        self.gallery = gallery
+        with self._workers_lock:
+            for gallery_queue in self._gallery_queues:
+                gallery_queue.put(gallery)
+
+    def pending_count(self):
+        """ワーカーに渡して結果待ちのフレーム数を返す"""
+        with self._seq_lock:
+            return len(self._pending_frames)
+
+    def _collect_results(self):
+        """ワーカーの結果を受け取り、シーケンス番号順に配信する"""
+        while not self._stop_event.is_set():
+            try:
+                message = self._result_queue.get(timeout=self.CHECK_INTERVAL)
+            except queue.Empty:
+                message = None
+            if message is not None:
+                self._receive(*message)
+            if time.monotonic() - self._last_check >= self.CHECK_INTERVAL:
+                self._last_check = time.monotonic()
+                self._check_workers()
+            self._deliver()
+
+    def _receive(self, seq, slot_index, results, error, timings, cache_counts):
+        with self._seq_lock:
+            entry = self._in_flight.pop(seq, None)
+            if entry is not None:
+                self._loads[entry[0]] -= 1
+        if entry is None:
+            # 終了したワーカーのフレームとして飛ばした後に届いた結果 (スロットは解放済み)
+            return
+        self._free_slots.put(slot_index)
+        if error is not None:
+            self.logger.error(f"認識ワーカーで処理中にエラーが発生しました (seq={seq}): {error}")
+        if self.timer is not None:
+            for stage, seconds in timings:
+                self.timer.record(stage, seconds)
+        self.face_cache_hits += cache_counts[0]
+        self.face_cache_misses += cache_counts[1]
+        heapq.heappush(self._reorder_heap, (seq, results))
+
+    def _check_workers(self):
+        """応答しないワーカーを強制終了し、終了したワーカーのフレームを飛ばして起動し直す"""
+        now = time.monotonic()
+        with self._seq_lock:
+            stalled = {w for w, _, submitted_at in self._in_flight.values() if now - submitted_at > self.result_timeout}
+        with self._workers_lock:
+            if not self.is_running:
+                return
+            for index in stalled:
+                p = self._workers[index]
+                if p.is_alive():
+                    self.logger.error(f"{p.name} が {self.result_timeout} 秒以上結果を返さないため強制終了します。")
+                    p.terminate()
+                    p.join(timeout=1.0)
+            for index, p in enumerate(self._workers):
+                if p.is_alive():
+                    continue
+                if self._alive[index]:
+                    self._abandon_worker(index, p)
+                if now - self._started_at[index] >= self.RESTART_INTERVAL:
+                    self.restart_count += 1
+                    self._start_worker(index)
+
+    def _abandon_worker(self, index, p):
+        """終了したワーカーが持っていたフレームを飛ばし、スロットを解放する"""
+        with self._seq_lock:
+            self._alive[index] = False
+            self._loads[index] = 0
+            lost = sorted(seq for seq, (w, _, _) in self._in_flight.items() if w == index)
+            slots = [self._in_flight.pop(seq)[1] for seq in lost]
+        self._skipped.update(lost)
+        self.skipped_count += len(lost)
+        for slot_index in slots:
+            self._free_slots.put(slot_index)
+        self.logger.error(
+            f"{p.name} が終了しました (終了コード: {p.exitcode})。処理中だったフレーム {len(lost)} 件を飛ばして起動し直します。"
+        )
+
+    def _deliver(self):
+        """順番が来た結果を on_result に、飛ばしたフレームを on_skipped に渡す"""
+        while True:
+            if self._reorder_heap and self._reorder_heap[0][0] == self._next_deliver_seq:
+                seq, results = heapq.heappop(self._reorder_heap)
+            elif self._next_deliver_seq in self._skipped:
+                seq, results = self._next_deliver_seq, None
+                self._skipped.discard(seq)
+            else:
+                return
+            with self._seq_lock:
+                camera_id, frame, context = self._pending_frames.pop(seq)
+            self._next_deliver_seq += 1
+            try:
+                if results is not None:
+                    self.on_result(camera_id, frame, results, context)
+                elif self.on_skipped is not None:
+                    self.on_skipped(camera_id, frame, context)
+            except Exception as e:
+                self.logger.error(f"認識結果の処理中にエラーが発生しました: {e}")
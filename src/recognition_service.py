@@ -0,0 +1,891 @@
+import os
+import copy
+import time
+import threading
+from datetime import datetime
+import cv2
+import importlib
+import numpy as np
+from config import AppConfig
+from websocket_client import ConnectionManager
+from encoding_store import EncodingStore, ENCODING_DIM
+from frame_pipeline import FramePipeline
+from frame_buffers import FramePool, read_only
+from face_gallery import FaceGallery, IdentityGallery
+from tracker import FaceTracker
+from detectors import CascadeDetector, create_detector
+from preprocess import Preprocessor
+from frame_recorder import FrameRecorder
+from unknown_face_writer import UnknownFaceWriter
+from gallery_watcher import GalleryWatcher
+from adaptive_quality import AdaptiveQualityController
+from result_cache import ResultCache, CachedFrame, frame_key
+from sighting_store import SightingStore
+from metrics import Metrics, MetricsServer, JsonSnapshotWriter, MATCH_DISTANCE_BUCKETS
+
+WARMUP_FACE_NAME = "..." # 顔認識の準備中に位置だけを検出した顔の名前 (WARMUP_FRAME_POLICY=detect)
+
+
+class CameraState:
+    """カメラごとの設定と状態"""
+    def __init__(self, camera_id, url):
+        self.camera_id = camera_id
+        self.url = url
+        self.current_fps_setting = AppConfig.DEFAULT_FPS_SETTING
+        self.current_resolution = AppConfig.DEFAULT_RESOLUTION
+        self.send_stream_command_on_open = False
+        self.last_resolution_resend_time = 0
+        self.frame_count = 0
+        self.start_time = time.time()
+        self.current_fps = 0
+
+
+class RecognitionService:
+    """WebSocketからのフレーム受信と顔認識を行う、GUIに依存しないサービス
+
+    AppConfig.WS_URLS の各カメラに接続し、フレームは1つのパイプラインと認識ワーカーで
+    カメラ間を順番に処理する。既知の顔データは全カメラで共有し、一度だけ読み込む。
+
+    顔認識のモジュール (dlibのモデル) と既知の顔の読み込みは作成時にバックグラウンドで始め、
+    終わるまではGUIの表示やカメラへの接続を待たせない。読み込み中に届いたフレームは
+    WARMUP_FRAME_POLICY に従って処理し、読み込みが終わると ready_event をセットして "ready" イベントを通知する。
+
+    処理結果は subscribe() で登録したコールバックに構造化イベント (dict) として通知する。
+    コールバックは callback(event, frame) の形で呼ばれ、frame は "faces" イベントの場合のみ
+    認識対象になった (描画前の) フレームが渡される。それ以外は None。
+    フレームは使い回す配列の書き込みできないビューで、コールバック側が参照を持っている間は再利用されない。
+    認識結果を描画する場合は表示用に縮小・変換した配列に描画する。
+    "status" 以外のイベントには送信元のカメラID ("camera") が含まれる。
+
+    イベントの種類:
+        {"type": "faces", "camera", "timestamp", "faces": [{"name", "box": [top, right, bottom, left], "distance"}]}
+            (読み込み中のフレームには "warming_up": True が付き、顔の名前は WARMUP_FACE_NAME になる)
+        {"type": "fps", "camera", "value"}
+        {"type": "connection", "camera", "state": "open" / "closed" / "error", "detail"}
+        {"type": "camera_setting", "camera", "fps"} / {"type": "camera_setting", "camera", "resolution"}
+        {"type": "quality_adjusted", "camera", "fps", "resolution"}
+        {"type": "unknown_face_saved", "camera", "filename"}
+        {"type": "gallery_reloaded", "known_faces"}
+        {"type": "status", "running"}
+        {"type": "ready", "startup": {"import", "model_load", "gallery_load", "ready"}} (各段階の秒数)
+    """
+    def __init__(self, logger):
+        self._created_at = time.perf_counter()
+        self.logger = logger
+        self.metrics = self._create_metrics()
+
+        # Haar Cascadesの確認
+        face_cascade = cv2.CascadeClassifier(AppConfig.CASCADE_PATH)
+        if face_cascade.empty():
+            self.logger.critical("Haar Cascades ファイルが見つかりません。アプリケーションを終了します。")
+            raise IOError("Haar Cascades ファイルが見つかりません。正しいパスを確認してください。")
+
+        # 顔認証データ (既知の顔は _warm_up() で読み込む)
+        self.known_face_encodings = np.empty((0, ENCODING_DIM))
+        self.known_face_names = []
+        self.encoding_store = EncodingStore(AppConfig.ENCODING_CACHE_DIR, self.logger)
+        self.gallery = None
+        self.recognizer_options = self._recognizer_options()
+        self.recognizers = {} # カメラID -> FaceRecognizer (トラッカー等の状態をカメラごとに分ける)
+
+        # 起動処理の状態 (読み込みが終わるまでに届いたフレームの扱いは WARMUP_FRAME_POLICY で決める)
+        self.ready_event = threading.Event()
+        self.startup_times = {} # 段階 -> 秒数
+        self._warmup_lock = threading.Lock()
+        self._shutting_down = False
+        self._warmup_frames = {} # カメラID -> 読み込み中に届いた最新のフレーム (latest の場合)
+        self._warmup_detector = None
+        if AppConfig.WARMUP_FRAME_POLICY == "detect":
+            self._warmup_detector = CascadeDetector(AppConfig.CASCADE_PATH)
+        elif AppConfig.WARMUP_FRAME_POLICY != "latest":
+            raise ValueError(f"不明な起動中のフレームの扱いです: {AppConfig.WARMUP_FRAME_POLICY} (選択肢: latest, detect)")
+
+        # 状態変数
+        self.is_running = False
+        self.save_unknown_faces = AppConfig.SAVE_UNKNOWN_FACES
+        self.unknown_face_writer = UnknownFaceWriter(
+            AppConfig.FACES_DIR,
+            self.logger,
+            dedup_threshold=AppConfig.UNKNOWN_DEDUP_THRESHOLD,
+            dedup_window_sec=AppConfig.UNKNOWN_DEDUP_WINDOW_SEC,
+            queue_size=AppConfig.UNKNOWN_WRITE_QUEUE_SIZE,
+            on_saved=self._on_unknown_face_saved
+        )
+        self.unknown_face_writer.start()
+
+        # 認識した人物の記録 (SIGHTING_DB_PATH が設定されている場合のみ、書き込みはバックグラウンドで行う)
+        self.sighting_store = None
+        if AppConfig.SIGHTING_DB_PATH:
+            self.sighting_store = SightingStore(
+                AppConfig.SIGHTING_DB_PATH,
+                self.logger,
+                gap_sec=AppConfig.SIGHTING_VISIT_GAP_SEC,
+                max_visit_sec=AppConfig.SIGHTING_MAX_VISIT_SEC,
+                min_interval=AppConfig.SIGHTING_MIN_INTERVAL_SEC,
+                batch_size=AppConfig.SIGHTING_BATCH_SIZE,
+                flush_interval=AppConfig.SIGHTING_FLUSH_INTERVAL_SEC,
+                queue_size=AppConfig.SIGHTING_QUEUE_SIZE,
+                timer=self.metrics
+            )
+            self.sighting_store.start()
+
+        self._subscribers = []
+        self._subscribers_lock = threading.Lock()
+
+        # カメラごとのWebSocket接続 (切断時はカメラごとに指数バックオフで再接続する)
+        # デコード・回転したフレームの配列は解像度ごとに使い回す
+        self.frame_pool = FramePool(AppConfig.FRAME_POOL_SIZE)
+        # 同じJPEGが続いた場合 (静止した場面) はデコードと認識を省略する (FRAME_CACHE_SIZE > 0 の場合のみ)
+        self.frame_cache = None
+        if AppConfig.FRAME_CACHE_SIZE > 0:
+            self.frame_cache = ResultCache(AppConfig.FRAME_CACHE_SIZE, AppConfig.RESULT_CACHE_TTL_SEC)
+        self._pool_dropped = {} # カメラID -> ワーカーに空きがなく破棄したフレーム数
+
+        self.cameras = {}
+        self.connection_manager = self._create_connection_manager()
+        for i, url in enumerate(AppConfig.WS_URLS):
+            camera_id = f"cam{i}"
+            self.cameras[camera_id] = CameraState(camera_id, url)
+            self.connection_manager.add(
+                camera_id,
+                url,
+                lambda ws_app, message, camera_id=camera_id: self._on_websocket_message(camera_id, message),
+                lambda ws_app, error, camera_id=camera_id: self._on_websocket_error(camera_id, error),
+                lambda ws_app, code, msg, camera_id=camera_id: self._on_websocket_close(camera_id, code, msg),
+                lambda ws_app, camera_id=camera_id: self._on_websocket_open(camera_id)
+            )
+        # 受信フレームの記録 (RECORD_DIR が設定されている場合のみ、bench.py replay で再生できる)
+        self.recorders = {}
+        if AppConfig.RECORD_DIR:
+            os.makedirs(AppConfig.RECORD_DIR, exist_ok=True)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            for camera_id in self.cameras:
+                path = os.path.join(AppConfig.RECORD_DIR, f"{camera_id}_{timestamp}.frames")
+                self.recorders[camera_id] = FrameRecorder(path)
+                self.logger.info(f"受信フレームを記録します ({camera_id}): {path}")
+        self.logger.info(f"カメラ {len(self.cameras)} 台: {', '.join(f'{c.camera_id}={c.url}' for c in self.cameras.values())}")
+
+        # 認識ワーカープール (RECOGNITION_WORKERS > 0 の場合のみ、既知の顔を読み込んでから _warm_up() で開始する)
+        self.recognition_pool = None
+
+        # フレーム処理パイプライン (受信スレッドをデコード・認識処理から切り離す)
+        # ワーカープールを使わずにバッチ処理する場合は、認識ステージで複数のフレームをまとめて受け取る
+        batch_in_thread = AppConfig.RECOGNITION_WORKERS == 0 and AppConfig.ENCODE_BATCH_SIZE > 1
+        self.pipeline = FramePipeline(
+            self._decode_frame,
+            self._recognize_frames if batch_in_thread else self._recognize_frame,
+            self.logger,
+            raw_queue_size=AppConfig.RAW_FRAME_QUEUE_SIZE,
+            decoded_queue_size=AppConfig.DECODED_FRAME_QUEUE_SIZE,
+            recognize_batch_size=AppConfig.ENCODE_BATCH_SIZE if batch_in_thread else 1,
+            recognize_batch_wait=AppConfig.ENCODE_BATCH_WAIT_MS / 1000
+        )
+        self.pipeline.start()
+        self.metrics.add_collector(self._collect_metrics)
+
+        # 認識の遅延に応じたFPS・解像度の自動調整 (ADAPTIVE_QUALITY=True の場合のみ)
+        self.quality_controller = None
+        if AppConfig.ADAPTIVE_QUALITY:
+            self.quality_controller = AdaptiveQualityController(
+                self._apply_adaptive_fps,
+                self._apply_adaptive_resolution,
+                self._dropped_frames,
+                self.logger,
+                AppConfig.TARGET_LATENCY_MS / 1000,
+                AppConfig.FPS_STEPS,
+                AppConfig.RESOLUTION_STEPS,
+                interval=AppConfig.ADAPTIVE_INTERVAL_SEC,
+                window=AppConfig.ADAPTIVE_WINDOW_SEC,
+                settle_sec=AppConfig.ADAPTIVE_SETTLE_SEC,
+                up_ratio=AppConfig.ADAPTIVE_UP_RATIO,
+                up_hold=AppConfig.ADAPTIVE_UP_HOLD,
+                down_hold=AppConfig.ADAPTIVE_DOWN_HOLD,
+                parallelism=max(AppConfig.RECOGNITION_WORKERS, 1),
+                is_active=lambda camera_id: self.is_running and self.connection_manager.is_connected(camera_id)
+            )
+            for camera in self.cameras.values():
+                self.quality_controller.add_camera(camera.camera_id, camera.current_fps_setting, camera.current_resolution)
+            self.quality_controller.start()
+
+        # FACES_DIRの監視 (写真を追加・変更すると再起動せずに反映する、既知の顔を読み込んでから _warm_up() で開始する)
+        self.gallery_watcher = None
+
+        # メトリクスの公開 (METRICS_PORT / METRICS_SNAPSHOT_PATH が設定されている場合のみ)
+        self.metrics_server = None
+        if AppConfig.METRICS_PORT:
+            self.metrics_server = MetricsServer(self.metrics, AppConfig.METRICS_PORT, self.logger)
+            self.metrics_server.start()
+        self.metrics_writer = None
+        if AppConfig.METRICS_SNAPSHOT_PATH:
+            self.metrics_writer = JsonSnapshotWriter(
+                self.metrics, AppConfig.METRICS_SNAPSHOT_PATH, AppConfig.METRICS_SNAPSHOT_INTERVAL_SEC, self.logger
+            )
+            self.metrics_writer.start()
+
+        # 顔認識のモジュールと既知の顔の読み込み (終わるまで認識は行わない)
+        self._warmup_thread = threading.Thread(target=self._warm_up, name="warm-up", daemon=True)
+        self._warmup_thread.start()
+
+    def _warm_up(self):
+        """顔認識のモジュールと既知の顔を読み込み、認識を開始できる状態にする (起動用のスレッドで実行する)
+
+        dlibの読み込み (import)、face_recognitionのモデルの読み込み (model_load)、既知の顔の読み込み (gallery_load) の
+        時間を startup_times に記録する。ready はサービスの作成から認識を開始できるまでの時間。
+        """
+        try:
+            start = time.perf_counter()
+            importlib.import_module("dlib")
+            self.startup_times["import"] = time.perf_counter() - start
+
+            # face_recognition は読み込み時に検出器・特徴点・エンコーダーのモデルを読み込む
+            start = time.perf_counter()
+            for module in ("face_recognition", "recognizer", "batch_encoder", "recognition_pool"):
+                importlib.import_module(module)
+            self.startup_times["model_load"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            encodings, names = self._load_known_faces()
+            gallery = self._build_gallery(encodings, names)
+            self.known_face_encodings, self.known_face_names = encodings, names
+            self.startup_times["gallery_load"] = time.perf_counter() - start
+        except Exception as e:
+            self.logger.critical(f"顔認識の準備中にエラーが発生しました。認識は行われません: {e}")
+            return
+
+        with self._warmup_lock:
+            if self._shutting_down:
+                return
+            self.gallery = gallery
+            if AppConfig.RECOGNITION_WORKERS > 0:
+                from recognition_pool import RecognitionPool
+                self.recognition_pool = RecognitionPool(
+                    AppConfig.RECOGNITION_WORKERS,
+                    self.gallery,
+                    self._on_pool_result,
+                    self.logger,
+                    AppConfig.MAX_FRAME_BYTES,
+                    recognizer_options=self.recognizer_options,
+                    timer=self.metrics,
+                    batch_size=AppConfig.ENCODE_BATCH_SIZE,
+                    batch_wait=AppConfig.ENCODE_BATCH_WAIT_MS / 1000,
+                    result_timeout=AppConfig.RECOGNITION_RESULT_TIMEOUT_SEC
+                )
+                self.recognition_pool.start()
+            if AppConfig.GALLERY_WATCH_INTERVAL_SEC > 0:
+                self.gallery_watcher = GalleryWatcher(
+                    AppConfig.FACES_DIR,
+                    self._list_face_files,
+                    self.reload_gallery,
+                    self.logger,
+                    interval=AppConfig.GALLERY_WATCH_INTERVAL_SEC
+                )
+                self.gallery_watcher.start()
+            self.startup_times["ready"] = time.perf_counter() - self._created_at
+            self.ready_event.set()
+            warmup_frames, self._warmup_frames = self._warmup_frames, {}
+
+        times = self.startup_times
+        self.logger.info(
+            f"顔認識の準備ができました ({times['ready']:.2f} 秒: モジュール {times['import']:.2f} 秒, "
+            f"モデル {times['model_load']:.2f} 秒, 既知の顔 {times['gallery_load']:.2f} 秒)。"
+        )
+        self._emit({"type": "ready", "startup": dict(times)})
+
+        # 読み込み中に届いた最新のフレームを認識する (その後に新しいフレームが届いていれば、そちらを優先する)
+        for camera_id, item in warmup_frames.items():
+            self.pipeline.resubmit_decoded(camera_id, item)
+
+    def _handle_warmup_frame(self, camera_id, item):
+        """顔認識の準備中に届いたフレームを WARMUP_FRAME_POLICY に従って処理する (認識ステージ)
+
+        latest: 最新のフレームだけを残しておき、準備ができたら認識する。
+        detect: Haar Cascadeで顔の位置だけを検出する (名前は WARMUP_FACE_NAME)。
+        どちらの場合もフレームは "warming_up" を付けた "faces" イベントで通知するため、映像は準備中も表示される。
+        """
+        received_at, frame, _ = item
+        faces = []
+        if self._warmup_detector is not None:
+            with self.metrics.time("warmup_detect"):
+                locations = self._warmup_detector.detect(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), None)
+            faces = [{"name": WARMUP_FACE_NAME, "box": list(location), "distance": None} for location in locations]
+        else:
+            with self._warmup_lock:
+                ready = self.ready_event.is_set()
+                if not ready:
+                    self._warmup_frames[camera_id] = item
+            if ready: # 判定の直後に準備ができた
+                self.pipeline.resubmit_decoded(camera_id, item)
+        self._emit({"type": "faces", "camera": camera_id, "timestamp": time.time(), "faces": faces, "warming_up": True}, frame)
+
+    @staticmethod
+    def _create_metrics():
+        """サービスが記録するメトリクスを登録する"""
+        metrics = Metrics()
+        metrics.describe("frames_received_total", "counter", "受信したフレーム数")
+        metrics.describe("frames_decoded_total", "counter", "デコードしたフレーム数")
+        metrics.describe("decode_failures_total", "counter", "デコードに失敗したフレーム数")
+        metrics.describe("frames_dropped_total", "counter", "処理が追いつかずキューから破棄したフレーム数")
+        metrics.describe("frames_recognized_total", "counter", "認識を行ったフレーム数")
+        metrics.describe("pool_frames_skipped_total", "counter", "認識ワーカーの異常終了・無応答のため結果が得られなかったフレーム数")
+        metrics.describe("pool_worker_restarts_total", "counter", "認識ワーカーを起動し直した回数")
+        metrics.describe("unknown_faces_saved_total", "counter", "保存した未知の顔の数")
+        metrics.describe("unknown_faces_deduplicated_total", "counter", "直近に保存した人物と同じため保存しなかった未知の顔の数")
+        metrics.describe("unknown_faces_dropped_total", "counter", "書き込みが追いつかず保存しなかった未知の顔の数")
+        metrics.describe("unknown_faces_evicted_total", "counter", "新しい人物のためにキューから外した (まだ映っている) 未知の顔の数")
+        metrics.describe("reconnects_total", "counter", "WebSocketの再接続回数")
+        metrics.describe("queue_depth", "gauge", "キューに溜まっているフレーム数")
+        metrics.describe("frame_buffers", "gauge", "解像度ごとに確保したフレーム用配列の数")
+        metrics.describe("frame_pool_overflow_total", "counter", "使い回す配列が全て使用中のため新しく確保したフレーム数")
+        metrics.describe("result_cache_lookups_total", "counter", "結果キャッシュを引いた回数 (level=frame: JPEGのハッシュ, face: 顔の知覚ハッシュ)")
+        metrics.describe("frames_reused_total", "counter", "同じJPEGの認識結果を使い回し、デコードと認識を省略したフレーム数")
+        metrics.describe("quality_adjustments_total", "counter", "遅延に応じてFPS・解像度を自動で変更した回数")
+        metrics.describe("sightings_recorded_total", "counter", "データベースに記録した人物の検出数")
+        metrics.describe("sightings_dropped_total", "counter", "書き込みが追いつかず記録しなかった人物の検出数")
+        metrics.describe("startup_seconds", "gauge", "起動の段階ごとの時間 (import / model_load / gallery_load / ready)")
+        metrics.describe("match_distance", "histogram", "最も近い既知の顔との距離", MATCH_DISTANCE_BUCKETS)
+        return metrics
+
+    def _collect_metrics(self):
+        """他のオブジェクトが数えている値をメトリクスとして返す (出力時に呼ばれる)"""
+        for camera_id, stats in self.pipeline.stats()["cameras"].items():
+            for queue_name, queue_stats in (("receive", stats["receive"]), ("decode", stats["decode"])):
+                if queue_stats is None:
+                    continue
+                yield "frames_dropped_total", {"camera": camera_id, "queue": queue_name}, queue_stats["dropped"]
+                yield "queue_depth", {"camera": camera_id, "queue": queue_name}, queue_stats["depth"]
+        for camera_id, dropped in list(self._pool_dropped.items()):
+            yield "frames_dropped_total", {"camera": camera_id, "queue": "pool"}, dropped
+        if self.recognition_pool:
+            yield "pool_frames_skipped_total", {}, self.recognition_pool.skipped_count
+            yield "pool_worker_restarts_total", {}, self.recognition_pool.restart_count
+        for camera_id, client in self.connection_manager.clients.items():
+            yield "reconnects_total", {"camera": camera_id}, client.reconnect_count
+        yield "unknown_faces_deduplicated_total", {}, self.unknown_face_writer.duplicate_count
+        yield "unknown_faces_dropped_total", {}, self.unknown_face_writer.dropped_count
+        yield "unknown_faces_evicted_total", {}, self.unknown_face_writer.evicted_count
+        if self.sighting_store:
+            yield "sightings_recorded_total", {}, self.sighting_store.written_count
+            yield "sightings_dropped_total", {}, self.sighting_store.dropped_count
+        for shape, stats in self.frame_pool.stats().items():
+            yield "frame_buffers", {"shape": shape, "state": "allocated"}, stats["allocated"]
+            yield "frame_buffers", {"shape": shape, "state": "in_use"}, stats["in_use"]
+        yield "frame_pool_overflow_total", {}, self.frame_pool.overflow_count
+        if self.quality_controller:
+            yield "quality_adjustments_total", {}, self.quality_controller.adjust_count
+        for phase, seconds in list(self.startup_times.items()):
+            yield "startup_seconds", {"phase": phase}, seconds
+        if self.frame_cache:
+            yield "result_cache_lookups_total", {"level": "frame", "result": "hit"}, self.frame_cache.hits
+            yield "result_cache_lookups_total", {"level": "frame", "result": "miss"}, self.frame_cache.misses
+        if AppConfig.FACE_CACHE_SIZE > 0:
+            hits, misses = self._face_cache_counts()
+            yield "result_cache_lookups_total", {"level": "face", "result": "hit"}, hits
+            yield "result_cache_lookups_total", {"level": "face", "result": "miss"}, misses
+
+    def _face_cache_counts(self):
+        """全カメラの顔キャッシュの (ヒット数, ミス数) を返す (ワーカープールの分を含む)"""
+        caches = [r.face_cache for r in list(self.recognizers.values()) if r.face_cache is not None]
+        hits, misses = sum(c.hits for c in caches), sum(c.misses for c in caches)
+        if self.recognition_pool:
+            hits += self.recognition_pool.face_cache_hits
+            misses += self.recognition_pool.face_cache_misses
+        return hits, misses
+
+    def _dropped_frames(self, camera_id):
+        """カメラのフレームがキューから破棄された累計数を返す"""
+        stats = self.pipeline.stats()["cameras"].get(camera_id)
+        if stats is None:
+            return 0
+        return sum(queue_stats["dropped"] for queue_stats in stats.values() if queue_stats is not None)
+
+    def subscribe(self, callback):
+        """イベントを受け取るコールバックを登録する"""
+        with self._subscribers_lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._subscribers_lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def _emit(self, event, frame=None):
+        """登録されたコールバックにイベントを通知する"""
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(event, frame)
+            except Exception as e:
+                self.logger.error(f"イベント処理中にエラーが発生しました ({event.get('type')}): {e}")
+
+    def _load_known_faces(self):
+        """既知の顔データをロードし、(エンコーディング配列, 名前リスト) を返す"""
+        faces_dir = AppConfig.FACES_DIR
+        if not os.path.exists(faces_dir):
+            os.makedirs(faces_dir)
+            self.logger.info(f"ディレクトリ {faces_dir} を作成しました。")
+
+        # 一覧の取得から同期までの間に一括登録 (enroll.py) がファイルを置いてキャッシュを書き換えないよう排他する
+        with self.encoding_store.locked():
+            filenames = self._list_face_files(log_skipped=True)
+            encodings, names = self.encoding_store.sync(
+                faces_dir, filenames, self._name_from_filename, self._encode_face_file
+            )
+
+        self.logger.info(f"Loaded {len(encodings)} known faces.")
+        self.logger.debug(str(names))
+        return encodings, names
+
+    def _list_face_files(self, log_skipped=False):
+        """FACES_DIR内の既知の顔の画像ファイル名を返す (保存した未知の顔は除く)"""
+        filenames = []
+        for filename in os.listdir(AppConfig.FACES_DIR):
+            if filename.lower().startswith("unknown_"):
+                if log_skipped:
+                    self.logger.info(f"既知の顔として 'Unknown_' で始まるファイル '{filename}' をスキップしました。")
+                continue
+
+            if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
+                filenames.append(filename)
+        return filenames
+
+    def _build_gallery(self, encodings, names):
+        """読み込んだ既知の顔から照合用のギャラリーを作成する"""
+        if AppConfig.GALLERY_MODE == "identity":
+            gallery = IdentityGallery(
+                encodings,
+                names,
+                AppConfig.FACE_MATCH_THRESHOLD,
+                medoids=AppConfig.IDENTITY_MEDOIDS,
+                boundary_margin=AppConfig.IDENTITY_BOUNDARY_MARGIN
+            )
+            self.logger.info(f"人物 {len(gallery.names)} 人のギャラリーを作成しました (代表点 {gallery.prototype_count} 件)。")
+            return gallery
+        if AppConfig.GALLERY_MODE != "flat":
+            raise ValueError(f"不明なギャラリー方式です: {AppConfig.GALLERY_MODE} (選択肢: flat, identity)")
+        return FaceGallery(
+            encodings,
+            names,
+            AppConfig.FACE_MATCH_THRESHOLD,
+            ann_threshold=AppConfig.GALLERY_ANN_THRESHOLD,
+            ann_probes=AppConfig.GALLERY_ANN_PROBES
+        )
+
+    def reload_gallery(self):
+        """FACES_DIRを読み直し、新しいギャラリーに差し替える (監視スレッドから呼ばれる)
+
+        追加・変更された画像だけをエンコードし、新しい FaceGallery を作ってから参照を入れ替える。
+        FaceGallery は作成後に変更しないため、照合中のスレッドはロックなしで古いギャラリーを使い続けられる。
+        読み込みやギャラリーの作成に失敗した場合は例外を送出し、既知の顔とギャラリーは元のまま残す。
+        """
+        if isinstance(self.known_face_encodings, np.memmap):
+            # キャッシュファイルを置き換えられるよう、古いメモリマップへの参照をメモリ上の複製に置き換える
+            self.known_face_encodings = np.array(self.known_face_encodings)
+        encodings, names = self._load_known_faces()
+        gallery = self._build_gallery(encodings, names)
+
+        self.known_face_encodings, self.known_face_names = encodings, names
+        self.gallery = gallery
+        for recognizer in list(self.recognizers.values()):
+            recognizer.set_gallery(gallery)
+        if self.frame_cache:
+            self.frame_cache.clear()
+        if self.recognition_pool:
+            self.recognition_pool.update_gallery(gallery)
+        self.logger.info(f"既知の顔のギャラリーを更新しました ({len(gallery)} 件)。")
+        self._emit({"type": "gallery_reloaded", "known_faces": len(gallery)})
+
+    def _create_connection_manager(self):
+        """AppConfig.INGEST_BACKEND に応じた接続管理クラスを作成する"""
+        if AppConfig.INGEST_BACKEND == "asyncio":
+            from async_ingest import AsyncIngest # websockets が必要なため、使う場合だけ読み込む
+            manager_class = AsyncIngest
+        elif AppConfig.INGEST_BACKEND == "thread":
+            manager_class = ConnectionManager
+        else:
+            raise ValueError(f"不明な受信方式です: {AppConfig.INGEST_BACKEND} (選択肢: thread, asyncio)")
+        self.logger.info(f"受信方式: {AppConfig.INGEST_BACKEND}")
+        return manager_class(
+            self.logger,
+            initial_backoff=AppConfig.RECONNECT_INITIAL_BACKOFF_SEC,
+            max_backoff=AppConfig.RECONNECT_MAX_BACKOFF_SEC
+        )
+
+    @staticmethod
+    def _recognizer_options():
+        """AppConfigからFaceRecognizerのオプションを組み立てる"""
+        steps = [step.strip() for step in AppConfig.PREPROCESS_STEPS.split(",") if step.strip()]
+        options = {
+            "detector": create_detector(AppConfig.DETECTOR_STRATEGY, AppConfig.CASCADE_PATH, AppConfig.DETECT_MIN_FACE_RATIO),
+            "preprocessor": Preprocessor(steps, gamma=AppConfig.PREPROCESS_GAMMA),
+            "encode_crops": AppConfig.ENCODE_CROPS,
+            "face_cache_size": AppConfig.FACE_CACHE_SIZE,
+            "face_cache_ttl": AppConfig.RESULT_CACHE_TTL_SEC,
+        }
+        if AppConfig.TRACKING_ENABLED:
+            options["tracker"] = FaceTracker(
+                iou_threshold=AppConfig.TRACK_IOU_THRESHOLD,
+                max_missed=AppConfig.TRACK_MAX_MISSED,
+                reverify_interval=AppConfig.TRACK_REVERIFY_INTERVAL
+            )
+            options["detect_interval"] = AppConfig.TRACK_DETECT_INTERVAL
+        return options
+
+    @staticmethod
+    def _name_from_filename(filename):
+        """ファイル名から人物名を取得する"""
+        name_part = filename.split('_')[0]
+        return name_part if name_part else "Unknown"
+
+    @staticmethod
+    def _encode_face_file(filepath):
+        """画像ファイルから顔エンコーディングを計算する。顔がなければNoneを返す"""
+        import face_recognition # 読み込みに時間がかかるため、_warm_up() で読み込んだものを使う
+        img = face_recognition.load_image_file(filepath)
+        encodings = face_recognition.face_encodings(img)
+        return encodings[0] if encodings else None
+
+    def _on_websocket_message(self, camera_id, message):
+        """WebSocketメッセージ受信時の処理"""
+        if isinstance(message, bytes):
+            # 受信スレッドではキューに積むだけにして、すぐに次のフレームを読めるようにする
+            with self.metrics.time("receive"):
+                # 受信時刻は認識結果までの遅延の計測に使う
+                self.pipeline.submit(camera_id, (time.monotonic(), message))
+                recorder = self.recorders.get(camera_id)
+                if recorder:
+                    recorder.write(message)
+            self.metrics.inc("frames_received_total", camera=camera_id)
+
+        elif isinstance(message, str):
+            camera = self.cameras[camera_id]
+            if message == "error:frame_capture_failed":
+                self.logger.warning(f"ESP32 ({camera_id}) からフレーム取得失敗通知を受信しました。")
+                current_time_esp_err = time.time()
+                if (current_time_esp_err - camera.last_resolution_resend_time > AppConfig.RESOLUTION_RESEND_INTERVAL_SEC):
+                    self.logger.info(f"ESP32でのフレーム取得失敗のため、現在の解像度 ({camera.current_resolution}) を再送信します ({camera_id})。")
+                    self.send_command(f"SET_RESOLUTION:{camera.current_resolution}", camera_id)
+                    camera.last_resolution_resend_time = current_time_esp_err
+                else:
+                    self.logger.info("ESP32フレーム取得失敗通知を受信しましたが、短時間での解像度再送信はスキップします。")
+            elif message.startswith("from_esp32:"):
+                self.logger.info(f"[{camera_id}] {message}")
+            elif message.startswith("current_fps:"):
+                try:
+                    fps_val = message.split(":")[1].strip()
+                    self.logger.info(f"ESP32 ({camera_id}) からFPS設定を受信: {fps_val}")
+                    self._emit({"type": "camera_setting", "camera": camera_id, "fps": fps_val})
+                except IndexError:
+                    self.logger.warning(f"不正なFPSメッセージ形式: {message}")
+            elif message.startswith("current_resolution:"):
+                try:
+                    res_val = message.split(":")[1].strip()
+                    self.logger.info(f"ESP32 ({camera_id}) から解像度設定を受信: {res_val}")
+                    self._emit({"type": "camera_setting", "camera": camera_id, "resolution": res_val})
+                except IndexError:
+                    self.logger.warning(f"不正な解像度メッセージ形式: {message}")
+        else:
+            self.logger.warning(f"Unknown message type: {type(message)}")
+
+    def _decode_frame(self, camera_id, item):
+        """JPEGバイト列をデコードし、使い回す配列に回転して書き込む (デコードステージ)
+
+        後段には書き込みできないビューを渡すため、認識・表示の途中でフレームが書き換えられることはない。
+        フレームキャッシュを使う場合は、同じJPEGを以前にデコードしていればそのフレームを返す。
+        後段には (受信時刻, フレーム, フレームキャッシュのキー) を渡す (キャッシュを使わない場合のキーはNone)。
+        """
+        received_at, message = item
+        cache_key = None
+        if self.frame_cache is not None:
+            cache_key = (camera_id, frame_key(message))
+            cached = self.frame_cache.get(cache_key)
+            if cached is not None:
+                return received_at, cached.frame, cache_key
+        with self.metrics.time("decode"):
+            decoded = cv2.imdecode(np.frombuffer(message, np.uint8), cv2.IMREAD_COLOR)
+        if decoded is None:
+            self.logger.debug("フレームのデコードに失敗しました。")
+            self.metrics.inc("decode_failures_total", camera=camera_id)
+            return None
+        self.metrics.inc("frames_decoded_total", camera=camera_id)
+        with self.metrics.time("rotate"):
+            height, width = decoded.shape[:2]
+            frame = self.frame_pool.acquire((width, height, 3))
+            cv2.rotate(decoded, cv2.ROTATE_90_COUNTERCLOCKWISE, dst=frame)
+        frame = read_only(frame)
+        if cache_key is not None:
+            self.frame_cache.put(cache_key, CachedFrame(frame))
+        return received_at, frame, cache_key
+
+    def _reuse_cached_result(self, camera_id, item):
+        """同じJPEGの認識結果がフレームキャッシュにあれば、認識せずにそれを通知してTrueを返す"""
+        received_at, frame, cache_key = item
+        if cache_key is None:
+            return False
+        cached = self.frame_cache.peek(cache_key)
+        if cached is None or cached.face_matches is None:
+            return False
+        self.metrics.inc("frames_reused_total", camera=camera_id)
+        self._on_recognition_result(camera_id, frame, cached.face_matches, received_at)
+        return True
+
+    def _recognize_frame(self, camera_id, item):
+        """フレームの顔認識を行う (認識ステージ)"""
+        if not self.ready_event.is_set():
+            self._handle_warmup_frame(camera_id, item)
+            return
+        if self._reuse_cached_result(camera_id, item):
+            return
+        received_at, original_color_frame, cache_key = item
+        if self.recognition_pool:
+            # 結果はシーケンス番号順に、受信時刻とフレームキャッシュのキーと一緒に _on_pool_result へ渡される
+            # ワーカーが全て止まっていても認識スレッドが止まらないよう、待つ時間に上限を設ける
+            if not self.recognition_pool.submit(camera_id, original_color_frame,
+                                                timeout=AppConfig.RECOGNITION_SUBMIT_TIMEOUT_SEC,
+                                                context=(received_at, cache_key)):
+                self._pool_dropped[camera_id] = self._pool_dropped.get(camera_id, 0) + 1
+            return
+        with self.metrics.time("recognize"):
+            face_matches = self._recognizer_for(camera_id).recognize(original_color_frame)
+        self._on_recognition_result(camera_id, original_color_frame, face_matches, received_at, cache_key)
+
+    def _recognize_frames(self, items):
+        """複数のフレーム (カメラが異なってもよい) の顔をまとめて認識する (バッチ処理時の認識ステージ)"""
+        if not self.ready_event.is_set():
+            for camera_id, item in items:
+                self._handle_warmup_frame(camera_id, item)
+            return
+        from batch_encoder import recognize_batch # dlibを使うため、_warm_up() で読み込んだものを使う
+        items = [(camera_id, item) for camera_id, item in items if not self._reuse_cached_result(camera_id, item)]
+        if not items:
+            return
+        batch = [(self._recognizer_for(camera_id), frame) for camera_id, (_, frame, _) in items]
+        with self.metrics.time("recognize_batch"):
+            outcomes = recognize_batch(batch, self.gallery, self.metrics)
+        for (camera_id, (received_at, frame, cache_key)), (face_matches, error) in zip(items, outcomes):
+            if error is not None:
+                self.logger.error(f"顔認識中にエラーが発生しました ({camera_id}): {error}")
+                continue
+            self._on_recognition_result(camera_id, frame, face_matches, received_at, cache_key)
+
+    def _recognizer_for(self, camera_id):
+        """カメラごとの FaceRecognizer を返す (トラッカー等の状態をカメラごとに分ける)"""
+        recognizer = self.recognizers.get(camera_id)
+        if recognizer is None:
+            from recognizer import FaceRecognizer # dlibを使うため、_warm_up() で読み込んだものを使う
+            recognizer = self.recognizers[camera_id] = FaceRecognizer(
+                self.gallery, timer=self.metrics, **copy.deepcopy(self.recognizer_options)
+            )
+        return recognizer
+
+    def _on_pool_result(self, camera_id, original_color_frame, face_matches, context):
+        """ワーカープールの認識結果を処理する (結果の収集スレッドから呼ばれる)"""
+        received_at, cache_key = context
+        self._on_recognition_result(camera_id, original_color_frame, face_matches, received_at, cache_key)
+
+    def _on_recognition_result(self, camera_id, original_color_frame, face_matches, received_at=None, cache_key=None):
+        """認識結果を処理し、イベントとして通知する"""
+        self.metrics.inc("frames_recognized_total", camera=camera_id)
+        if cache_key is not None:
+            cached = self.frame_cache.peek(cache_key)
+            if cached is not None and cached.frame is original_color_frame:
+                cached.face_matches = face_matches
+        if received_at is not None:
+            latency = time.monotonic() - received_at
+            self.metrics.record("end_to_end", latency)
+            if self.quality_controller:
+                self.quality_controller.observe(camera_id, latency)
+        for match in face_matches:
+            if match.distance is not None:
+                self.metrics.observe("match_distance", match.distance, result="unknown" if match.name == "Unknown" else "known")
+        timestamp = time.time()
+        with self.metrics.time("handle_results"):
+            self._handle_face_results(camera_id, original_color_frame, face_matches, timestamp)
+        faces = [
+            {
+                "name": match.name,
+                "box": [int(v) for v in match.location],
+                "distance": match.distance,
+            }
+            for match in face_matches
+        ]
+        self._emit({"type": "faces", "camera": camera_id, "timestamp": timestamp, "faces": faces}, original_color_frame)
+
+        camera = self.cameras[camera_id]
+        camera.frame_count += 1
+        elapsed_time = time.time() - camera.start_time
+        if elapsed_time >= 1.0:
+            camera.current_fps = camera.frame_count / elapsed_time
+            camera.frame_count = 0
+            camera.start_time = time.time()
+            self._emit({"type": "fps", "camera": camera_id, "value": camera.current_fps})
+
+    def _on_websocket_error(self, camera_id, error):
+        """WebSocketエラー発生時の処理"""
+        self.logger.error(f"App WebSocketエラー ({camera_id}): {error}")
+        self._resume_stream_on_reconnect(camera_id)
+        self._emit({"type": "connection", "camera": camera_id, "state": "error", "detail": str(error)})
+
+    def _on_websocket_close(self, camera_id, close_status_code, close_msg):
+        """WebSocket接続切断時の処理"""
+        self.logger.warning(f"App WebSocket接続が切断されました ({camera_id})。コード: {close_status_code}, メッセージ: {close_msg}")
+        self._resume_stream_on_reconnect(camera_id)
+        self._emit({"type": "connection", "camera": camera_id, "state": "closed", "detail": close_msg})
+
+    def _resume_stream_on_reconnect(self, camera_id):
+        """ESP32は切断時にストリーミングを止めるため、実行中なら再接続時にstart_streamを送り直す"""
+        if self.is_running:
+            self.cameras[camera_id].send_stream_command_on_open = True
+
+    def _on_websocket_open(self, camera_id):
+        """WebSocket接続確立時の処理"""
+        self.logger.info(f"App WebSocket接続が確立しました ({camera_id})。")
+
+        camera = self.cameras[camera_id]
+        if camera.send_stream_command_on_open:
+            self.logger.info(f"接続確立のため、start_streamコマンドを送信します ({camera_id})。")
+            self.send_command("start_stream", camera_id)
+            camera.send_stream_command_on_open = False
+        self._emit({"type": "connection", "camera": camera_id, "state": "open", "detail": None})
+
+    def _camera_ids(self, camera_id):
+        """camera_id がNoneなら全カメラ、そうでなければそのカメラだけのIDリストを返す"""
+        if camera_id is None:
+            return list(self.cameras)
+        if camera_id not in self.cameras:
+            raise ValueError(f"不明なカメラです: {camera_id}")
+        return [camera_id]
+
+    def send_command(self, command, camera_id=None):
+        """ESP32-CAMにコマンドを送信する (camera_id がNoneなら全カメラ)"""
+        for target in self._camera_ids(camera_id):
+            self.connection_manager.send(target, command)
+
+    def start(self):
+        """ストリーミングを開始する"""
+        if self.is_running:
+            self.logger.info("既にプロセスが実行中です。")
+            return
+        self.is_running = True
+        self.logger.info("プロセスを開始します。")
+        self._emit({"type": "status", "running": True})
+
+        for camera_id, camera in self.cameras.items():
+            if self.connection_manager.is_connected(camera_id):
+                self.logger.info(f"WebSocketクライアントが接続済みです ({camera_id})。")
+                self.send_command("start_stream", camera_id)
+                camera.send_stream_command_on_open = False
+            else:
+                camera.send_stream_command_on_open = True
+        # 未接続のカメラへの接続と、切断時の再接続を開始する
+        self.connection_manager.connect_all()
+
+    def stop(self):
+        """ストリーミングを停止する"""
+        if not self.is_running:
+            self.logger.info("プロセスは既に停止しています。")
+            return
+        self.is_running = False
+        self.logger.info("プロセスを停止します。")
+        self._emit({"type": "status", "running": False})
+        for camera in self.cameras.values():
+            camera.send_stream_command_on_open = False
+        self.send_command("stop_stream")
+
+    def set_fps(self, fps, camera_id=None):
+        """ESP32-CAMのFPSを設定する (camera_id がNoneなら全カメラ)
+
+        自動調整が有効な場合、手動で設定した値がそのカメラのFPSの上限になる。
+        """
+        for target in self._camera_ids(camera_id):
+            self.cameras[target].current_fps_setting = fps
+            self.logger.info(f"FPSを{fps}に設定しました ({target})。")
+            self.send_command(f"SET_FPS:{fps}", target)
+            if self.quality_controller:
+                self.quality_controller.reset(target, fps=fps)
+
+    def set_resolution(self, resolution, camera_id=None):
+        """ESP32-CAMの解像度を設定する (camera_id がNoneなら全カメラ)
+
+        自動調整が有効な場合、手動で設定した値がそのカメラの解像度の上限になる。
+        """
+        for target in self._camera_ids(camera_id):
+            self.cameras[target].current_resolution = resolution
+            self.logger.info(f"解像度を{resolution}に設定しました ({target})。")
+            self.send_command(f"SET_RESOLUTION:{resolution}", target)
+            if self.quality_controller:
+                self.quality_controller.reset(target, resolution=resolution)
+
+    def _apply_adaptive_fps(self, camera_id, fps):
+        """自動調整によるFPSの変更 (制御スレッドから呼ばれる)"""
+        self.cameras[camera_id].current_fps_setting = fps
+        self.send_command(f"SET_FPS:{fps}", camera_id)
+        self._emit_quality_adjusted(camera_id)
+
+    def _apply_adaptive_resolution(self, camera_id, resolution):
+        """自動調整による解像度の変更 (制御スレッドから呼ばれる)"""
+        self.cameras[camera_id].current_resolution = resolution
+        self.send_command(f"SET_RESOLUTION:{resolution}", camera_id)
+        self._emit_quality_adjusted(camera_id)
+
+    def _emit_quality_adjusted(self, camera_id):
+        camera = self.cameras[camera_id]
+        self._emit({
+            "type": "quality_adjusted",
+            "camera": camera_id,
+            "fps": camera.current_fps_setting,
+            "resolution": camera.current_resolution,
+        })
+
+    def _handle_face_results(self, camera_id, frame, face_matches, timestamp):
+        """認識結果を処理する (未知の顔の保存・認識した人物の記録)"""
+        for match in face_matches:
+            name = match.name
+
+            if name == "Unknown":
+                if self.save_unknown_faces: # トグルスイッチの状態を確認
+                    # 顔の切り抜きだけをキューに積み、書き込みはバックグラウンドで行う
+                    self.unknown_face_writer.submit(camera_id, frame, match.location, match.encoding)
+                else:
+                    self.logger.debug("未知の顔の保存は無効になっています。")
+            else:
+                self.logger.info(f"顔を検出しました: {name}")
+                if self.sighting_store:
+                    # キューに積むだけで、コミットは書き込みスレッドがまとめて行う
+                    self.sighting_store.record(name, camera_id, timestamp, match.location, match.distance)
+
+    def _on_unknown_face_saved(self, camera_id, filename):
+        """未知の顔が保存された時の処理 (書き込みスレッドから呼ばれる)"""
+        self.metrics.inc("unknown_faces_saved_total", camera=camera_id)
+        self._emit({"type": "unknown_face_saved", "camera": camera_id, "filename": filename})
+
+    def shutdown(self):
+        """サービスを終了する"""
+        with self._warmup_lock:
+            # 読み込みが終わっていなければ、ワーカープール等を開始させない
+            self._shutting_down = True
+        if self.is_running:
+            self.stop() # ストリームを停止
+
+        self.logger.info("WebSocketクライアントを明示的に閉じます。")
+        self.connection_manager.close_all()
+
+        if self.quality_controller:
+            self.quality_controller.stop()
+        self.pipeline.stop()
+        if self.recognition_pool:
+            self.recognition_pool.stop()
+        if self.gallery_watcher:
+            self.gallery_watcher.stop()
+        self.unknown_face_writer.stop()
+        if self.sighting_store:
+            self.sighting_store.stop()
+        if self.metrics_server:
+            self.metrics_server.stop()
+        if self.metrics_writer:
+            self.metrics_writer.stop()
+        for camera_id, recorder in self.recorders.items():
+            recorder.close()
+            self.logger.info(f"フレームの記録を終了しました ({camera_id}: {recorder.frame_count} フレーム)。")
+            if recorder.dropped_count:
+                self.logger.warning(f"書き込みが追いつかず記録しなかったフレームがあります ({camera_id}: {recorder.dropped_count} フレーム)。")
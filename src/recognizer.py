@@ -0,0 +1,226 @@
+from collections import namedtuple
+import cv2
+import face_recognition
+from detectors import HogDetector
+from preprocess import Preprocessor
+from stage_timer import NullTimer
+from batch_encoder import face_chips
+from result_cache import ResultCache, face_hash
+from tracker import iou
+
+# 1つの顔の認識結果。location は (top, right, bottom, left)、distance は最も近い既知の顔との距離 (既知の顔がなければNone)
+# track_id はトラッカー使用時のみ設定される
+FaceMatch = namedtuple("FaceMatch", ["location", "name", "distance", "encoding", "track_id"], defaults=(None,))
+
+
+class PreparedFrame:
+    """prepare() の結果。エンコードが必要な顔の位置 (locations) と、バッチ処理用の顔画像 (chips) を持つ
+
+    顔のキャッシュを使う場合、locations はキャッシュにない顔だけで、all_locations に全ての顔、
+    cached に顔ごとのキャッシュの値 ((エンコーディング, (名前, 距離), 顔の位置, トラックID) またはNone)、
+    owners に顔ごとのトラックID (トラッカーを使わない場合はNone) が入る。
+    """
+    __slots__ = ("frame", "color_for_dlib", "locations", "chips", "tracks", "pending_tracks", "reuse_last",
+                 "all_locations", "face_keys", "cached", "owners")
+
+    def __init__(self, frame, color_for_dlib, locations, tracks=None, pending_tracks=None, reuse_last=False):
+        self.frame = frame
+        self.color_for_dlib = color_for_dlib
+        self.locations = locations
+        self.chips = None
+        self.tracks = tracks
+        self.pending_tracks = pending_tracks
+        self.reuse_last = reuse_last
+        self.all_locations = locations
+        self.face_keys = None
+        self.cached = None
+        self.owners = None
+
+
+class FaceRecognizer:
+    """フレームの前処理・顔検出・エンコード・照合を行うクラス
+
+    GUIやWebSocketには依存しないため、スレッドやワーカープロセスからも利用できる。
+    tracker を渡すと、追跡中の顔はエンコードを省略し、detect_interval フレームごとにだけHOG検出を行う。
+    detector が None を返した場合 (動きがない場合) は前回の結果をそのまま返す。
+    timer を渡すと、前処理・検出・エンコード・照合の各ステージの処理時間を timer.time(stage) で計測する。
+    face_cache_size を1以上にすると、顔の切り出しの知覚ハッシュをキーに、見た目がほぼ同じ顔のエンコーディングと
+    照合結果を face_cache_ttl 秒の間使い回す (ギャラリーを set_gallery() で差し替えると破棄する)。
+    ハッシュは64ビットしかないため、ヒットしても顔の位置が登録時とほぼ同じ (IoUが FACE_CACHE_MIN_IOU 以上) で、
+    トラッカー使用時は同じトラックの顔である場合だけ使う。
+    encode_crops を True にすると、エンコードを前処理後の画像ではなく元のフレームから切り出した
+    顔の周辺 (顔のサイズ × crop_padding の余白付き) で行う (既知の顔と同じく前処理していないカラー画像になる)。
+
+    recognize() は prepare() (前処理・検出・追跡)、エンコード・照合、finish() (結果の組み立て) を順に行う。
+    複数フレームの顔をまとめてエンコードする場合は batch_encoder.recognize_batch() を使う。
+    """
+    FACE_CACHE_MIN_IOU = 0.7
+
+    def __init__(self, gallery, tracker=None, detect_interval=1, detector=None, preprocessor=None, timer=None,
+                 encode_crops=False, crop_padding=0.5, face_cache_size=0, face_cache_ttl=10.0):
+        self.gallery = gallery
+        self.tracker = tracker
+        self.detect_interval = max(1, detect_interval)
+        self.detector = detector or HogDetector()
+        self.preprocessor = preprocessor or Preprocessor()
+        self.timer = timer or NullTimer()
+        self.encode_crops = encode_crops
+        self.crop_padding = crop_padding
+        self.face_cache = ResultCache(face_cache_size, face_cache_ttl) if face_cache_size > 0 else None
+        self._last_results = []
+        self._frame_index = 0
+        self._prev_processed = None
+
+    def set_gallery(self, gallery):
+        """照合に使うギャラリーを差し替える (古いギャラリーでの照合結果のキャッシュは破棄する)"""
+        self.gallery = gallery
+        if self.face_cache is not None:
+            self.face_cache.clear()
+
+    def recognize(self, frame):
+        """フレーム内の顔を検出・認識し、FaceMatchのリストを返す"""
+        prepared = self.prepare(frame)
+        face_encodings, matches = [], []
+        if prepared.locations:
+            with self.timer.time("encode"):
+                face_encodings = self._encode(frame, prepared.color_for_dlib, prepared.locations)
+            # フレーム内の全ての顔をまとめて照合する
+            with self.timer.time("match"):
+                matches = self.gallery.match(face_encodings)
+        return self.finish(prepared, face_encodings, matches)
+
+    def prepare(self, frame, extract_chips=False):
+        """前処理・検出・追跡を行い、エンコードが必要な顔を PreparedFrame として返す
+
+        extract_chips を True にすると、エンコード用に顔を切り出して位置合わせした画像 (chips) も作る。
+        chips は前処理用のバッファを参照しないため、後続のフレームを処理した後でもエンコードできる。
+        """
+        with self.timer.time("preprocess"):
+            processed_frame, color_for_dlib = self.preprocessor.run(frame)
+        if self.tracker is not None:
+            prepared = self._prepare_tracked(frame, processed_frame, color_for_dlib)
+        else:
+            with self.timer.time("detect"):
+                face_locations = self.detector.detect(processed_frame, color_for_dlib)
+            if face_locations is None:
+                prepared = PreparedFrame(frame, color_for_dlib, [], reuse_last=True)
+            else:
+                prepared = PreparedFrame(frame, color_for_dlib, list(face_locations))
+        if self.face_cache is not None and prepared.locations:
+            with self.timer.time("face_cache"):
+                self._lookup_faces(frame, prepared)
+        if extract_chips:
+            with self.timer.time("landmarks"):
+                prepared.chips = self._chips(frame, color_for_dlib, prepared.locations)
+            prepared.color_for_dlib = None
+        return prepared
+
+    def finish(self, prepared, face_encodings, matches):
+        """prepare() で選んだ顔のエンコーディングと照合結果から、FaceMatchのリストを返す"""
+        if prepared.cached is not None:
+            face_encodings, matches = self._merge_cached(prepared, face_encodings, matches)
+        if prepared.tracks is not None:
+            for track, face_encoding, (name, distance) in zip(prepared.pending_tracks, face_encodings, matches):
+                track.set_identity(name, distance, face_encoding)
+            return [
+                FaceMatch(t.location, t.name, t.distance, t.encoding, t.track_id)
+                for t in prepared.tracks if not t.needs_encoding
+            ]
+        if prepared.reuse_last:
+            return self._last_results
+        self._last_results = [
+            FaceMatch(location, name, distance, face_encoding)
+            for location, face_encoding, (name, distance) in zip(prepared.all_locations, face_encodings, matches)
+        ]
+        return self._last_results
+
+    def _lookup_faces(self, frame, prepared):
+        """顔の知覚ハッシュでキャッシュを引き、同じ顔だと確かめられた顔をエンコード対象 (locations) から外す"""
+        if prepared.pending_tracks is not None:
+            prepared.owners = [t.track_id for t in prepared.pending_tracks]
+        else:
+            prepared.owners = [None] * len(prepared.all_locations)
+        prepared.face_keys = [face_hash(frame, location) for location in prepared.all_locations]
+        prepared.cached = [
+            None if key is None else self.face_cache.get(key, self._same_face(location, owner))
+            for key, location, owner in zip(prepared.face_keys, prepared.all_locations, prepared.owners)
+        ]
+        prepared.locations = [location for location, hit in zip(prepared.all_locations, prepared.cached) if hit is None]
+
+    def _same_face(self, location, owner):
+        """キャッシュの値が同じ位置・同じトラックの顔のものか確かめる関数を返す"""
+        def verify(value):
+            return value[3] == owner and iou(value[2], location) >= self.FACE_CACHE_MIN_IOU
+        return verify
+
+    def _merge_cached(self, prepared, face_encodings, matches):
+        """キャッシュの値と新しく計算した結果を all_locations の順に並べ、新しい結果をキャッシュに入れる"""
+        computed = iter(zip(face_encodings, matches))
+        merged_encodings, merged_matches = [], []
+        for key, hit, location, owner in zip(prepared.face_keys, prepared.cached, prepared.all_locations, prepared.owners):
+            if hit is None:
+                hit = next(computed, None)
+                if hit is None:
+                    break
+                hit = (hit[0], hit[1], location, owner)
+                if key is not None:
+                    self.face_cache.put(key, hit)
+            merged_encodings.append(hit[0])
+            merged_matches.append(hit[1])
+        return merged_encodings, merged_matches
+
+    def _crop(self, frame, location):
+        """元のフレームから顔の周辺を切り出し、(RGBの切り出し画像, 切り出し内での顔の位置) を返す"""
+        top, right, bottom, left = location
+        height, width = frame.shape[:2]
+        pad_y, pad_x = int((bottom - top) * self.crop_padding), int((right - left) * self.crop_padding)
+        y0, x0 = max(top - pad_y, 0), max(left - pad_x, 0)
+        y1, x1 = min(bottom + pad_y, height), min(right + pad_x, width)
+        crop = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2RGB)
+        return crop, (top - y0, right - x0, bottom - y0, left - x0)
+
+    def _encode(self, frame, color_for_dlib, face_locations):
+        """検出した顔のエンコーディングを計算する"""
+        if not self.encode_crops:
+            return face_recognition.face_encodings(color_for_dlib, face_locations)
+        encodings = []
+        for location in face_locations:
+            crop, crop_location = self._crop(frame, location)
+            encodings.extend(face_recognition.face_encodings(crop, [crop_location]))
+        return encodings
+
+    def _chips(self, frame, color_for_dlib, face_locations):
+        """検出した顔をエンコード用に位置合わせした画像のリストを返す"""
+        if not self.encode_crops:
+            return face_chips(color_for_dlib, face_locations)
+        chips = []
+        for location in face_locations:
+            crop, crop_location = self._crop(frame, location)
+            chips.extend(face_chips(crop, [crop_location]))
+        return chips
+
+    def _prepare_tracked(self, frame, processed_frame, color_for_dlib):
+        """トラッカーを使って、新しい顔と再確認が必要な顔だけをエンコード対象にする"""
+        if self._prev_processed is not None and self._prev_processed.shape != processed_frame.shape:
+            # 解像度が変わった場合は追跡をやり直す
+            self.tracker.reset()
+            self._prev_processed = None
+
+        detect = self._prev_processed is None or self._frame_index % self.detect_interval == 0
+        self._frame_index += 1
+
+        pending = []
+        if detect:
+            with self.timer.time("detect"):
+                face_locations = self.detector.detect(processed_frame, color_for_dlib)
+            if face_locations is None:
+                # 動きがないので追跡中の顔をそのまま使う
+                face_locations = [t.location for t in self.tracker.tracks if not t.missed]
+            tracks = self.tracker.update(face_locations)
+            pending = [t for t in tracks if t.needs_encoding]
+        else:
+            with self.timer.time("track"):
+                tracks = self.tracker.propagate(self._prev_processed, processed_frame)
+
+        self._prev_processed = processed_frame
+        return PreparedFrame(frame, color_for_dlib, [t.location for t in pending], tracks=tracks, pending_tracks=pending)
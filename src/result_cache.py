@@ -0,0 +1,100 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+
+def frame_key(data):
+    """JPEGバイト列の内容から決まるキー (バイト列が同じなら同じキーになる)"""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def face_hash(frame, location, hash_size=8):
+    """顔の切り出しの知覚ハッシュ (dHash) を返す。切り出しが空ならNone
+
+    縮小したグレースケール画像の隣り合う画素の大小だけを使うため、
+    JPEGのノイズや明るさの僅かな変化ではハッシュが変わりにくい。
+    """
+    top, right, bottom, left = location
+    crop = frame[max(top, 0):bottom, max(left, 0):right]
+    if crop.size == 0:
+        return None
+    if crop.ndim == 3:
+        crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(crop, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return np.packbits(small[:, 1:] > small[:, :-1]).tobytes()
+
+
+class CachedFrame:
+    """フレームキャッシュの値。デコード済みのフレームと、認識が終わっていればその結果を持つ"""
+    __slots__ = ("frame", "face_matches")
+
+    def __init__(self, frame, face_matches=None):
+        self.frame = frame
+        self.face_matches = face_matches
+
+
+class ResultCache:
+    """最大 max_entries 件のLRUキャッシュ。登録から ttl 秒経った値は使わずに捨てる
+
+    get() のたびにヒット・ミスを数える (peek() は数えない)。複数のスレッドから使える。
+    get() に verify を渡すと、値を verify(value) で確かめ、Falseならミスとして扱う (値は残す)。
+    """
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict() # キー -> (値, 期限)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def get(self, key, verify=None):
+        """値を返す (なければNone)"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None and verify is not None and not verify(value):
+                value = None
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def peek(self, key):
+        """ヒット・ミスを数えずに値を返す (なければNone)"""
+        with self._lock:
+            return self._lookup(key)
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
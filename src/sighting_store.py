@@ -0,0 +1,291 @@
+"""認識した人物の記録 (SQLite)
+
+認識スレッドからは record() でキューに積むだけにし、書き込みスレッドがまとめてコミットする。
+同じ人物・同じカメラの続けての検出は訪問 (visits) の区間にまとめる。
+
+期間を指定して記録を表示する例:
+    python src/sighting_store.py --since "2024-05-18 10:00" --until "2024-05-18 12:00"
+"""
+import os
+import time
+import queue
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sightings (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    camera TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    box_top INTEGER NOT NULL,
+    box_right INTEGER NOT NULL,
+    box_bottom INTEGER NOT NULL,
+    box_left INTEGER NOT NULL,
+    distance REAL,
+    visit_id INTEGER NOT NULL REFERENCES visits(id)
+);
+CREATE INDEX IF NOT EXISTS sightings_timestamp ON sightings(timestamp);
+CREATE INDEX IF NOT EXISTS sightings_name_timestamp ON sightings(name, timestamp);
+CREATE TABLE IF NOT EXISTS visits (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    camera TEXT NOT NULL,
+    start_time REAL NOT NULL,
+    end_time REAL NOT NULL,
+    detections INTEGER NOT NULL,
+    min_distance REAL
+);
+CREATE INDEX IF NOT EXISTS visits_start_time ON visits(start_time);
+CREATE INDEX IF NOT EXISTS visits_name_camera_start_time ON visits(name, camera, start_time);
+"""
+
+
+class _Visit:
+    """書き込みスレッドが更新中の訪問"""
+    __slots__ = ("visit_id", "start_time", "end_time", "detections", "min_distance", "last_sighting")
+
+    def __init__(self, visit_id, start_time, end_time, detections, min_distance, last_sighting):
+        self.visit_id = visit_id
+        self.start_time = start_time
+        self.end_time = end_time
+        self.detections = detections
+        self.min_distance = min_distance
+        self.last_sighting = last_sighting
+
+
+def _min_distance(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
+
+
+class SightingStore:
+    """認識した人物 (名前・カメラ・時刻・位置・距離) をSQLite (WALモード) に記録するクラス
+
+    record() は認識スレッドから呼ばれ、キューに積むだけで待たない (キューが満杯なら捨てて dropped_count に数える)。
+    書き込みスレッドは batch_size 件たまるか flush_interval 秒経つごとに1トランザクションでコミットする。
+
+    同じ人物・同じカメラで前回の検出から gap_sec 秒以内の検出は同じ訪問 (visits) にまとめる。
+    訪問の長さは max_visit_sec までとし、超えたら新しい訪問にする。これにより期間の検索では
+    start_time のインデックスだけで重なる訪問を絞り込める。
+    検出ごとの記録 (sightings) は同じ訪問の中で min_interval 秒に1件までとし、間の検出は訪問の回数だけに数える。
+    """
+    def __init__(self, path, logger, gap_sec=10.0, max_visit_sec=3600.0, min_interval=1.0,
+                 batch_size=200, flush_interval=1.0, queue_size=10000, timer=None):
+        self.path = path
+        self.logger = logger
+        self.gap_sec = gap_sec
+        self.max_visit_sec = max_visit_sec
+        self.min_interval = min_interval
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timer = timer
+        self.written_count = 0
+        self.dropped_count = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._visits = {} # (name, camera) -> _Visit
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="sighting-store", daemon=True)
+        self._thread.start()
+        self.logger.info(f"認識した人物を {self.path} に記録します。")
+
+    def stop(self, timeout=5.0):
+        """キューに残っている記録を書き込んでから終了する"""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout=timeout)
+        if self._thread.is_alive():
+            self.logger.warning("認識した人物の書き込みスレッドがタイムアウト後も終了していません。")
+        self._thread = None
+
+    def record(self, name, camera_id, timestamp, location, distance):
+        """検出した人物を記録する (認識スレッドから呼ばれる)。キューが満杯で捨てた場合はFalseを返す"""
+        try:
+            self._queue.put_nowait((name, camera_id, timestamp, tuple(int(v) for v in location), distance))
+            return True
+        except queue.Full:
+            self.dropped_count += 1
+            return False
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while not (self._stop_event.is_set() and self._queue.empty()):
+                batch = self._collect()
+                if not batch:
+                    continue
+                try:
+                    if self.timer is not None:
+                        with self.timer.time("sighting_commit"):
+                            self._write(conn, batch)
+                    else:
+                        self._write(conn, batch)
+                    self.written_count += len(batch)
+                except sqlite3.Error as e:
+                    conn.rollback()
+                    self._visits.clear() # 書き込めなかった訪問はデータベースから読み直す
+                    self.logger.error(f"認識した人物の記録に失敗しました ({len(batch)} 件): {e}")
+        finally:
+            conn.close()
+
+    def _collect(self):
+        """最初の記録から flush_interval 秒以内に届いた記録を batch_size 件までまとめて返す"""
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop_event.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _visit_for(self, conn, name, camera_id, timestamp):
+        """検出を含める訪問を返す。続きでなければ新しい訪問を作る"""
+        key = (name, camera_id)
+        visit = self._visits.get(key)
+        if visit is None:
+            # 再起動前に記録した訪問の続きかもしれない
+            row = conn.execute(
+                "SELECT id, start_time, end_time, detections, min_distance FROM visits "
+                "WHERE name = ? AND camera = ? ORDER BY start_time DESC LIMIT 1",
+                (name, camera_id)
+            ).fetchone()
+            if row is not None:
+                visit = _Visit(*row, last_sighting=row[2])
+        if visit is not None and (timestamp - visit.end_time > self.gap_sec or
+                                  timestamp - visit.start_time > self.max_visit_sec or
+                                  timestamp < visit.start_time):
+            visit = None
+        if visit is None:
+            cursor = conn.execute(
+                "INSERT INTO visits (name, camera, start_time, end_time, detections, min_distance) VALUES (?, ?, ?, ?, 0, NULL)",
+                (name, camera_id, timestamp, timestamp)
+            )
+            visit = _Visit(cursor.lastrowid, timestamp, timestamp, 0, None, None)
+        self._visits[key] = visit
+        return visit
+
+    def _write(self, conn, batch):
+        sightings = []
+        touched = {} # 訪問ID -> このバッチで更新した訪問 (途中で新しい訪問に替わったものも含む)
+        for name, camera_id, timestamp, (top, right, bottom, left), distance in batch:
+            visit = self._visit_for(conn, name, camera_id, timestamp)
+            visit.end_time = max(visit.end_time, timestamp)
+            visit.detections += 1
+            visit.min_distance = _min_distance(visit.min_distance, distance)
+            touched[visit.visit_id] = visit
+            if visit.last_sighting is None or timestamp - visit.last_sighting >= self.min_interval:
+                sightings.append((name, camera_id, timestamp, top, right, bottom, left, distance, visit.visit_id))
+                visit.last_sighting = timestamp
+        conn.executemany(
+            "INSERT INTO sightings (name, camera, timestamp, box_top, box_right, box_bottom, box_left, distance, visit_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            sightings
+        )
+        conn.executemany(
+            "UPDATE visits SET end_time = ?, detections = ?, min_distance = ? WHERE id = ?",
+            [(v.end_time, v.detections, v.min_distance, v.visit_id) for v in touched.values()]
+        )
+        conn.commit()
+        # 終わった訪問はメモリから外す
+        now = time.time()
+        for key in [k for k, v in self._visits.items() if now - v.end_time > self.gap_sec + self.flush_interval]:
+            del self._visits[key]
+
+    def visits_between(self, start, end, name=None):
+        """期間 [start, end] (UNIX時刻) に重なる訪問を開始時刻順に返す (コミット済みの記録のみ)"""
+        query = (
+            "SELECT name, camera, start_time, end_time, detections, min_distance FROM visits "
+            "WHERE start_time BETWEEN ? AND ? AND end_time >= ?"
+        )
+        params = [start - self.max_visit_sec, end, start]
+        if name is not None:
+            query += " AND name = ?"
+            params.append(name)
+        query += " ORDER BY start_time"
+        with sqlite3.connect(self.path, timeout=30.0) as conn:
+            rows = conn.execute(query, params).fetchall()
+        keys = ("name", "camera", "start_time", "end_time", "detections", "min_distance")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def sightings_between(self, start, end, name=None):
+        """期間 [start, end] (UNIX時刻) の検出の記録を時刻順に返す (コミット済みの記録のみ)"""
+        query = (
+            "SELECT name, camera, timestamp, box_top, box_right, box_bottom, box_left, distance FROM sightings "
+            "WHERE timestamp BETWEEN ? AND ?"
+        )
+        params = [start, end]
+        if name is not None:
+            query += " AND name = ?"
+            params.append(name)
+        query += " ORDER BY timestamp"
+        with sqlite3.connect(self.path, timeout=30.0) as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [
+            {"name": n, "camera": c, "timestamp": t, "box": [top, right, bottom, left], "distance": d}
+            for n, c, t, top, right, bottom, left, d in rows
+        ]
+
+
+def _parse_time(value):
+    """"YYYY-mm-dd HH:MM" 形式 (秒は省略可) またはUNIX時刻をUNIX時刻に変換する"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    from config import AppConfig
+    parser = argparse.ArgumentParser(description="期間を指定して、記録した訪問 (いつ誰がどのカメラに映っていたか) を表示する")
+    parser.add_argument("--db", default=AppConfig.SIGHTING_DB_PATH, help="記録のデータベース (デフォルト: SIGHTING_DB_PATH)")
+    parser.add_argument("--since", required=True, help="開始時刻 (例: 2024-05-18 10:00)")
+    parser.add_argument("--until", default=None, help="終了時刻 (省略時は現在)")
+    parser.add_argument("--name", default=None, help="人物名で絞り込む")
+    args = parser.parse_args()
+
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+    store = SightingStore(args.db, logging.getLogger("sighting_store"), max_visit_sec=AppConfig.SIGHTING_MAX_VISIT_SEC)
+    until = _parse_time(args.until) if args.until else time.time()
+    for visit in store.visits_between(_parse_time(args.since), until, args.name):
+        start = datetime.fromtimestamp(visit["start_time"]).strftime("%Y-%m-%d %H:%M:%S")
+        end = datetime.fromtimestamp(visit["end_time"]).strftime("%H:%M:%S")
+        distance = "-" if visit["min_distance"] is None else f"{visit['min_distance']:.3f}"
+        print(f"{start} - {end}  {visit['name']:<16} {visit['camera']:<6} 検出 {visit['detections']:>6} 回  最小距離 {distance}")
+
+
+if __name__ == "__main__":
+    main()
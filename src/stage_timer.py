@@ -0,0 +1,76 @@
+import time
+import threading
+from collections import defaultdict
+import numpy as np
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class NullTimer:
+    """計測を行わないタイマー (計測しない場合のデフォルト)"""
+    def time(self, stage):
+        return _NULL_SPAN
+
+
+class TimingSpan:
+    """with ブロックの処理時間を recorder.record(stage, seconds) に記録する"""
+    __slots__ = ("recorder", "stage", "start")
+
+    def __init__(self, recorder, stage):
+        self.recorder = recorder
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.recorder.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class LatencyRecorder:
+    """ステージごとの処理時間をすべて記録し、パーセンタイルを計算するタイマー
+
+    with recorder.time("decode"): ... の形で使う。ベンチマーク用で、記録は無制限に増える。
+    """
+    def __init__(self):
+        self._samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def time(self, stage):
+        return TimingSpan(self, stage)
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self._samples[stage].append(seconds)
+
+    def count(self, stage):
+        with self._lock:
+            return len(self._samples.get(stage, ()))
+
+    def total(self, stage):
+        """指定したステージの処理時間の合計 (秒) を返す"""
+        with self._lock:
+            return float(sum(self._samples.get(stage, ())))
+
+    def percentiles(self, stage, percents=(50, 90, 99)):
+        """指定したステージの処理時間のパーセンタイル (ms) を返す。記録がなければNone"""
+        with self._lock:
+            samples = list(self._samples.get(stage, ()))
+        if not samples:
+            return None
+        return [float(v) * 1000 for v in np.percentile(samples, percents)]
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
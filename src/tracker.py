@@ -0,0 +1,124 @@
+import itertools
+import cv2
+import numpy as np
+
+
+def iou(a, b):
+    """2つの (top, right, bottom, left) 矩形のIoUを計算する"""
+    top = max(a[0], b[0])
+    right = min(a[1], b[1])
+    bottom = min(a[2], b[2])
+    left = max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    if inter == 0:
+        return 0.0
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return inter / float(area_a + area_b - inter)
+
+
+class Track:
+    """フレーム間で追跡している1つの顔"""
+    _ids = itertools.count(1)
+
+    def __init__(self, location):
+        self.track_id = next(Track._ids)
+        self.location = location
+        self.name = None
+        self.distance = None
+        self.encoding = None
+        self.frames_since_verify = 0
+        self.missed = 0
+
+    @property
+    def needs_encoding(self):
+        return self.encoding is None
+
+    def set_identity(self, name, distance, encoding):
+        self.name = name
+        self.distance = distance
+        self.encoding = encoding
+        self.frames_since_verify = 0
+
+
+class FaceTracker:
+    """IoUによるフレーム間の顔の対応付けを行うトラッカー
+
+    対応付けられた顔は前回の認識結果を引き継ぎ、新しいトラックか reverify_interval
+    フレームごとの再確認のときだけエンコードが必要になる。検出を間引くフレームでは
+    オプティカルフローで矩形を移動させる。
+    """
+    def __init__(self, iou_threshold=0.3, max_missed=3, reverify_interval=30):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.reverify_interval = reverify_interval
+        self.tracks = []
+
+    def update(self, locations):
+        """検出結果と既存のトラックを対応付け、検出順にトラックのリストを返す"""
+        pairs = []
+        for i, location in enumerate(locations):
+            for track in self.tracks:
+                score = iou(location, track.location)
+                if score >= self.iou_threshold:
+                    pairs.append((score, i, track))
+        # IoUの大きい組から貪欲に割り当てる
+        pairs.sort(key=lambda p: p[0], reverse=True)
+
+        assigned = [None] * len(locations)
+        used = set()
+        for score, i, track in pairs:
+            if assigned[i] is None and track.track_id not in used:
+                assigned[i] = track
+                used.add(track.track_id)
+
+        for track in self.tracks:
+            if track.track_id not in used:
+                track.missed += 1
+        self.tracks = [t for t in self.tracks if t.missed <= self.max_missed]
+
+        for i, location in enumerate(locations):
+            track = assigned[i]
+            if track is None:
+                track = Track(location)
+                self.tracks.append(track)
+                assigned[i] = track
+            else:
+                track.location = location
+                track.missed = 0
+                track.frames_since_verify += 1
+                if track.frames_since_verify >= self.reverify_interval:
+                    track.encoding = None  # 再確認のためにエンコードし直す
+        return assigned
+
+    def propagate(self, prev_gray, gray):
+        """検出を行わないフレームで、オプティカルフローにより各トラックの矩形を移動させる"""
+        height, width = gray.shape[:2]
+        alive = []
+        for track in self.tracks:
+            if track.missed:
+                continue
+            top, right, bottom, left = track.location
+            mask = np.zeros_like(prev_gray)
+            mask[max(top, 0):max(bottom, 0), max(left, 0):max(right, 0)] = 255
+            points = cv2.goodFeaturesToTrack(prev_gray, maxCorners=20, qualityLevel=0.01, minDistance=3, mask=mask)
+            if points is None:
+                track.missed += 1
+                continue
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None)
+            ok = status.reshape(-1) == 1
+            if ok.sum() < 3:
+                track.missed += 1
+                continue
+            dx, dy = np.median((moved - points).reshape(-1, 2)[ok], axis=0)
+            dx, dy = int(round(dx)), int(round(dy))
+            track.location = (
+                min(max(top + dy, 0), height), min(max(right + dx, 0), width),
+                min(max(bottom + dy, 0), height), min(max(left + dx, 0), width)
+            )
+            track.frames_since_verify += 1
+            alive.append(track)
+        return alive
+
+    def reset(self):
+        self.tracks = []
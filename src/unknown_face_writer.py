@@ -0,0 +1,184 @@
+import os
+import time
+import threading
+import collections
+from datetime import datetime
+import cv2
+import numpy as np
+
+
+class UnknownFaceWriter:
+    """未知の顔の切り抜きをバックグラウンドで保存するクラス
+
+    submit() は認識スレッドから呼ばれ、顔の切り抜きをコピーしてキューに積むだけにする。
+    直近に保存した未知の顔とエンコーディングの距離が dedup_threshold 未満なら同じ人物とみなして保存しない。
+    同じ人物が映り続けている間は dedup_window_sec を過ぎても保存しない (最後に見た時刻から数える)。
+    submit() は待たない。キューが満杯の場合は、キューに積んだ後も映り続けている人物 (重複として捨てた顔がある) を
+    キューから外して新しい人物を積む。外した人物は保存済みとして覚えないため、次に映った時に改めて積まれる。
+    一度しか映らない人物を優先するためで、外せる人物がいない場合だけ新しい人物を捨てて dropped_count に数える。
+    """
+    DROP_WARNING_INTERVAL = 10.0 # 捨てたことを警告する間隔 (秒)
+
+    def __init__(self, faces_dir, logger, dedup_threshold=0.5, dedup_window_sec=600, queue_size=32,
+                 batch_size=8, padding=0.2, max_recent=1000, on_saved=None):
+        self.faces_dir = faces_dir
+        self.logger = logger
+        self.dedup_threshold = dedup_threshold
+        self.dedup_window_sec = dedup_window_sec
+        self.batch_size = batch_size
+        self.padding = padding
+        self.max_recent = max_recent
+        self.on_saved = on_saved
+        self.queue_size = queue_size
+
+        self._pending = collections.deque() # (カメラID, 時刻, 切り抜き, _recent_encodings に記録したエンコーディング)
+        self._pending_cond = threading.Condition()
+        self._recent_encodings = [] # 直近に保存した未知の顔のエンコーディング
+        self._recent_last_seen = [] # それぞれを最後に見た時刻
+        self._recent_lock = threading.Lock()
+        self._sequence = 0
+        self._thread = None
+        self._stop_event = threading.Event()
+        self.saved_count = 0
+        self.duplicate_count = 0
+        self.dropped_count = 0
+        self.evicted_count = 0
+        self._last_drop_warning = 0.0
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="unknown-face-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """キューに残っている顔を書き出してから終了する"""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout=timeout)
+        if self._thread.is_alive():
+            self.logger.warning("未知の顔の書き込みスレッドがタイムアウト後も終了していません。")
+        self._thread = None
+
+    def _remember(self, encoding, now):
+        """直近に保存した未知の顔と同じ人物なら最後に見た時刻を更新してNoneを返し、新しい人物なら記録したエンコーディングを返す"""
+        with self._recent_lock:
+            # 一定時間見ていない人物は忘れる
+            keep = [i for i, t in enumerate(self._recent_last_seen) if now - t < self.dedup_window_sec]
+            if len(keep) != len(self._recent_last_seen):
+                self._recent_encodings = [self._recent_encodings[i] for i in keep]
+                self._recent_last_seen = [self._recent_last_seen[i] for i in keep]
+
+            if self._recent_encodings:
+                distances = np.linalg.norm(np.asarray(self._recent_encodings) - encoding, axis=1)
+                nearest = int(np.argmin(distances))
+                if distances[nearest] < self.dedup_threshold:
+                    self._recent_last_seen[nearest] = now
+                    return None
+
+            remembered = np.asarray(encoding, dtype=np.float64)
+            self._recent_encodings.append(remembered)
+            self._recent_last_seen.append(now)
+            if len(self._recent_encodings) > self.max_recent:
+                del self._recent_encodings[0]
+                del self._recent_last_seen[0]
+            return remembered
+
+    def _forget(self, remembered):
+        """_remember() で記録したエンコーディングを取り消す (保存しなかった場合)"""
+        with self._recent_lock:
+            for i, recent in enumerate(self._recent_encodings):
+                if recent is remembered:
+                    del self._recent_encodings[i]
+                    del self._recent_last_seen[i]
+                    break
+
+    def _evict_still_visible(self):
+        """キューに積んだ後も映り続けている人物のうち、最後に見た時刻が最も新しいものをキューから外す (_pending_cond を持って呼ぶ)"""
+        with self._recent_lock:
+            last_seen = {id(e): t for e, t in zip(self._recent_encodings, self._recent_last_seen)}
+        victim = None
+        victim_seen = 0.0
+        for i, (_, queued_at, _, remembered) in enumerate(self._pending):
+            if remembered is None:
+                continue
+            seen = last_seen.get(id(remembered), queued_at)
+            if seen > queued_at and seen > victim_seen:
+                victim, victim_seen = i, seen
+        if victim is None:
+            return False
+        remembered = self._pending[victim][3]
+        del self._pending[victim]
+        self._forget(remembered)
+        self.evicted_count += 1
+        return True
+
+    def _crop(self, frame, location):
+        top, right, bottom, left = location
+        pad_y, pad_x = int((bottom - top) * self.padding), int((right - left) * self.padding)
+        height, width = frame.shape[:2]
+        return frame[max(top - pad_y, 0):min(bottom + pad_y, height), max(left - pad_x, 0):min(right + pad_x, width)].copy()
+
+    def submit(self, camera_id, frame, location, encoding):
+        """未知の顔を保存対象として登録する (待たない)。重複または保存できずに捨てた場合はFalseを返す"""
+        now = time.time()
+        remembered = None
+        if encoding is not None:
+            remembered = self._remember(encoding, now)
+            if remembered is None:
+                self.duplicate_count += 1
+                return False
+        item = (camera_id, now, self._crop(frame, location), remembered)
+        with self._pending_cond:
+            if len(self._pending) < self.queue_size or self._evict_still_visible():
+                self._pending.append(item)
+                self._pending_cond.notify()
+                return True
+        self.dropped_count += 1
+        if remembered is not None:
+            self._forget(remembered)
+        if now - self._last_drop_warning >= self.DROP_WARNING_INTERVAL:
+            self._last_drop_warning = now
+            if self._thread is None or not self._thread.is_alive():
+                self.logger.error("未知の顔の書き込みスレッドが動作していないため保存できません。")
+                return False
+            self.logger.warning(f"未知の顔の書き込みが追いつかないため保存しませんでした (累計 {self.dropped_count} 件)。")
+        return False
+
+    def _run(self):
+        while True:
+            with self._pending_cond:
+                if not self._pending:
+                    self._pending_cond.wait(timeout=0.5)
+                # まとめて書き出す
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            if not batch:
+                if self._stop_event.is_set():
+                    break
+                continue
+            for camera_id, timestamp, crop, _ in batch:
+                self._write(camera_id, timestamp, crop)
+
+    def _write(self, camera_id, timestamp, crop):
+        ok, jpeg = cv2.imencode(".jpg", crop)
+        if not ok:
+            self.logger.error("未知の顔のエンコードに失敗しました。")
+            return
+        stamp = datetime.fromtimestamp(timestamp).strftime("%Y%m%d_%H%M%S_%f")[:-3]
+        while True:
+            self._sequence += 1
+            filename = f"Unknown_{stamp}_{camera_id}_{self._sequence:06d}.jpg"
+            try:
+                # 既存のファイルは上書きしない
+                with open(os.path.join(self.faces_dir, filename), "xb") as f:
+                    f.write(jpeg.tobytes())
+                break
+            except FileExistsError:
+                continue
+            except OSError as e:
+                self.logger.error(f"未知の顔の保存に失敗しました: {e}")
+                return
+        self.saved_count += 1
+        self.logger.info(f"未知の顔を保存しました: {filename}")
+        if self.on_saved:
+            self.on_saved(camera_id, filename)
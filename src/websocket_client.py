@@ -0,0 +1,204 @@
+import threading
+import time
+import websocket
+
+
+class WebSocketClient:
+    """1台のカメラとのWebSocket接続を管理するクラス
+
+    切断時は指数バックオフで次の再接続時刻を決め、ConnectionManagerがその時刻に再接続する。
+    """
+    def __init__(self, url, on_message, on_error, on_close, on_open, logger, initial_backoff=0.5, max_backoff=30.0, on_disconnect=None):
+        self.url = url
+        self.on_message_callback = on_message
+        self.on_error_callback = on_error
+        self.on_close_callback = on_close
+        self.on_open_callback = on_open
+        self.on_disconnect_callback = on_disconnect
+        self.logger = logger
+        self.ws = None
+        self.thread = None
+        self.is_connected = False
+
+        # 再接続の状態
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.backoff = initial_backoff
+        self.next_attempt = None # 再接続を試みる時刻 (予定がなければNone)
+        self.should_connect = False # 接続を維持すべきかどうか (close() でFalseになる)
+        self.reconnect_count = 0
+
+    def _on_message(self, ws, message):
+        self.on_message_callback(ws, message)
+
+    def _on_error(self, ws, error):
+        self.is_connected = False
+        self.logger.error(f"WebSocketエラー (WebSocketClient {self.url}): {error}")
+        # GUI更新はAppクラスに任せる
+        self.on_error_callback(ws, error)
+        self._schedule_reconnect()
+
+    def _on_close(self, ws, close_status_code, close_msg):
+        self.is_connected = False
+        self.logger.warning(f"WebSocket接続が閉じられました ({self.url})。コード: {close_status_code}, メッセージ: {close_msg}")
+        # GUI更新はAppクラスに任せる
+        self.on_close_callback(ws, close_status_code, close_msg)
+        self._schedule_reconnect()
+
+    def _on_open(self, ws):
+        self.is_connected = True
+        self.backoff = self.initial_backoff
+        self.next_attempt = None
+        self.logger.info(f"WebSocketに接続しました ({self.url})。 (WebSocketClient._on_open)")
+        # GUI更新はAppクラスに任せる
+        self.on_open_callback(ws)
+
+    def _schedule_reconnect(self):
+        """次の再接続時刻を決める。エラーと切断が続けて通知されても一度だけ予約する"""
+        if not self.should_connect or self.next_attempt is not None:
+            return
+        self.next_attempt = time.monotonic() + self.backoff
+        self.logger.info(f"{self.backoff:.1f}秒後に再接続を試みます ({self.url})。")
+        self.backoff = min(self.backoff * 2, self.max_backoff)
+        if self.on_disconnect_callback:
+            self.on_disconnect_callback()
+
+    def connect(self):
+        self.should_connect = True
+        if self.ws and self.ws.keep_running:
+            self.logger.info("既にWebSocket接続処理が実行中です。")
+            if self.is_connected:
+                return
+            else:
+                self.logger.info("以前の接続はあったが、現在未接続のため再接続を試みます。")
+                if self.thread and self.thread.is_alive():
+                    try:
+                        self.ws.close()
+                        self.thread.join(timeout=2.0)
+                    except Exception as e:
+                        self.logger.error(f"既存WebSocketスレッドの終了待機中にエラー: {e}")
+
+        # 古い接続を閉じた際の再接続予約は取り消す
+        self.next_attempt = None
+        self.ws = websocket.WebSocketApp(
+            self.url,
+            on_message=self._on_message,
+            on_error=self._on_error,
+            on_close=self._on_close,
+            on_open=self._on_open
+        )
+        self.thread = threading.Thread(target=self.ws.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.logger.info(f"WebSocketクライアント接続処理を開始しました ({self.url})。")
+
+    def send(self, message):
+        if self.is_connected and self.ws and self.ws.sock and self.ws.sock.connected:
+            try:
+                self.ws.send(message)
+                self.logger.debug(f"WebSocketにメッセージを送信: {message}")
+            except Exception as e:
+                self.logger.error(f"WebSocket送信エラー: {e}")
+                self.is_connected = False
+                # GUI更新はAppクラスに任せる
+        else:
+            self.logger.warning(f"WebSocketが接続されていません ({self.url})。メッセージ '{message}' の送信をスキップします。")
+
+    def close(self):
+        self.should_connect = False
+        self.next_attempt = None
+        self.is_connected = False
+        if self.ws:
+            self.ws.close()
+            self.logger.info(f"WebSocketクライアント接続を閉じました ({self.url})。")
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=2.0)
+            if self.thread.is_alive():
+                self.logger.warning("WebSocketスレッドがタイムアウト後も終了していません。")
+            else:
+                self.logger.info("WebSocketスレッドを終了しました。")
+        self.ws = None
+        self.thread = None
+
+
+class ConnectionManager:
+    """複数カメラのWebSocket接続を管理するクラス
+
+    カメラごとに WebSocketClient を持ち、切断されたクライアントはそれぞれのバックオフ時刻に
+    1つの管理スレッドから再接続する (定期的なポーリングは行わない)。
+    """
+    def __init__(self, logger, initial_backoff=0.5, max_backoff=30.0):
+        self.logger = logger
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.clients = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def add(self, camera_id, url, on_message, on_error, on_close, on_open):
+        """カメラを追加する。コールバックは WebSocketClient と同じ引数で呼ばれる"""
+        self.clients[camera_id] = WebSocketClient(
+            url, on_message, on_error, on_close, on_open, self.logger,
+            initial_backoff=self.initial_backoff, max_backoff=self.max_backoff, on_disconnect=self._wake
+        )
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def is_connected(self, camera_id):
+        return self.clients[camera_id].is_connected
+
+    def connect_all(self):
+        """全カメラへの接続を開始し、再接続用の管理スレッドを起動する"""
+        for client in self.clients.values():
+            if not client.is_connected:
+                client.connect()
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="connection-manager", daemon=True)
+            self._thread.start()
+            self.logger.info("ConnectionManagerの再接続スレッドを開始しました。")
+
+    def send(self, camera_id, message):
+        client = self.clients.get(camera_id)
+        if client is None:
+            self.logger.error(f"不明なカメラです: {camera_id}")
+            return
+        client.send(message)
+
+    def _run(self):
+        """再接続予定時刻になったクライアントを再接続する"""
+        while True:
+            with self._cond:
+                if self._stopped:
+                    break
+                now = time.monotonic()
+                due = [c for c in self.clients.values() if c.should_connect and c.next_attempt is not None and c.next_attempt <= now]
+                if not due:
+                    pending = [c.next_attempt for c in self.clients.values() if c.should_connect and c.next_attempt is not None]
+                    self._cond.wait(max(min(pending) - now, 0) if pending else None)
+                    continue
+                for client in due:
+                    client.next_attempt = None
+
+            # 再接続中に他のクライアントのコールバックがブロックされないよう、ロックの外で接続する
+            for client in due:
+                self.logger.warning(f"WebSocketが切断されました。再接続を試みます ({client.url})...")
+                client.reconnect_count += 1
+                client.connect()
+        self.logger.info("ConnectionManagerの再接続スレッドが終了しました。")
+
+    def close_all(self):
+        """全カメラの接続を閉じ、管理スレッドを終了する"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for client in self.clients.values():
+            client.close()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=2.0)
+            if self._thread.is_alive():
+                self.logger.warning("ConnectionManagerの再接続スレッドがタイムアウト後も終了していません。")
+        self._thread = None
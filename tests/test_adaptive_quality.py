@@ -0,0 +1,86 @@
+import logging
+import adaptive_quality
+from adaptive_quality import AdaptiveQualityController
+
+
+class _FakeTime:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+def _controller(monkeypatch):
+    clock = _FakeTime()
+    monkeypatch.setattr(adaptive_quality, "time", clock)
+    applied = []
+    controller = AdaptiveQualityController(
+        lambda camera_id, fps: applied.append(("fps", fps)),
+        lambda camera_id, resolution: applied.append(("resolution", resolution)),
+        lambda camera_id: 0,
+        logging.getLogger("test"),
+        target_latency=0.2,
+        fps_steps=[5, 10, 15],
+        resolution_steps=["160x120", "320x240", "640x480"],
+        interval=1.0, window=3.0, settle_sec=3.0, up_hold=5, down_hold=2,
+    )
+    controller.add_camera("cam", 15, "640x480")
+    return controller, clock, applied
+
+
+def _tick(controller, clock, latency, count=1):
+    """1秒ずつ進めながら、遅延を記録して判断させる"""
+    for _ in range(count):
+        clock.now += 1.0
+        controller.observe("cam", latency)
+        controller.evaluate("cam")
+
+
+def _settle(controller, clock):
+    clock.now += controller.settle_sec
+
+
+def test_sustained_latency_over_target_steps_resolution_down(monkeypatch):
+    controller, clock, applied = _controller(monkeypatch)
+    _tick(controller, clock, 0.3)
+    assert applied == [] # down_hold 回続くまでは下げない
+    _tick(controller, clock, 0.3)
+    assert applied == [("resolution", "320x240")]
+    assert controller.current("cam") == (15, "320x240")
+
+    # 変更直後の settle_sec 秒は判断しない
+    _tick(controller, clock, 0.3, count=2)
+    assert applied == [("resolution", "320x240")]
+
+
+def test_step_up_waits_for_up_hold_good_evaluations(monkeypatch):
+    controller, clock, applied = _controller(monkeypatch)
+    _tick(controller, clock, 0.3, count=2)
+    _settle(controller, clock)
+
+    _tick(controller, clock, 0.01, count=4)
+    assert controller.current("cam") == (15, "320x240")
+    _tick(controller, clock, 0.01)
+    assert controller.current("cam") == (15, "640x480")
+    assert applied[-1] == ("resolution", "640x480")
+
+
+def test_failed_step_up_doubles_wait_before_next_step_up(monkeypatch):
+    controller, clock, applied = _controller(monkeypatch)
+    _tick(controller, clock, 0.3, count=2)
+    _settle(controller, clock)
+    _tick(controller, clock, 0.01, count=5)
+    assert controller.current("cam") == (15, "640x480")
+
+    # 戻した直後に処理が追いつかなくなった
+    _settle(controller, clock)
+    _tick(controller, clock, 0.3, count=2)
+    assert controller.current("cam") == (15, "320x240")
+
+    _settle(controller, clock)
+    _tick(controller, clock, 0.01, count=9)
+    assert controller.current("cam") == (15, "320x240")
+    _tick(controller, clock, 0.01)
+    assert controller.current("cam") == (15, "640x480")
+    assert controller.adjust_count == 4
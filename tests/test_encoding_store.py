@@ -0,0 +1,142 @@
+import os
+import logging
+import multiprocessing as mp
+import pathlib
+import numpy as np
+from encoding_store import EncodingStore, ENCODING_DIM
+
+logger = logging.getLogger("test")
+
+
+def _name_for(filename):
+    return filename.split("_")[0]
+
+
+def _fake_encode(filepath):
+    """ファイルの内容 (1バイト目) から決まるエンコーディング。内容が空なら顔なし"""
+    with open(filepath, "rb") as f:
+        data = f.read()
+    if not data:
+        return None
+    return np.full(ENCODING_DIM, float(data[0]))
+
+
+def _write(directory, filename, value):
+    with open(directory / filename, "wb") as f:
+        f.write(bytes([value]) if value is not None else b"")
+
+
+def test_sync_empty_faces_dir_without_cache_returns_empty_array(tmp_path):
+    faces_dir = tmp_path / "faces"
+    faces_dir.mkdir()
+    store = EncodingStore(str(tmp_path / "cache"), logger)
+
+    encodings, names = store.sync(str(faces_dir), [], _name_for, _fake_encode)
+
+    assert encodings is not None
+    assert encodings.shape == (0, ENCODING_DIM)
+    assert names == []
+    # 2回目 (空のキャッシュがある場合) も同じ
+    encodings, names = store.sync(str(faces_dir), [], _name_for, _fake_encode)
+    assert encodings.shape == (0, ENCODING_DIM)
+    assert names == []
+
+
+def test_sync_reuses_cache_and_skips_images_without_face(tmp_path):
+    faces_dir = tmp_path / "faces"
+    faces_dir.mkdir()
+    _write(faces_dir, "alice_1.jpg", 1)
+    _write(faces_dir, "bob_1.jpg", 2)
+    _write(faces_dir, "carol_1.jpg", None)
+    filenames = ["alice_1.jpg", "bob_1.jpg", "carol_1.jpg"]
+    store = EncodingStore(str(tmp_path / "cache"), logger)
+    store.sync(str(faces_dir), filenames, _name_for, _fake_encode)
+
+    def fail(filepath):
+        raise AssertionError(f"再エンコードされました: {filepath}")
+
+    encodings, names = store.sync(str(faces_dir), filenames, _name_for, fail)
+
+    assert names == ["alice", "bob"]
+    assert [float(e[0]) for e in encodings] == [1.0, 2.0]
+
+
+def _added(directory, filename, value):
+    """enroll.py と同じく、ファイルを置いてキャッシュに追加するための items の要素を作る"""
+    _write(directory, filename, value)
+    filepath = str(directory / filename)
+    return (filename, _name_for(filename), _fake_encode(filepath), os.stat(filepath), EncodingStore.file_hash(filepath))
+
+
+def test_add_out_of_order_keeps_names_aligned_with_encodings(tmp_path):
+    faces_dir = tmp_path / "faces"
+    faces_dir.mkdir()
+    store = EncodingStore(str(tmp_path / "cache"), logger)
+    # 並列登録では処理が終わった順 (ファイル名順ではない) に追加される
+    store.add([_added(faces_dir, "zed_1.jpg", 26), _added(faces_dir, "mia_1.jpg", 13)])
+    store.add([_added(faces_dir, "adam_1.jpg", 1)])
+    filenames = ["adam_1.jpg", "mia_1.jpg", "zed_1.jpg"]
+
+    def fail(filepath):
+        raise AssertionError(f"再エンコードされました: {filepath}")
+
+    expected = {"adam": 1.0, "mia": 13.0, "zed": 26.0}
+    for encodings, names in (store.sync(str(faces_dir), filenames, _name_for, fail), store.load_cached()):
+        assert sorted(names) == sorted(expected)
+        for name, encoding in zip(names, encodings):
+            assert float(encoding[0]) == expected[name]
+
+
+def test_sync_realigns_cache_written_out_of_filename_order(tmp_path):
+    faces_dir = tmp_path / "faces"
+    faces_dir.mkdir()
+    store = EncodingStore(str(tmp_path / "cache"), logger)
+    store.sync(str(faces_dir), [], _name_for, _fake_encode)
+    # 行がファイル名順に並んでいないキャッシュ (以前の add() が書いたもの)
+    items = [_added(faces_dir, "zed_1.jpg", 26), _added(faces_dir, "adam_1.jpg", 1)]
+    entries = {}
+    for row, (filename, name, encoding, st, digest) in enumerate(items):
+        entries[filename] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha256": digest, "name": name, "row": row}
+    store._write_cache(entries, np.asarray([item[2] for item in items]))
+
+    encodings, names = store.sync(str(faces_dir), ["adam_1.jpg", "zed_1.jpg"], _name_for, _fake_encode)
+
+    assert names == ["adam", "zed"]
+    assert [float(e[0]) for e in encodings] == [1.0, 26.0]
+    encodings, names = store.load_cached()
+    assert names == ["adam", "zed"]
+    assert [float(e[0]) for e in encodings] == [1.0, 26.0]
+
+
+def _add_one_by_one(cache_dir, faces_dir, prefix, count):
+    """別のプロセスから1件ずつキャッシュに追加する (読み込みから書き込みまでが排他されていないと追加が失われる)"""
+    store = EncodingStore(cache_dir, logger)
+    for i in range(count):
+        store.add([_added(pathlib.Path(faces_dir), f"{prefix}_{i}.jpg", i + 1)])
+
+
+def test_concurrent_adds_from_processes_are_not_lost(tmp_path):
+    faces_dir = tmp_path / "faces"
+    faces_dir.mkdir()
+    cache_dir = str(tmp_path / "cache")
+    ctx = mp.get_context("spawn")
+    processes = [ctx.Process(target=_add_one_by_one, args=(cache_dir, str(faces_dir), prefix, 20)) for prefix in ("a", "b")]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    encodings, names = EncodingStore(cache_dir, logger).load_cached()
+
+    assert sorted(names) == ["a"] * 20 + ["b"] * 20
+
+
+def test_locked_can_be_nested_around_add_and_sync(tmp_path):
+    faces_dir = tmp_path / "faces"
+    faces_dir.mkdir()
+    store = EncodingStore(str(tmp_path / "cache"), logger)
+    with store.locked():
+        store.add([_added(faces_dir, "adam_1.jpg", 1)])
+        encodings, names = store.sync(str(faces_dir), ["adam_1.jpg"], _name_for, _fake_encode)
+    assert names == ["adam"]
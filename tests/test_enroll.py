@@ -0,0 +1,28 @@
+import os
+from enroll import plan_filenames
+
+
+def _paths(source_dir, *relatives):
+    return [os.path.join(source_dir, *relative.split("/")) for relative in relatives]
+
+
+def test_plan_filenames_takes_name_from_subdirectory_or_prefix():
+    paths = _paths("photos", "yamada/001.jpg", "sato_2.JPG", "Unknown_1.jpg", "a_b/1.jpg")
+
+    plans = plan_filenames("photos", paths)
+
+    assert plans[0] == ("yamada", "yamada_001.jpg")
+    assert plans[1] == ("sato", "sato_2.jpg")
+    assert plans[2][0] is None
+    assert plans[3][0] is None
+
+
+def test_plan_filenames_never_reuses_batch_or_existing_names():
+    paths = _paths("photos", "yamada/1.jpg", "yamada_1.jpg", "yamada_1.JPG", "sato/1.png")
+    existing = ["Yamada_1.jpg", "yamada_1-2.jpg", "sato_1.png"]
+
+    plans = plan_filenames("photos", paths, existing)
+
+    filenames = [filename for _, filename in plans]
+    assert filenames == ["yamada_1-3.jpg", "yamada_1-4.jpg", "yamada_1-5.jpg", "sato_1-2.png"]
+    assert not {f.lower() for f in filenames} & {f.lower() for f in existing}
@@ -0,0 +1,43 @@
+import numpy as np
+from face_gallery import FaceGallery, UNKNOWN_NAME
+
+
+def _encodings(count, seed=0):
+    rng = np.random.default_rng(seed)
+    encodings = rng.normal(size=(count, 128)).astype(np.float32)
+    return encodings / np.linalg.norm(encodings, axis=1, keepdims=True)
+
+
+def test_exact_match_returns_nearest_name_within_threshold():
+    encodings = _encodings(10)
+    names = [f"p{i}" for i in range(10)]
+    gallery = FaceGallery(encodings, names, threshold=0.5)
+
+    results = gallery.match([encodings[3], -encodings[3]])
+
+    assert results[0][0] == "p3"
+    assert results[0][1] < 1e-3
+    assert results[1][0] == UNKNOWN_NAME
+
+
+def test_ivf_match_agrees_with_exact_for_registered_faces():
+    encodings = _encodings(400)
+    names = [f"p{i}" for i in range(400)]
+    gallery = FaceGallery(encodings, names, threshold=0.5, ann_threshold=100, ann_probes=4)
+    assert gallery.uses_ann
+
+    results = gallery.match(encodings[:20])
+
+    assert [name for name, _ in results] == names[:20]
+
+
+def test_ivf_match_with_only_empty_lists_probed_is_no_match():
+    encodings = _encodings(400)
+    names = [f"p{i}" for i in range(400)]
+    gallery = FaceGallery(encodings, names, threshold=0.5, ann_threshold=100, ann_probes=4)
+    # k-meansで空になったクラスタだけが探索される状況を作る
+    gallery.list_offsets = np.zeros_like(gallery.list_offsets)
+
+    results = gallery.match(encodings[:3])
+
+    assert results == [(UNKNOWN_NAME, None)] * 3
@@ -0,0 +1,45 @@
+from frame_buffers import FramePool, read_only
+
+
+def test_acquire_reuses_released_buffer():
+    pool = FramePool(max_per_shape=2)
+    first = pool.acquire((4, 3, 3))
+    first_id = id(first)
+    del first
+    second = pool.acquire((4, 3, 3))
+    assert id(second) == first_id
+    assert pool.allocated_count == 1
+
+
+def test_buffer_held_through_slice_or_read_only_view_is_not_handed_out():
+    pool = FramePool(max_per_shape=4)
+    frame = pool.acquire((4, 3, 3))
+    face = frame[1:3, 1:2]
+    view = read_only(frame)
+    frame_id = id(frame)
+    del frame
+
+    other = pool.acquire((4, 3, 3))
+    assert id(other) != frame_id
+    del other
+    assert pool.stats()["4x3x3"] == {"allocated": 2, "in_use": 1}
+
+    # スライスを手放してもビューが残っている間は使用中
+    del face
+    assert id(pool.acquire((4, 3, 3))) != frame_id
+    del view
+    assert pool.stats()["4x3x3"]["in_use"] == 0
+    assert id(pool.acquire((4, 3, 3))) == frame_id
+
+
+def test_acquire_allocates_outside_pool_when_all_buffers_are_in_use():
+    pool = FramePool(max_per_shape=2)
+    held = [pool.acquire((2, 2, 3)), pool.acquire((2, 2, 3))]
+    extra = pool.acquire((2, 2, 3))
+    assert pool.overflow_count == 1
+    assert pool.allocated_count == 2
+    assert all(extra is not buffer for buffer in held)
+    # 別の形は別に数える
+    pool.acquire((3, 2, 3))
+    assert pool.overflow_count == 1
+    assert pool.stats()["2x2x3"] == {"allocated": 2, "in_use": 2}
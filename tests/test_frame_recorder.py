@@ -0,0 +1,15 @@
+from frame_recorder import FrameRecorder, read_frames
+
+
+def test_recorded_frames_are_read_back_in_order(tmp_path):
+    path = str(tmp_path / "cam0.frames")
+    recorder = FrameRecorder(path)
+    frames = [(1000.0 + i, bytes([i]) * (i + 1)) for i in range(50)]
+    for timestamp, jpeg_bytes in frames:
+        recorder.write(jpeg_bytes, timestamp)
+    recorder.close()
+    recorder.write(b"after close", 2000.0) # 閉じた後の書き込みは無視される
+
+    assert list(read_frames(path)) == frames
+    assert recorder.frame_count == 50
+    assert recorder.dropped_count == 0
@@ -0,0 +1,65 @@
+import logging
+from logging_handlers import TkinterHandler
+
+
+class _FakeText:
+    """TkinterHandlerが使う分だけのTextウィジェットの代わり (行のリストで持つ)"""
+    def __init__(self):
+        self.lines = []
+
+    def config(self, **kwargs):
+        pass
+
+    def insert(self, index, text):
+        self.lines.extend(text.split("\n")[:-1])
+
+    def delete(self, start, end):
+        if start == "end-2l linestart":
+            del self.lines[-1]
+        else:
+            del self.lines[:int(end.split(".")[0]) - 1]
+
+    def index(self, index):
+        return f"{len(self.lines) + 1}.0"
+
+    def yview(self, *args):
+        pass
+
+
+def _record(level, message, name="app", created=1000.0):
+    record = logging.LogRecord(name, level, __file__, 0, message, None, None)
+    record.created = created
+    return record
+
+
+def _handler(**kwargs):
+    widget = _FakeText()
+    handler = TkinterHandler(widget, **kwargs)
+    handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+    return handler, widget
+
+
+def test_repeated_message_is_coalesced_across_drains():
+    handler, widget = _handler()
+    for _ in range(3):
+        handler.emit(_record(logging.INFO, "顔を検出しました: X"))
+    handler.drain_to_widget()
+    handler.emit(_record(logging.INFO, "顔を検出しました: X"))
+    handler.drain_to_widget()
+
+    assert widget.lines == ["INFO 顔を検出しました: X ×4"]
+
+
+def test_warnings_are_not_suppressed_by_info_flood():
+    handler, widget = _handler(rate=1.0, burst=2)
+    for i in range(10):
+        handler.emit(_record(logging.INFO, f"info {i}"))
+    handler.emit(_record(logging.WARNING, "warning"))
+    handler.emit(_record(logging.ERROR, "error"))
+    handler.drain_to_widget()
+
+    assert widget.lines[:2] == ["INFO info 0", "INFO info 1"]
+    assert "WARNING warning" in widget.lines
+    assert "ERROR error" in widget.lines
+    assert handler.suppressed_count == 8
+    assert any("8 件を表示しませんでした" in line for line in widget.lines)
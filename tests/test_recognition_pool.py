@@ -0,0 +1,125 @@
+import os
+import time
+import logging
+import threading
+import numpy as np
+from recognition_pool import RecognitionPool
+
+logger = logging.getLogger("test")
+
+
+def _fake_worker_main(slot_names, gallery, recognizer_options, task_queue, result_queue, gallery_queue,
+                      batch_size=1, batch_wait=0.0):
+    """カメラIDに応じて、結果を返す・異常終了する・応答しなくなるワーカー (dlibを使わない)"""
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        seq, slot_index, _, camera_id = task
+        if camera_id == "crash":
+            # 送信済みの結果は親プロセスに届けてから異常終了する
+            result_queue.close()
+            result_queue.join_thread()
+            os._exit(3)
+        if camera_id == "hang":
+            time.sleep(3600)
+        result_queue.put((seq, slot_index, [camera_id], None, [], (0, 0)))
+
+
+class _FakePool(RecognitionPool):
+    SLOTS_PER_WORKER = 3
+    RESTART_INTERVAL = 0.1
+    CHECK_INTERVAL = 0.1
+
+    def _worker_target(self):
+        return _fake_worker_main
+
+
+class _Recorder:
+    def __init__(self):
+        self.results = []
+        self.skipped = []
+        self.contexts = []
+        self.lock = threading.Lock()
+
+    def on_result(self, camera_id, frame, results, context):
+        with self.lock:
+            self.results.append(camera_id)
+            self.contexts.append(context)
+
+    def on_skipped(self, camera_id, frame, context):
+        with self.lock:
+            self.skipped.append(camera_id)
+            self.contexts.append(context)
+
+    def wait_for(self, count, timeout=20.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if len(self.results) + len(self.skipped) >= count:
+                    return True
+            time.sleep(0.02)
+        return False
+
+
+def _pool(recorder, **kwargs):
+    pool = _FakePool(1, None, recorder.on_result, logger, 64, on_skipped=recorder.on_skipped, **kwargs)
+    pool.start()
+    return pool
+
+
+def _submit(pool, camera_id):
+    return pool.submit(camera_id, np.zeros((2, 2, 3), dtype=np.uint8), timeout=5.0, context=(camera_id, "key"))
+
+
+def test_dead_worker_frames_are_skipped_and_later_frames_delivered():
+    recorder = _Recorder()
+    pool = _pool(recorder)
+    try:
+        assert _submit(pool, "a")
+        assert _submit(pool, "crash")
+        assert _submit(pool, "b") # 異常終了したワーカーのキューに残るため飛ばされる
+        assert recorder.wait_for(3)
+        assert recorder.results == ["a"]
+        assert recorder.skipped == ["crash", "b"]
+        # submit() に渡した値が結果・飛ばしたフレームと一緒に返る
+        assert recorder.contexts == [("a", "key"), ("crash", "key"), ("b", "key")]
+
+        # 起動し直したワーカーで処理が続く (スロットも解放されている)
+        for camera_id in ("c", "d", "e"):
+            assert _submit(pool, camera_id)
+        assert recorder.wait_for(6)
+        assert recorder.results == ["a", "c", "d", "e"]
+        assert pool.skipped_count == 2
+        assert pool.restart_count >= 1
+        assert pool.pending_count() == 0
+    finally:
+        pool.stop()
+
+
+def test_unresponsive_worker_is_terminated_after_timeout():
+    recorder = _Recorder()
+    pool = _pool(recorder, result_timeout=1.0)
+    try:
+        assert _submit(pool, "hang")
+        assert recorder.wait_for(1)
+        assert recorder.skipped == ["hang"]
+        assert _submit(pool, "after")
+        assert recorder.wait_for(2)
+        assert recorder.results == ["after"]
+    finally:
+        pool.stop()
+
+
+def test_submit_does_not_block_when_no_slot_is_free():
+    recorder = _Recorder()
+    pool = _pool(recorder, result_timeout=60.0)
+    try:
+        # 1ワーカー分のスロットを応答しないフレームで埋める
+        for _ in range(pool.SLOTS_PER_WORKER):
+            assert _submit(pool, "hang")
+        start = time.monotonic()
+        assert not pool.submit("x", np.zeros((2, 2, 3), dtype=np.uint8), timeout=0.2)
+        assert time.monotonic() - start < 2.0
+    finally:
+        pool.stop()
@@ -0,0 +1,41 @@
+import logging
+from contextlib import contextmanager
+import numpy as np
+import pytest
+from config import AppConfig
+from face_gallery import FaceGallery
+from recognition_service import RecognitionService
+
+
+class _FailingStore:
+    @contextmanager
+    def locked(self):
+        yield
+
+    def sync(self, faces_dir, filenames, name_for, encode_file):
+        raise OSError("disk error")
+
+
+def _service(tmp_path, monkeypatch):
+    """reload_gallery() に必要な属性だけを持つサービス (カメラ接続やスレッドは作らない)"""
+    monkeypatch.setattr(AppConfig, "FACES_DIR", str(tmp_path))
+    service = RecognitionService.__new__(RecognitionService)
+    service.logger = logging.getLogger("test")
+    service.encoding_store = _FailingStore()
+    service.known_face_encodings = np.ones((1, 128))
+    service.known_face_names = ["alice"]
+    service.gallery = FaceGallery(service.known_face_encodings, service.known_face_names, 0.5)
+    service.recognizers = {}
+    service.frame_cache = None
+    service.recognition_pool = None
+    return service
+
+
+def test_reload_gallery_keeps_previous_gallery_when_sync_fails(tmp_path, monkeypatch):
+    service = _service(tmp_path, monkeypatch)
+    gallery = service.gallery
+    with pytest.raises(OSError):
+        service.reload_gallery()
+    assert service.gallery is gallery
+    assert service.known_face_names == ["alice"]
+    assert service.known_face_encodings.shape == (1, 128)
@@ -0,0 +1,62 @@
+import numpy as np
+import result_cache
+from result_cache import ResultCache, face_hash
+
+
+class _FakeTime:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_put_evicts_least_recently_used_entry():
+    cache = ResultCache(2, ttl=60.0)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1 # a が最近使われたので b が捨てられる
+    cache.put("c", 3)
+    assert cache.peek("b") is None
+    assert cache.peek("a") == 1 and cache.peek("c") == 3
+    assert len(cache) == 2
+    assert cache.evictions == 1
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = _FakeTime()
+    monkeypatch.setattr(result_cache, "time", clock)
+    cache = ResultCache(4, ttl=10.0)
+    cache.put("a", 1)
+    clock.now += 9.9
+    assert cache.get("a") == 1
+    clock.now += 0.1
+    assert cache.get("a") is None
+    assert len(cache) == 0 # 期限切れの値は捨てる
+
+
+def test_get_counts_hits_and_misses_but_peek_does_not():
+    cache = ResultCache(4, ttl=60.0)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.peek("a") == 1
+    assert cache.peek("b") is None
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_get_treats_unverified_value_as_miss():
+    cache = ResultCache(4, ttl=60.0)
+    cache.put("a", ("alice", (0, 40, 40, 0)))
+    assert cache.get("a", lambda value: value[1] == (0, 140, 40, 100)) is None
+    assert cache.get("a", lambda value: value[1] == (0, 40, 40, 0)) == ("alice", (0, 40, 40, 0))
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert len(cache) == 1
+
+
+def test_face_hash_ignores_small_brightness_changes():
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 200, (60, 60, 3), dtype=np.uint8)
+    location = (10, 50, 50, 10)
+    assert face_hash(frame, location) == face_hash(frame + 10, location)
+    assert face_hash(frame, (0, 10, 0, 0)) is None
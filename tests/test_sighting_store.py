@@ -0,0 +1,76 @@
+import time
+import logging
+from sighting_store import SightingStore
+
+logger = logging.getLogger("test")
+BOX = (10, 50, 50, 10)
+
+
+def _now():
+    """現在時刻 (整数秒にして、時刻の差を正確に比べられるようにする)"""
+    return float(int(time.time()))
+
+
+def _store(path, **kwargs):
+    store = SightingStore(str(path), logger, flush_interval=0.05, **kwargs)
+    store.start()
+    return store
+
+
+def _record_all(store, detections):
+    for name, camera_id, timestamp, distance in detections:
+        assert store.record(name, camera_id, timestamp, BOX, distance)
+    store.stop()
+
+
+def test_detections_are_merged_into_visits_and_split_by_gap(tmp_path):
+    base = _now()
+    store = _store(tmp_path / "sightings.db", gap_sec=10.0, min_interval=1.0)
+    detections = [("alice", "cam0", base + i * 0.5, 0.4 - i * 0.01) for i in range(11)] # 5秒間に11回
+    detections.append(("bob", "cam0", base + 1.0, 0.3))
+    detections.append(("alice", "cam1", base + 2.0, 0.35)) # 別のカメラは別の訪問
+    detections.append(("alice", "cam0", base + 30.0, 0.45)) # gap_sec より空いたので新しい訪問
+    _record_all(store, detections)
+
+    visits = store.visits_between(base - 1, base + 60)
+
+    summary = [(v["name"], v["camera"], v["start_time"] - base, v["end_time"] - base, v["detections"]) for v in visits]
+    assert summary == [
+        ("alice", "cam0", 0.0, 5.0, 11),
+        ("bob", "cam0", 1.0, 1.0, 1),
+        ("alice", "cam1", 2.0, 2.0, 1),
+        ("alice", "cam0", 30.0, 30.0, 1),
+    ]
+    assert visits[0]["min_distance"] == min(d for n, c, t, d in detections[:11])
+    # 検出ごとの記録は訪問の中で min_interval 秒に1件まで
+    sightings = store.sightings_between(base - 1, base + 60, name="alice")
+    assert [s["timestamp"] - base for s in sightings if s["camera"] == "cam0"] == [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 30.0]
+    assert store.written_count == len(detections)
+
+
+def test_visits_are_split_at_max_visit_sec(tmp_path):
+    base = _now()
+    store = _store(tmp_path / "sightings.db", gap_sec=10.0, max_visit_sec=5.0)
+    _record_all(store, [("alice", "cam0", base + i, None) for i in range(13)])
+
+    visits = store.visits_between(base - 1, base + 60)
+
+    assert [(v["start_time"] - base, v["end_time"] - base) for v in visits] == [(0.0, 5.0), (6.0, 11.0), (12.0, 12.0)]
+    assert all(v["min_distance"] is None for v in visits)
+    # 期間の途中だけを指定しても重なる訪問が見つかる
+    assert [v["start_time"] - base for v in store.visits_between(base + 8, base + 9)] == [6.0]
+
+
+def test_visit_continues_after_restart(tmp_path):
+    path = tmp_path / "sightings.db"
+    base = _now()
+    _record_all(_store(path), [("alice", "cam0", base, 0.4)])
+    store = _store(path)
+    _record_all(store, [("alice", "cam0", base + 3.0, 0.3)])
+
+    visits = store.visits_between(base - 1, base + 60)
+
+    assert len(visits) == 1
+    assert visits[0]["end_time"] - base == 3.0
+    assert visits[0]["detections"] == 2
+    assert visits[0]["min_distance"] == 0.3
@@ -0,0 +1,38 @@
+import numpy as np
+from tracker import FaceTracker, iou
+
+
+def test_iou():
+    assert iou((0, 10, 10, 0), (0, 10, 10, 0)) == 1.0
+    assert iou((0, 10, 10, 0), (0, 20, 10, 10)) == 0.0
+    assert iou((0, 10, 10, 0), (0, 15, 10, 5)) == 50 / 150
+
+
+def test_update_keeps_track_and_identity_for_overlapping_face():
+    tracker = FaceTracker(reverify_interval=3)
+    first, = tracker.update([(0, 40, 40, 0)])
+    assert first.needs_encoding
+    first.set_identity("alice", 0.3, np.zeros(128))
+
+    second, = tracker.update([(2, 42, 42, 2)])
+    third, = tracker.update([(4, 44, 44, 4)])
+    assert second is first and third is first
+    assert third.name == "alice" and not third.needs_encoding
+
+    # reverify_interval フレームごとにエンコードし直す
+    fourth, = tracker.update([(6, 46, 46, 6)])
+    assert fourth is first
+    assert fourth.needs_encoding
+
+
+def test_update_assigns_each_track_once_and_drops_missing_tracks():
+    tracker = FaceTracker(max_missed=1)
+    a, b = tracker.update([(0, 40, 40, 0), (0, 140, 40, 100)])
+    # 2つの検出がどちらも a に重なる場合は、IoUの大きい方だけが a を引き継ぐ
+    near, nearer = tracker.update([(0, 50, 40, 10), (0, 42, 40, 2)])
+    assert nearer is a
+    assert near is not a and near is not b
+
+    tracker.update([(0, 42, 40, 2)])
+    assert b not in tracker.tracks # 2フレーム続けて見つからなかった
+    assert a in tracker.tracks
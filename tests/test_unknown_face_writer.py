@@ -0,0 +1,68 @@
+import time
+import logging
+import numpy as np
+from unknown_face_writer import UnknownFaceWriter
+
+logger = logging.getLogger("test")
+
+
+def _submit(writer, value):
+    frame = np.zeros((40, 40, 3), dtype=np.uint8)
+    return writer.submit("cam", frame, (10, 30, 30, 10), np.full(128, value))
+
+
+def test_submit_drops_without_blocking_when_queue_is_full(tmp_path):
+    # 書き込みスレッドを起動しないので、キューは空かない
+    writer = UnknownFaceWriter(str(tmp_path), logger, queue_size=1)
+
+    assert _submit(writer, 0.0)
+    start = time.monotonic()
+    assert not _submit(writer, 1.0)
+    assert time.monotonic() - start < 0.5
+    assert writer.dropped_count == 1
+    assert writer.duplicate_count == 0
+
+
+def test_dropped_face_is_not_remembered_as_saved(tmp_path):
+    writer = UnknownFaceWriter(str(tmp_path), logger, queue_size=1)
+    assert _submit(writer, 0.0)
+    assert not _submit(writer, 1.0)
+
+    # 書き込まれた後に同じ人物が映ったら、重複扱いせずに保存する
+    writer.start()
+    try:
+        deadline = time.monotonic() + 5.0
+        while writer.saved_count < 1 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert _submit(writer, 1.0)
+        assert not _submit(writer, 0.0) # 保存した人物は重複として捨てる
+        assert writer.duplicate_count == 1
+    finally:
+        writer.stop()
+    assert writer.saved_count == 2
+
+
+def test_full_queue_makes_room_for_unseen_person_by_evicting_one_still_in_view(tmp_path):
+    writer = UnknownFaceWriter(str(tmp_path), logger, queue_size=1)
+    assert _submit(writer, 0.0)
+    time.sleep(0.01)
+    assert not _submit(writer, 0.0) # まだ映っている (重複)
+
+    # 一度しか映らない人物のために、映り続けている人物をキューから外す
+    assert _submit(writer, 1.0)
+    assert writer.evicted_count == 1
+    assert writer.dropped_count == 0
+    # 外した人物は保存済みとして覚えていないので、次に映った時にまた積もうとする
+    assert not _submit(writer, 0.0)
+    assert writer.dropped_count == 1 # 1.0 は積んだ後に映っていないため外せない
+    assert writer.duplicate_count == 1
+
+    writer.start()
+    try:
+        deadline = time.monotonic() + 5.0
+        while writer.saved_count < 1 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert _submit(writer, 0.0)
+    finally:
+        writer.stop()
+    assert writer.saved_count == 2